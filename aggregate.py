@@ -0,0 +1,233 @@
+# aggregate.py - Rolling window of the spots of each DX station
+
+
+import collections
+import heapq
+import time
+
+from filters import bandOf
+
+
+
+AGGREGATE_HEADER = ("DX        band     freq  mode  skim  best  med  wpm  "
+                    "last   dist to me")
+
+# SNR histogram range in dB, values outside are counted at the ends
+SNR_MIN = -30
+SNR_MAX = 69
+
+
+def aggregateLine(activity):
+    # Display line of the spots of one DX station on one band
+    best = activity.bestSNR()
+    median = activity.medianSNR()
+    wpm = activity.meanWPM()
+
+    line = (f"{activity.call:8s}  {activity.band or '':>4s}  "
+            f"{activity.freq:>7.1f}  {activity.mode:4s}  "
+            f"{len(activity.skimmers):>4d}  "
+            f"{'' if best is None else best:>4}  "
+            f"{'' if median is None else median:>3}  "
+            f"{'' if wpm is None else round(wpm):>3}  "
+            f"{activity.time:5s}")
+
+    if activity.miles is not None:
+        line += f"  {round(activity.miles):5} mi"
+
+    dxCallData = activity.dxCallData or {}
+    if 'state' in dxCallData:
+        line += f"  {dxCallData['state']}"
+    elif 'country' in dxCallData:
+        line += f"  {dxCallData['country']}"
+
+    return line
+
+
+
+class DxActivity:
+    """The spots of one DX station on one band within the window: the
+    skimmers hearing it, a histogram of their SNRs and the sum of their
+    WPMs. Adding and expiring a spot are O(1), the best and median SNR
+    scan the histogram, whose size does not depend on the number of
+    spots."""
+
+    __slots__ = ('call', 'band', 'freq', 'mode', 'time', 'lastHeard',
+                 'dxCallData', 'miles', 'color', 'skimmers', 'spots',
+                 'snrCounts', 'snrSpots', 'wpmSum', 'wpmSpots')
+
+    def __init__(self, call, band):
+        self.call = call
+        self.band = band
+        self.freq = 0.0
+        self.mode = ""
+        self.time = ""
+        self.lastHeard = 0.0
+        self.dxCallData = None
+        self.miles = None
+        self.color = ""
+
+        # spots in the window per skimmer
+        self.skimmers = {}
+        self.spots = 0
+
+        self.snrCounts = [0] * (SNR_MAX - SNR_MIN + 1)
+        self.snrSpots = 0
+        self.wpmSum = 0
+        self.wpmSpots = 0
+
+
+    def add(self, de, snr, wpm):
+        self.skimmers[de] = self.skimmers.get(de, 0) + 1
+        self.spots += 1
+
+        if snr is not None:
+            self.snrCounts[min(SNR_MAX, max(SNR_MIN, snr)) - SNR_MIN] += 1
+            self.snrSpots += 1
+
+        if wpm is not None:
+            self.wpmSum += wpm
+            self.wpmSpots += 1
+
+
+    def remove(self, de, snr, wpm):
+        count = self.skimmers[de] - 1
+        if count:
+            self.skimmers[de] = count
+        else:
+            del self.skimmers[de]
+        self.spots -= 1
+
+        if snr is not None:
+            self.snrCounts[min(SNR_MAX, max(SNR_MIN, snr)) - SNR_MIN] -= 1
+            self.snrSpots -= 1
+
+        if wpm is not None:
+            self.wpmSum -= wpm
+            self.wpmSpots -= 1
+
+
+    def bestSNR(self):
+        if not self.snrSpots:
+            return None
+
+        for i in range(len(self.snrCounts) - 1, -1, -1):
+            if self.snrCounts[i]:
+                return i + SNR_MIN
+
+
+    def medianSNR(self):
+        # the lower median, an SNR the skimmers actually reported
+        if not self.snrSpots:
+            return None
+
+        seen = 0
+        middle = (self.snrSpots + 1) // 2
+        for i, count in enumerate(self.snrCounts):
+            seen += count
+            if seen >= middle:
+                return i + SNR_MIN
+
+
+    def meanWPM(self):
+        if not self.wpmSpots:
+            return None
+
+        return self.wpmSum / self.wpmSpots
+
+
+
+class SpotAggregator:
+    """Collects the spots shown into one DxActivity per DX station and
+    band, over a rolling window of window seconds. The spots are kept in
+    arrival order in a ring buffer from which they expire, each spot
+    added and expired in O(1), so the aggregator keeps up with contest
+    rates. At most maxSpots spots are kept, the oldest are expired early
+    beyond that.
+
+    The window is measured in spot times (Spot.timestamp), and expires
+    as the latest spot time seen advances, so a replay run faster than
+    real time aggregates the spots of each window of the capture rather
+    than of the whole file.
+
+    version changes whenever the activities change, so a display only
+    has to redraw them when it does."""
+
+    def __init__(self, window=300, maxSpots=200000):
+        self.window = window
+        self.maxSpots = maxSpots
+
+        self.activities = {}
+        self._ring = collections.deque()
+
+        # latest spot time seen
+        self.now = None
+
+        self.version = 0
+
+
+    def add(self, spot, dxCallData, miles=None, color="", now=None):
+        # now is the time of the spot, by default its timestamp
+        if now is None:
+            now = spot.timestamp
+        if now is None:
+            now = time.time()
+
+        if self.now is None or now > self.now:
+            self.now = now
+
+        self.expire()
+        if len(self._ring) >= self.maxSpots:
+            self._expireOldest()
+
+        band = bandOf(spot.freq)
+        key = (spot.dx, band)
+        activity = self.activities.get(key)
+        if activity is None:
+            activity = DxActivity(spot.dx, band)
+            self.activities[key] = activity
+
+        activity.add(spot.de, spot.snr, spot.wpm)
+        activity.freq = spot.freq
+        activity.mode = spot.mode
+        activity.time = spot.time or ""
+        activity.lastHeard = time.monotonic()
+        activity.dxCallData = dxCallData
+        activity.miles = miles
+        activity.color = color
+
+        self._ring.append((now, key, spot.de, spot.snr, spot.wpm))
+        self.version += 1
+
+
+    def expire(self, now=None):
+        # Drop the spots older than the window before now, by default
+        # the latest spot time seen, and the stations left without spots
+        if now is None:
+            now = self.now
+        if now is None:
+            return
+
+        oldest = now - self.window
+        ring = self._ring
+        while ring and ring[0][0] <= oldest:
+            self._expireOldest()
+
+
+    def _expireOldest(self):
+        heard, key, de, snr, wpm = self._ring.popleft()
+        activity = self.activities[key]
+        activity.remove(de, snr, wpm)
+        if not activity.spots:
+            del self.activities[key]
+
+        self.version += 1
+
+
+    def latest(self, count):
+        # The count stations heard most recently, newest first
+        return heapq.nlargest(count, self.activities.values(),
+                              key=lambda a: a.lastHeard)
+
+
+    def __len__(self):
+        return len(self.activities)
@@ -0,0 +1,241 @@
+# archive.py - Compact binary archive of RBN spots, read memory-mapped
+
+
+import os
+import struct
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from spot import spotTimestamp
+
+
+
+# File header: magic, version and record size
+ARCHIVE_MAGIC = b'RBNSPOTS'
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = struct.Struct('<8sII')
+
+# One fixed width, little endian record per spot. Callsigns are ids
+# into the archive's callsign file, frequency is in units of 100 Hz,
+# time is the unix time of the spot's HHMMZ time, dated by the feed
+# (Spot.timestamp). A missing SNR is -128, a missing WPM, zone, mode
+# or type is 0.
+ARCHIVE_RECORD = struct.Struct('<IIIIbBBBBBBB')
+ARCHIVE_FIELDS = [
+    ('time', '<u4'), ('freq', '<u4'), ('dx', '<u4'), ('de', '<u4'),
+    ('snr', 'i1'), ('wpm', 'u1'), ('mode', 'u1'), ('type', 'u1'),
+    ('dxcq', 'u1'), ('dxitu', 'u1'), ('decq', 'u1'), ('deitu', 'u1'),
+]
+
+ARCHIVE_MODES = ('', 'CW', 'RTTY', 'FT8', 'FT4', 'PSK31', 'PSK63')
+ARCHIVE_TYPES = ('', 'CQ', 'DX', 'BEACON', 'NCDXF B')
+
+NO_SNR = -128
+
+# Records buffered before they are written
+ARCHIVE_BUFFER = 4096
+
+
+def requireNumpy():
+    # Writing an archive only needs struct, reading one needs numpy
+    if numpy is None:
+        raise ImportError("reading a spot archive needs numpy "
+                          "(pip install -r requirements.txt)")
+
+
+def archiveDtype():
+    # NumPy structured dtype of the archive records
+    requireNumpy()
+    return numpy.dtype(ARCHIVE_FIELDS)
+
+
+def callsFile(filename):
+    # The callsigns of the ids in the records, one per line
+    return filename + '.calls'
+
+
+def zoneNumber(callData, name):
+    try:
+        return min(255, int(callData[name]))
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+
+class SpotArchive:
+    """Appends spots to an archive as fixed width binary records, with
+    the callsigns interned into a separate file of callsigns. The zones
+    of the callsigns come from the cty.dat table when one is given.
+
+    Records are written in blocks of ARCHIVE_BUFFER, so a spot costs a
+    struct.pack and a list append. An existing archive is appended to,
+    after cutting off a record or callsign left incomplete by a crash,
+    so that the records appended stay aligned and the ids in step with
+    the callsigns."""
+
+    def __init__(self, filename, cty=None):
+        self.filename = filename
+        self.cty = cty
+
+        self._ids = {}
+        self._newCalls = []
+        self._buffer = []
+        self.records = 0
+
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            with open(filename, 'r+b') as f:
+                checkHeader(f.read(ARCHIVE_HEADER.size), filename)
+                whole = ((os.path.getsize(filename) - ARCHIVE_HEADER.size) //
+                         ARCHIVE_RECORD.size)
+                f.truncate(ARCHIVE_HEADER.size + whole * ARCHIVE_RECORD.size)
+            if os.path.exists(callsFile(filename)):
+                with open(callsFile(filename), 'r+b') as f:
+                    calls = f.read()
+                    # no record uses a callsign cut short, the callsigns
+                    # are written before the records
+                    whole = calls.rfind(b'\n') + 1
+                    f.truncate(whole)
+                for call in calls[:whole].decode('latin-1').split('\n')[:-1]:
+                    self._ids[call] = len(self._ids)
+
+        self._file = open(filename, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC,
+                                                 ARCHIVE_VERSION,
+                                                 ARCHIVE_RECORD.size))
+        self._calls = open(callsFile(filename), 'a', encoding='latin-1')
+
+
+    def _id(self, call):
+        callId = self._ids.get(call)
+        if callId is None:
+            callId = len(self._ids)
+            self._ids[call] = callId
+            self._newCalls.append(call)
+
+        return callId
+
+
+    def add(self, spot, now=None):
+        if now is None:
+            now = time.time()
+
+        dxZones = deZones = None
+        if self.cty is not None:
+            dxZones = self.cty.callData(spot.dx)
+            deZones = self.cty.callData(spot.de)
+
+        timestamp = spot.timestamp
+        if timestamp is None:
+            timestamp = spotTimestamp(spot.time, now)
+
+        mode = spot.mode.upper()
+        self._buffer.append(ARCHIVE_RECORD.pack(
+            timestamp,
+            round(spot.freq * 10),
+            self._id(spot.dx),
+            self._id(spot.de),
+            NO_SNR if spot.snr is None else max(-127, min(127, spot.snr)),
+            0 if spot.wpm is None else min(255, spot.wpm),
+            ARCHIVE_MODES.index(mode) if mode in ARCHIVE_MODES else 0,
+            (ARCHIVE_TYPES.index(spot.type) if spot.type in ARCHIVE_TYPES
+             else 0),
+            zoneNumber(dxZones, 'cqzone'), zoneNumber(dxZones, 'ituzone'),
+            zoneNumber(deZones, 'cqzone'), zoneNumber(deZones, 'ituzone')))
+
+        if len(self._buffer) >= ARCHIVE_BUFFER:
+            self.flush()
+
+
+    def flush(self):
+        # The callsigns go first so that every id written has its call
+        if self._newCalls:
+            self._calls.write(''.join(f"{call}\n" for call in self._newCalls))
+            self._calls.flush()
+            self._newCalls.clear()
+
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._file.flush()
+            self.records += len(self._buffer)
+            self._buffer.clear()
+
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self._calls.close()
+
+
+
+def checkHeader(header, filename):
+    if len(header) < ARCHIVE_HEADER.size:
+        raise ValueError(f"{filename} is not a spot archive")
+
+    magic, version, size = ARCHIVE_HEADER.unpack(header)
+    if magic != ARCHIVE_MAGIC:
+        raise ValueError(f"{filename} is not a spot archive")
+    if version != ARCHIVE_VERSION or size != ARCHIVE_RECORD.size:
+        raise ValueError(f"{filename} is a spot archive of version "
+                         f"{version}, not {ARCHIVE_VERSION}")
+
+
+def readArchive(filename):
+    # The records of an archive as a read-only NumPy structured array
+    # mapped onto the file, nothing is copied or decoded, and the list
+    # of callsigns the dx and de ids index
+    requireNumpy()
+    with open(filename, 'rb') as f:
+        checkHeader(f.read(ARCHIVE_HEADER.size), filename)
+
+    count = ((os.path.getsize(filename) - ARCHIVE_HEADER.size) //
+             ARCHIVE_RECORD.size)
+    if count > 0:
+        records = numpy.memmap(filename, dtype=archiveDtype(), mode='r',
+                               offset=ARCHIVE_HEADER.size, shape=(count,))
+    else:
+        records = numpy.empty(0, dtype=archiveDtype())
+
+    calls = []
+    if os.path.exists(callsFile(filename)):
+        with open(callsFile(filename), encoding='latin-1') as f:
+            calls = [line.rstrip('\n') for line in f]
+
+    return records, calls
+
+
+def archiveMask(records, plan):
+    # Boolean mask of the records passing the band, mode, WPM, SNR and
+    # zone filters of a FilterPlan, computed over the whole array at
+    # once. Grid filters need QRZ data the archive does not hold.
+    requireNumpy()
+    freq = records['freq']
+    mask = numpy.zeros(len(records), dtype=bool)
+    for low, high in plan.bandEdges():
+        mask |= (freq >= low * 10) & (freq <= high * 10)
+
+    if plan.modes is not None:
+        ids = [ARCHIVE_MODES.index(m) for m in plan.modes
+               if m in ARCHIVE_MODES]
+        mask &= numpy.isin(records['mode'], ids)
+
+    # only CW spots report a speed in WPM
+    wpm = records['wpm']
+    mask &= (wpm == 0) | ((wpm >= plan.minWPM) & (wpm <= plan.maxWPM))
+
+    if plan.minSNR is not None:
+        snr = records['snr']
+        mask &= (snr != NO_SNR) & (snr >= plan.minSNR)
+
+    zoneFilters = (('dxcq', plan.dxCQZone), ('dxitu', plan.dxITUZone),
+                   ('decq', plan.deCQZone), ('deitu', plan.deITUZone))
+    for field, selected in zoneFilters:
+        if selected is not None:
+            zones = [int(z) for z in selected if z.isdigit()]
+            mask &= numpy.isin(records[field], zones)
+
+    return mask
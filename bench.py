@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+# Benchmark the rbn.py spot pipeline. Synthetic or recorded RBN lines are
+# run through the parser, the filters, the QRZ lookups and the club
+# highlighting without a terminal or a telnet connection. QRZ queries are
+# answered by a local stub instead of qrz.com, the local QRZ cache files
+# are the real ones, created in a temporary directory.
+#
+# Results are printed and can be written as JSON, so runs of different
+# versions can be compared:
+#
+#   $ ./bench.py -o before.json
+#   $ ./bench.py --replay capture.txt.gz --compare before.json
+
+
+import configargparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import rbn
+from clubs import *
+from lookup import *
+from qrz import *
+from replay import *
+from spot import *
+from synth import *
+
+
+
+# Arguments every benchmark configuration starts from
+BENCH_ARGV = ['-c', 'K6ZX', '--qrz_username', 'bench', '--qrz_password',
+              'bench', '--latitude', '40.8', '--longitude', '-73.1']
+
+# (name, extra rbn.py arguments)
+BENCH_CONFIGS = [
+    ('all-bands', ['-b', '160m', '-b', '80m', '-b', '40m', '-b', '30m',
+                   '-b', '20m', '-b', '17m', '-b', '15m', '-b', '12m',
+                   '-b', '10m', '-b', '6m']),
+    ('cw-tight-grid', ['-m', 'CW', '-b', '40m', '-b', '20m',
+                       '--dx_maid', 'FN', '--de_maid', 'FN',
+                       '--de_maid', 'EN']),
+    ('skcc-highlight', ['--skcc']),
+    ('fast-distance', ['-b', '160m', '-b', '80m', '-b', '40m', '-b', '30m',
+                       '-b', '20m', '-b', '17m', '-b', '15m', '-b', '12m',
+                       '-b', '10m', '-b', '6m', '--distance', 'fast']),
+]
+
+# Number of members of the synthetic SKCC club when no SKCC database
+# is available
+SYNTH_SKCC_MEMBERS = 30000
+
+
+
+class StubQRZ(QRZ):
+    """QRZ whose qrz.com queries are answered with synthetic records
+    after an optional delay standing in for the network round trip."""
+
+    def __init__(self, cacheDir, latency=0.0):
+        super().__init__('bench', 'bench', 0,
+                         os.path.join(cacheDir, 'rbnData.db'),
+                         negCacheFile=os.path.join(cacheDir, 'rbnNegative.db'))
+        self.latency = latency
+        self.queries = 0
+
+
+    def getQRZCallsignData(self, callsign, retry=True, quiet=False):
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        return syntheticRecord(callsign)
+
+
+
+def parseArguments():
+    parser = configargparse.ArgumentParser(description='Benchmark the '
+                                           'rbn.py spot pipeline.')
+
+    parser.add_argument('-n', '--spots', action='store', dest='spots',
+                        type=int, default=20000,
+                        help='Number of synthetic spots per configuration')
+    parser.add_argument('--replay', action='store', dest='replay',
+                        help='Benchmark the lines of a recorded RBN capture '
+                        'instead of synthetic spots')
+    parser.add_argument('--config', action='append', dest='config',
+                        help='Only run these configurations')
+    parser.add_argument('--qrz_latency', action='store', dest='qrzLatency',
+                        type=float, default=0.0,
+                        help='Seconds the QRZ stub takes per query')
+    parser.add_argument('--skcc-file', action='store', dest='skccFile',
+                        help='SKCCLogger membership database for the SKCC '
+                        'configuration, synthetic members if not given')
+    parser.add_argument('--no-memory', action='store_true', dest='noMemory',
+                        help='Skip the peak memory measurement')
+    parser.add_argument('-o', '--output', action='store', dest='output',
+                        help='Write the results as JSON to this file')
+    parser.add_argument('--compare', action='store', dest='compare',
+                        help='JSON results of an earlier run to compare with')
+
+    return parser.parse_args()
+
+
+def benchLines(args):
+    if args.replay:
+        with openCapture(args.replay) as f:
+            return [l.rstrip(b'\r\n') + b'\r\n' for l in f]
+
+    return SpotGenerator().lines(args.spots)
+
+
+def benchClubs(args, progArgs, generator):
+    clubIndex = ClubIndex()
+    if not progArgs['skcc']:
+        return clubIndex
+
+    if args.skccFile:
+        clubIndex.addClub('skcc', rbn.getSQLCallsigns(args.skccFile))
+    else:
+        # a third of the busiest DX stations are members
+        clubIndex.addClub('skcc', generator.dxCalls[::3] +
+                          callsignPool(SYNTH_SKCC_MEMBERS, 99))
+
+    return clubIndex
+
+
+def runPipeline(progArgs, lines, qrz, clubIndex):
+    # Run every line through the pipeline, returning the time taken by
+    # each line and the number of spots that would be displayed
+    parser = SpotParser()
+    lookupPool = QRZLookupPool(qrz, progArgs, progArgs['qrzWorkers'])
+
+    latencies = []
+    displayed = 0
+    try:
+        for line in lines:
+            start = time.perf_counter()
+
+            pending = rbn.parkSpot(progArgs, parser, lookupPool, clubIndex,
+                                   line)
+            for future in pending.futures.values():
+                future.result()
+
+            out = rbn.filter(progArgs, pending)
+            if out and out != '*':
+                rbn.spotHighlight(progArgs, clubIndex, out.split(None, 1)[0])
+                displayed += 1
+
+            latencies.append(time.perf_counter() - start)
+    finally:
+        lookupPool.close()
+
+    return latencies, displayed
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def benchConfig(args, argv, lines, generator):
+    progArgs = rbn.processArgs(rbn.buildParser().parse_args(BENCH_ARGV + argv))
+    clubIndex = benchClubs(args, progArgs, generator)
+
+    # every run starts from an empty QRZ cache
+    with tempfile.TemporaryDirectory() as cacheDir:
+        qrz = StubQRZ(cacheDir, args.qrzLatency)
+        latencies, displayed = runPipeline(progArgs, lines, qrz, clubIndex)
+        cacheStats = qrz.cacheStats()
+        queries = qrz.queries
+        qrz.close()
+
+    result = {
+        'spots': len(lines),
+        'displayed': displayed,
+        'seconds': sum(latencies),
+        'spotsPerSecond': len(lines) / sum(latencies),
+        'p50Micros': percentile(sorted(latencies), 0.50) * 1e6,
+        'p99Micros': percentile(sorted(latencies), 0.99) * 1e6,
+        'qrzQueries': queries,
+        'qrzCache': cacheStats,
+        'rejected': progArgs['filterPlan'].report(),
+        'duplicates': progArgs['dedup'].suppressed,
+    }
+
+    if not args.noMemory:
+        progArgs = rbn.processArgs(rbn.buildParser().parse_args(BENCH_ARGV +
+                                                                argv))
+        with tempfile.TemporaryDirectory() as cacheDir:
+            qrz = StubQRZ(cacheDir, args.qrzLatency)
+            tracemalloc.start()
+            runPipeline(progArgs, lines, qrz, clubIndex)
+            result['peakKiB'] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+            qrz.close()
+
+    return result
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printResults(results, previous):
+    print(f"{'config':16s} {'spots/s':>10s} {'p50 us':>9s} {'p99 us':>9s} "
+          f"{'peak KiB':>9s} {'shown':>7s} {'qrz':>6s}")
+
+    for name, r in results['results'].items():
+        peak = f"{r['peakKiB']:9.0f}" if 'peakKiB' in r else f"{'-':>9s}"
+        line = (f"{name:16s} {r['spotsPerSecond']:10.0f} {r['p50Micros']:9.1f} "
+                f"{r['p99Micros']:9.1f} {peak} {r['displayed']:7d} "
+                f"{r['qrzQueries']:6d}")
+
+        old = previous['results'].get(name) if previous else None
+        if old:
+            change = (r['spotsPerSecond'] / old['spotsPerSecond'] - 1) * 100
+            line += f"   {change:+.1f}% spots/s vs {previous.get('commit')}"
+
+        print(line)
+
+
+def main():
+    args = parseArguments()
+
+    lines = benchLines(args)
+    generator = SpotGenerator()
+
+    results = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': gitCommit(),
+        'python': platform.python_version(),
+        'source': args.replay or 'synthetic',
+        'results': {},
+    }
+
+    for name, argv in BENCH_CONFIGS:
+        if args.config and name not in args.config:
+            continue
+
+        results['results'][name] = benchConfig(args, argv, lines, generator)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    printResults(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
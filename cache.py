@@ -0,0 +1,394 @@
+# cache.py - Local storage of QRZ callsign data
+
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import logging
+import shelve
+import threading
+import time
+
+
+
+class CallsignCache:
+    """Persistent store of QRZ callsign records kept in a shelve file.
+
+    Each record is saved with the time it was fetched from qrz.com.
+    Records older than the ttl are treated as missing, and the store is
+    kept below maxEntries by evicting the oldest records. A small index
+    of fetch times is written on close so the next start does not have
+    to unpickle every record to find out how old it is.
+
+    The shelve file is opened and used on one thread of its own, the
+    QRZ lookup workers hand it their reads and writes. Some dbm
+    backends, dbm.sqlite3 (the default since Python 3.13) among them,
+    can only be used on the thread that opened them."""
+
+    # shelve key of the fetch time index, cannot clash with a callsign
+    INDEX_KEY = '__index__'
+
+    # fraction of maxEntries kept after an eviction, so eviction runs
+    # once per batch of new records rather than on every insert
+    EVICT_FRACTION = 0.9
+
+
+    def __init__(self, filename, ttl, maxEntries, logging=0, readOnly=False):
+        self.filename = filename
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.logging = logging
+        self.readOnly = readOnly
+
+        self.hits = 0
+        self.misses = 0
+
+        # callsign -> time the record was fetched
+        self._stamps = {}
+
+        self._db = None
+        self._owner = ThreadPoolExecutor(max_workers=1,
+                                         thread_name_prefix='cache')
+        try:
+            self._run(self._open)
+        except Exception:
+            self._owner.shutdown()
+            self._owner = None
+            raise
+
+
+    def _run(self, function, *args):
+        # Run function on the thread owning the shelve file and return
+        # its result, None once the cache is closed
+        owner = self._owner
+        if owner is None:
+            return None
+
+        try:
+            future = owner.submit(function, *args)
+        except RuntimeError:
+            # closed by another thread
+            return None
+
+        return future.result()
+
+
+    def _open(self):
+        self._db = shelve.open(self.filename,
+                               flag='r' if self.readOnly else 'c')
+        self._loadIndex()
+
+        if not self.readOnly:
+            self._expire()
+            self._evict()
+
+
+    def _loadIndex(self):
+        index = None
+        if self.INDEX_KEY in self._db:
+            index = self._db[self.INDEX_KEY]
+            valid = (isinstance(index, dict) and
+                     len(index) == len(self._db) - 1)
+
+            # the index is only trusted until this run changes the
+            # cache, it is written back by close()
+            if not self.readOnly:
+                del self._db[self.INDEX_KEY]
+
+            if valid:
+                self._stamps = index
+                return
+
+        # index is missing or stale (the previous run did not close
+        # the cache), rebuild it from the records themselves
+        for key in list(self._db.keys()):
+            if key == self.INDEX_KEY:
+                continue
+
+            record = self._db[key]
+            if isinstance(record, dict) and 'ts' in record and 'data' in record:
+                self._stamps[key] = record['ts']
+            elif not self.readOnly:
+                # record from an older version without a timestamp
+                del self._db[key]
+
+        if self.logging:
+            logging.info(f"CallsignCache rebuilt index of {len(self._stamps)} "
+                         f"records from {self.filename}")
+
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        expired = [c for c, ts in self._stamps.items() if ts < cutoff]
+        for callsign in expired:
+            self._remove(callsign)
+
+        if self.logging and expired:
+            logging.info(f"CallsignCache expired {len(expired)} records")
+
+
+    def _evict(self):
+        if len(self._stamps) <= self.maxEntries:
+            return
+
+        keep = int(self.maxEntries * self.EVICT_FRACTION)
+        count = len(self._stamps) - keep
+        oldest = heapq.nsmallest(count, self._stamps.items(),
+                                 key=lambda item: item[1])
+        for callsign, ts in oldest:
+            self._remove(callsign)
+
+        if self.logging:
+            logging.info(f"CallsignCache evicted {count} oldest records")
+
+
+    def _remove(self, callsign):
+        del self._stamps[callsign]
+        if callsign in self._db:
+            del self._db[callsign]
+
+
+    def get(self, callsign):
+        # Return the cached data for callsign or None if there is no
+        # record or the record has expired
+        if callsign not in self._stamps:
+            self.misses += 1
+            return None
+
+        return self._run(self._get, callsign)
+
+
+    def _get(self, callsign):
+        ts = self._stamps.get(callsign)
+        if ts is None or self._db is None:
+            self.misses += 1
+            return None
+
+        if time.time() - ts > self.ttl:
+            if not self.readOnly:
+                self._remove(callsign)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self._db[callsign]['data']
+
+
+    def set(self, callsign, data):
+        self._run(self._set, callsign, data)
+
+
+    def _set(self, callsign, data):
+        if self._db is None:
+            return
+
+        ts = time.time()
+        self._db[callsign] = {'ts': ts, 'data': data}
+        self._stamps[callsign] = ts
+        self._evict()
+
+
+    def timestamp(self, callsign):
+        # Time the record for callsign was fetched
+        return self._stamps.get(callsign)
+
+
+    def age(self, callsign):
+        # Seconds since the record for callsign was fetched
+        ts = self.timestamp(callsign)
+        if ts is None:
+            return None
+
+        return time.time() - ts
+
+
+    def keys(self):
+        keys = self._run(list, self._stamps)
+        return list(self._stamps) if keys is None else keys
+
+
+    def __len__(self):
+        return len(self._stamps)
+
+
+    def close(self):
+        if self._owner is None:
+            return
+
+        owner = self._owner
+        self._owner = None
+        owner.submit(self._close).result()
+        owner.shutdown()
+
+
+    def _close(self):
+        if not self.readOnly:
+            self._db[self.INDEX_KEY] = self._stamps
+        self._db.close()
+        self._db = None
+
+
+
+class LRUCache:
+    """Bounded in-memory cache of decoded callsign records kept in
+    front of the CallsignCache so the most active callsigns are served
+    without touching the shelve file. Holds at most maxEntries records,
+    dropping the least recently used one when full. Records carry their
+    fetch time and expire with the same ttl as the shelve store."""
+
+    def __init__(self, maxEntries, ttl):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._records = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, callsign):
+        with self._lock:
+            entry = self._records.get(callsign)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            ts, data = entry
+            if time.time() - ts > self.ttl:
+                del self._records[callsign]
+                self.misses += 1
+                return None
+
+            self._records.move_to_end(callsign)
+            self.hits += 1
+            return data
+
+
+    def set(self, callsign, data, ts=None):
+        if self.maxEntries <= 0:
+            return
+
+        if ts is None:
+            ts = time.time()
+
+        with self._lock:
+            self._records[callsign] = (ts, data)
+            self._records.move_to_end(callsign)
+            while len(self._records) > self.maxEntries:
+                self._records.popitem(last=False)
+
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+    def __len__(self):
+        return len(self._records)
+
+
+
+class NegativeCache:
+    """Callsigns that qrz.com could not resolve, kept apart from the
+    callsign records so they can be listed and cleared on their own.
+
+    A callsign that fails is not looked up again for ttl seconds. Each
+    further failure doubles the wait, up to maxTTL. The entries are
+    saved to their own shelve file on close and reloaded on start."""
+
+    # shelve key holding the entries
+    ENTRIES_KEY = 'entries'
+
+
+    def __init__(self, filename, ttl, maxTTL, maxEntries=100000, logging=0):
+        self.filename = filename
+        self.ttl = ttl
+        self.maxTTL = maxTTL
+        self.maxEntries = maxEntries
+        self.logging = logging
+
+        self._lock = threading.Lock()
+
+        # callsign -> [failures, retry time, error message]
+        self._entries = {}
+        with shelve.open(filename, flag='c') as db:
+            self._entries = db.get(self.ENTRIES_KEY, {})
+        self._closed = False
+
+        self.hits = 0
+
+        self._expire()
+
+
+    def _expire(self):
+        # Entries are kept for a full maxTTL after they can be retried
+        # so the failure count, and with it the backoff, survives a
+        # quick retry that fails again
+        cutoff = time.time() - self.maxTTL
+        expired = [c for c, e in self._entries.items() if e[1] < cutoff]
+        for callsign in expired:
+            del self._entries[callsign]
+
+
+    def blocked(self, callsign):
+        # True if a failed lookup of callsign should not be retried yet
+        with self._lock:
+            entry = self._entries.get(callsign)
+            if entry is not None and time.time() < entry[1]:
+                self.hits += 1
+                return True
+
+        return False
+
+
+    def fail(self, callsign, error):
+        with self._lock:
+            entry = self._entries.get(callsign)
+            failures = 1 if entry is None else entry[0] + 1
+            wait = min(self.ttl * 2 ** (failures - 1), self.maxTTL)
+            self._entries[callsign] = [failures, time.time() + wait,
+                                       str(error)]
+
+            if len(self._entries) > self.maxEntries:
+                self._expire()
+                if len(self._entries) > self.maxEntries:
+                    # drop the entries due for a retry soonest
+                    count = len(self._entries) - self.maxEntries
+                    for c, e in heapq.nsmallest(count, self._entries.items(),
+                                                key=lambda item: item[1][1]):
+                        del self._entries[c]
+
+        if self.logging:
+            logging.info(f"NegativeCache {callsign} failed {failures} times, "
+                         f"retry in {wait:.0f} s: {error}")
+
+
+    def succeed(self, callsign):
+        with self._lock:
+            self._entries.pop(callsign, None)
+
+
+    def entries(self):
+        # List of (callsign, failures, retry time, error) tuples
+        with self._lock:
+            return [(c, e[0], e[1], e[2]) for c, e in self._entries.items()]
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+
+            with shelve.open(self.filename, flag='c') as db:
+                db[self.ENTRIES_KEY] = self._entries
+            self._closed = True
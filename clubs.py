@@ -0,0 +1,61 @@
+# clubs.py - Club membership lookup for spotted callsigns
+
+
+
+def callsignVariants(callsign):
+    # The forms of a spotted callsign that may appear in a membership
+    # list: the full call, then each part of a portable call.
+    # 'VE3/W1AW/P' -> ('VE3/W1AW/P', 'VE3', 'W1AW', 'P'), skimmer
+    # suffixes are dropped so 'W3OA-2' -> ('W3OA',)
+    call = callsign.strip().upper().split('-')[0]
+
+    if '/' not in call:
+        return (call,)
+
+    return (call,) + tuple(p for p in call.split('/') if p)
+
+
+
+class ClubIndex:
+    """Callsigns of the members of one or more clubs, indexed so the
+    membership of a spotted station is found with a couple of dict
+    lookups however large the clubs are. Clubs are kept in the order
+    they were added, which is also their display priority."""
+
+    def __init__(self):
+        self.clubs = []
+
+        # normalized callsign -> tuple of club names
+        self._members = {}
+
+
+    def addClub(self, name, callsigns):
+        self.clubs.append(name)
+
+        for callsign in callsigns:
+            if not callsign:
+                continue
+
+            call = callsign.strip().upper()
+
+            clubs = self._members.get(call, ())
+            if name not in clubs:
+                self._members[call] = clubs + (name,)
+
+
+    def clubsOf(self, callsign):
+        # Names of the clubs callsign belongs to, in priority order
+        for call in callsignVariants(callsign):
+            clubs = self._members.get(call)
+            if clubs is not None:
+                return clubs
+
+        return ()
+
+
+    def isMember(self, name, callsign):
+        return name in self.clubsOf(callsign)
+
+
+    def __len__(self):
+        return len(self._members)
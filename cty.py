@@ -0,0 +1,176 @@
+# cty.py - Country, continent and zones of callsigns from a cty.dat file
+
+
+import re
+
+
+
+# Suffixes of portable, mobile and similar operation that do not change
+# the country of a callsign
+PORTABLE_SUFFIXES = frozenset(['P', 'M', 'QRP', 'QRPP', 'A', 'B', 'LH',
+                               'J', 'R'])
+
+# Maritime and aeronautical mobile stations are in no country
+NO_COUNTRY_SUFFIXES = frozenset(['MM', 'AM'])
+
+# A prefix or exact callsign of cty.dat and its optional overrides:
+# (cq zone) [itu zone] <lat/lon> {continent} ~utc offset~
+CTY_TOKEN = re.compile(r'(=?)([A-Z0-9/]+)((?:\(\d+\)|\[\d+\]|<[^>]*>|'
+                       r'\{[A-Z]+\}|~[^~]*~)*)$')
+CTY_CQZONE = re.compile(r'\((\d+)\)')
+CTY_ITUZONE = re.compile(r'\[(\d+)\]')
+CTY_CONTINENT = re.compile(r'\{([A-Z]+)\}')
+
+
+def zone(text):
+    # Zone number as QRZ gives it, '05' is '5'
+    try:
+        return str(int(text))
+    except ValueError:
+        return text
+
+
+def callPrefix(callsign):
+    # The part of callsign that decides its country, e.g. KH6 for
+    # W1AW/KH6, W4 for W1AW/4, W1AW for W1AW/P. None for maritime and
+    # aeronautical mobile stations.
+    parts = [p for p in callsign.upper().split('/') if p]
+    if any(p in NO_COUNTRY_SUFFIXES for p in parts):
+        return None
+
+    parts = [p for p in parts if p not in PORTABLE_SUFFIXES]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+
+    call, other = parts[0], parts[1]
+
+    # a new call area, W1AW/4 is heard from the 4 area as W4
+    if len(other) == 1 and other.isdigit():
+        for i in range(1, len(call)):
+            if call[i].isdigit():
+                return call[:i] + other
+        return call
+
+    # otherwise the prefix is the shorter part, VP2E/W1AW or W1AW/VP2E
+    return min(parts, key=len)
+
+
+
+class CtyTable:
+    """Country, continent, CQ zone and ITU zone of callsigns, resolved
+    offline from a cty.dat country file (https://www.country-files.com)
+    instead of QRZ. The prefixes are kept in a trie and a callsign gets
+    the data of its longest matching prefix, or of its exact entry when
+    cty.dat lists the callsign itself.
+
+    The records look like QRZ records with the fields country,
+    continent, cqzone and ituzone, so the zone filters and the display
+    take them as they are. Resolved callsigns are cached."""
+
+    def __init__(self, filename=None, maxCache=100000):
+        self.filename = filename
+        self.maxCache = maxCache
+
+        # trie of dicts keyed by character, '' holds the record of the
+        # prefix ending at a node
+        self._trie = {}
+        self._exact = {}
+        self._cache = {}
+        self.countries = 0
+
+        if filename:
+            self.load(filename)
+
+
+    def load(self, filename):
+        with open(filename, encoding='latin-1') as f:
+            text = f.read()
+
+        # an entry is the country header of eight fields separated by
+        # colons followed by its prefixes, ended by a semicolon
+        for entry in text.split(';'):
+            fields = entry.split(':')
+            if len(fields) < 9:
+                continue
+
+            name, cq, itu, continent = (f.strip() for f in fields[:4])
+            country = {'country': name, 'continent': continent.upper(),
+                       'cqzone': zone(cq), 'ituzone': zone(itu),
+                       'prefix': fields[7].strip().lstrip('*')}
+            self.countries += 1
+
+            for token in ''.join(fields[8:]).replace('\n', '').split(','):
+                self._addToken(token.strip().upper(), country)
+
+        self._cache.clear()
+
+
+    def _addToken(self, token, country):
+        match = CTY_TOKEN.match(token)
+        if match is None:
+            return
+
+        exact, call, overrides = match.groups()
+
+        record = country
+        if overrides:
+            record = dict(country)
+            m = CTY_CQZONE.search(overrides)
+            if m:
+                record['cqzone'] = zone(m.group(1))
+            m = CTY_ITUZONE.search(overrides)
+            if m:
+                record['ituzone'] = zone(m.group(1))
+            m = CTY_CONTINENT.search(overrides)
+            if m:
+                record['continent'] = m.group(1)
+
+        if exact:
+            self._exact[call] = record
+            return
+
+        node = self._trie
+        for ch in call:
+            node = node.setdefault(ch, {})
+        node[''] = record
+
+
+    def callData(self, callsign):
+        # Record of the country of callsign, None if it has none
+        if not self.countries:
+            return None
+
+        try:
+            return self._cache[callsign]
+        except KeyError:
+            pass
+
+        record = self._exact.get(callsign)
+        if record is None:
+            prefix = callPrefix(callsign)
+            if prefix is not None:
+                record = self._exact.get(prefix) or self._longest(prefix)
+
+        if len(self._cache) >= self.maxCache:
+            self._cache.clear()
+        self._cache[callsign] = record
+
+        return record
+
+
+    def _longest(self, prefix):
+        node = self._trie
+        record = None
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                break
+            record = node.get('', record)
+
+        return record
+
+
+    def __len__(self):
+        return self.countries
@@ -0,0 +1,80 @@
+# dedup.py - Suppress repeated spots of a station within a time window
+
+
+import collections
+import time
+
+from filters import bandOf
+
+
+
+class SpotDeduplicator:
+    """Remembers the spots shown, keyed on the DX callsign, the band and
+    the frequency rounded to khz, and reports a spot as a duplicate when
+    the same key was shown less than window seconds ago. A station heard
+    by many skimmers is then shown once per window instead of once per
+    skimmer.
+
+    The keys are kept in a dict with their time shown and in a ring
+    buffer in the order shown, from which they expire after the window,
+    and at most maxEntries keys are kept, so memory stays flat however
+    long the program runs.
+
+    Times are the spot times (Spot.timestamp), not the time a spot is
+    processed, so a replay run faster than real time keeps the spots of
+    a station hours apart as separate spots."""
+
+    def __init__(self, window=60, khz=1.0, maxEntries=50000):
+        self.window = window
+        self.khz = khz if khz > 0 else 1.0
+        self.maxEntries = maxEntries
+
+        self._shown = {}
+        self._ring = collections.deque()
+
+        self.suppressed = 0
+
+
+    def key(self, call, freq):
+        return (call, bandOf(freq), round(freq / self.khz))
+
+
+    def isDuplicate(self, call, freq, now=None):
+        # True if the spot repeats one shown within the window, False
+        # after remembering it as shown
+        if self.window <= 0:
+            return False
+
+        if now is None:
+            now = time.time()
+
+        self._expire(now)
+
+        key = self.key(call, freq)
+        if key in self._shown:
+            self.suppressed += 1
+            return True
+
+        if len(self._ring) >= self.maxEntries:
+            self._forget()
+
+        self._shown[key] = now
+        self._ring.append((now, key))
+
+        return False
+
+
+    def _expire(self, now):
+        ring = self._ring
+        oldest = now - self.window
+        while ring and ring[0][0] <= oldest:
+            self._forget()
+
+
+    def _forget(self):
+        shownAt, key = self._ring.popleft()
+        del self._shown[key]
+
+
+    def __len__(self):
+        return len(self._shown)
@@ -4,21 +4,66 @@
 # test program.
 
 
+import configargparse
+import datetime
 import os
-import shelve
+import sys
 
+from cache import *
+
+
+
+def parseArguments():
+    parser = configargparse.ArgumentParser(description='Dump the rbn.py '
+                                           'QRZ callsign cache.')
+
+    parser.add_argument('--qrz_cache', action='store', dest='qrzCache',
+                        default=os.path.join(os.environ['HOME'],
+                                             'amateur-radio/rbnData.db'),
+                        help='Local QRZ callsign cache file')
+    parser.add_argument('--qrz_negcache', action='store', dest='qrzNegCache',
+                        default=os.path.join(os.environ['HOME'],
+                                             'amateur-radio/rbnNegative.db'),
+                        help='Cache file of callsigns QRZ could not resolve')
+    parser.add_argument('--negative', action='store_true', dest='negative',
+                        help='List the callsigns QRZ could not resolve')
+    parser.add_argument('--clear_negative', action='store_true',
+                        dest='clearNegative',
+                        help='Clear the callsigns QRZ could not resolve')
+
+    return parser.parse_args()
+
+
+def dumpNegative(args):
+    negative = NegativeCache(args.qrzNegCache, 0, float('inf'))
+
+    if args.clearNegative:
+        print(f"Clearing {len(negative)} callsigns from {args.qrzNegCache}")
+        negative.clear()
+        negative.close()
+        return
+
+    for callsign, failures, retry, error in sorted(negative.entries()):
+        retryStr = datetime.datetime.fromtimestamp(retry).strftime('%Y-%m-%d %H:%M')
+        print(f"{callsign:10s} {failures:3d}  retry {retryStr}  {error}")
 
 
 def main():
-    shelveFile = os.path.join(os.environ['HOME'],
-                              'amateur-radio/rbnData.db')
-    calldata = shelve.open(shelveFile)
+    args = parseArguments()
+
+    if args.negative or args.clearNegative:
+        dumpNegative(args)
+        sys.exit(0)
+
+    # records are listed whatever their age, the age in days is shown
+    calldata = CallsignCache(args.qrzCache, float('inf'), sys.maxsize,
+                             readOnly=True)
 
-    for key in calldata:
-        record = calldata[key]
+    for key in calldata.keys():
+        record = calldata.get(key)
         # print(record)
 
-        output = f"{record['call']:6s}   "
+        output = f"{record['call']:6s}   {calldata.age(key) / 86400:5.1f}d   "
         if 'fname' in record:
             output += f"{record['fname']} "
         if 'name' in record:
@@ -31,13 +76,12 @@ def main():
             output += f"{record['country']}, "
         if 'grid' in record:
             output += f"{record['grid']}"
-            
+
 
         print(output)
 
     calldata.close()
-    
+
 
 if __name__ == "__main__":
     main()
-
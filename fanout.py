@@ -0,0 +1,495 @@
+# fanout.py - Spot server sharing one RBN feed and QRZ cache with many clients
+
+
+import argparse
+import asyncio
+import base64
+import collections
+import datetime
+import hashlib
+import shlex
+import struct
+import urllib.parse
+
+from filters import *
+from lookup import *
+from spot import *
+
+
+
+# Seconds a client has to log in
+CLIENT_LOGIN_TIMEOUT = 60
+
+# Seconds a departing client gets to receive the lines still queued
+CLIENT_CLOSE_TIMEOUT = 5
+
+# Key suffix of the websocket handshake, RFC 6455
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+WS_CONTINUATION = 0x0
+WS_TEXT = 0x1
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+
+# Largest websocket frame accepted from a client, commands are short
+WS_MAX_FRAME = 4096
+
+COMMAND_HELP = [
+    "Commands:",
+    "  set [options]  filter the spots sent, with the rbn.py filter options,",
+    "                 e.g. set -b 20m -b 40m -m CW --dx_maid FN --min_wpm 18",
+    "                 --latitude and --longitude set the distance origin.",
+    "                 set with no options sends all spots",
+    "  show           show the filters and the spots sent and dropped",
+    "  help           show this help",
+    "  quit           disconnect",
+]
+
+
+class FilterCommandError(Exception):
+    pass
+
+
+
+class FilterCommandParser(argparse.ArgumentParser):
+    """Parser of the options of a client's set command, raising an
+    error instead of exiting the server."""
+
+    def error(self, message):
+        raise FilterCommandError(message)
+
+
+
+def buildFilterCommandParser():
+    parser = FilterCommandParser(prog='set', add_help=False)
+
+    addFilterOptions(parser)
+    parser.add_argument('--latitude', action='store', dest='latitude',
+                        type=float, help='Station latitude')
+    parser.add_argument('--longitude', action='store', dest='longitude',
+                        type=float, help='Station longitude')
+
+    return parser
+
+
+def wsFrame(payload, opcode=WS_TEXT):
+    # One unmasked, unfragmented websocket frame, as sent by a server
+    length = len(payload)
+    if length < 126:
+        head = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+    return head + payload
+
+
+async def wsReadFrame(reader):
+    # Opcode and unmasked payload of the next frame from a client
+    head = await reader.readexactly(2)
+    opcode = head[0] & 0x0f
+    masked = head[1] & 0x80
+    length = head[1] & 0x7f
+
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+
+    if length > WS_MAX_FRAME:
+        raise ConnectionError(f"websocket frame of {length} bytes")
+
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    return opcode, payload
+
+
+
+class FanoutClient:
+    """A client of the spot server, with its own filters. Lines for the
+    client wait in a bounded queue that its send task empties. A client
+    that cannot keep up loses its oldest lines and never holds up the
+    spots of the other clients. Lines are sent as text lines, the
+    subclasses change the framing."""
+
+    def __init__(self, server, name, writer):
+        self.server = server
+        self.name = name
+        self.writer = writer
+
+        self.position = server.position
+        self.plan = None
+        self.filterCommand = []
+        self.setFilters([])
+
+        self.queue = collections.deque(maxlen=server.queueSize)
+        self.sent = 0
+        self.dropped = 0
+        self._ready = asyncio.Event()
+        self._finishing = False
+
+
+    def setFilters(self, argv):
+        opts = self.server.commandParser.parse_args(argv)
+
+        position = self.server.position
+        if opts.latitude is not None or opts.longitude is not None:
+            if opts.latitude is None or opts.longitude is None:
+                raise FilterCommandError("--latitude and --longitude are "
+                                         "needed together")
+            position = (opts.latitude, opts.longitude)
+
+        a = filterArgs(opts)
+        a['logging'] = 0
+
+        self.plan = FilterPlan(a)
+        self.position = position
+        self.filterCommand = argv
+
+
+    def accepts(self, spot, dxCallData, deCallData):
+        return self.plan.accept(spot.freq, spot.mode, spot.wpm, spot.snr,
+                                dxCallData, deCallData)
+
+
+    def push(self, line):
+        # Queue a line without waiting, the oldest line is dropped when
+        # the queue is full
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+
+        self.queue.append(line)
+        self._ready.set()
+
+
+    def encode(self, lines):
+        return b"".join(line.encode('utf-8') + b"\r\n" for line in lines)
+
+
+    def finish(self):
+        # Let the send task end once the lines queued are sent
+        self._finishing = True
+        self._ready.set()
+
+
+    async def sendLoop(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+
+                lines = list(self.queue)
+                self.queue.clear()
+
+                if lines:
+                    self.writer.write(self.encode(lines))
+                    self.sent += len(lines)
+
+                    # only this client waits while its socket is full,
+                    # the lines arriving meanwhile collect in its queue
+                    await self.writer.drain()
+
+                if self._finishing and not self.queue:
+                    return
+        except ConnectionError:
+            # the command loop sees the connection close and cleans up
+            pass
+
+
+    def close(self):
+        self.writer.close()
+
+
+
+class TelnetClient(FanoutClient):
+    """Client on the telnet compatible TCP port, one line per spot."""
+
+    async def commands(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+
+            text = line.decode('utf-8', 'replace').strip()
+            if text:
+                yield text
+
+
+
+class WebSocketClient(FanoutClient):
+    """Client on the websocket port, one text frame per spot."""
+
+    def __init__(self, server, name, writer):
+        super().__init__(server, name, writer)
+        self._closeSent = False
+
+
+    def encode(self, lines):
+        return b"".join(wsFrame(line.encode('utf-8')) for line in lines)
+
+
+    async def commands(self, reader):
+        while True:
+            opcode, payload = await wsReadFrame(reader)
+
+            if opcode == WS_CLOSE:
+                # nothing may follow the close frame
+                self.queue.clear()
+                self.writer.write(wsFrame(payload[:2], WS_CLOSE))
+                self._closeSent = True
+                return
+            elif opcode == WS_PING:
+                self.writer.write(wsFrame(payload, WS_PONG))
+            elif opcode in (WS_TEXT, WS_CONTINUATION):
+                for text in payload.decode('utf-8', 'replace').splitlines():
+                    if text.strip():
+                        yield text.strip()
+
+
+    def close(self):
+        if not self._closeSent:
+            self._closeSent = True
+            try:
+                self.writer.write(wsFrame(b"", WS_CLOSE))
+            except (ConnectionError, RuntimeError):
+                pass
+
+        super().close()
+
+
+
+class FanoutServer:
+    """Shares one RBN feed with many clients. Every spot is looked up
+    in QRZ once, its display line is formatted once per distance
+    origin, and each client gets the spots passing its own filters.
+    Clients connect on a telnet compatible TCP port, which runs the
+    RBN login dialog, or on a websocket port."""
+
+    def __init__(self, args):
+        self.args = args
+        self.position = tuple(args['position'])
+        self.queueSize = args['clientQueue']
+        self.commandParser = buildFilterCommandParser()
+
+        self.clients = set()
+        self.published = 0
+        self._servers = []
+
+
+    async def start(self, host, port=None, wsPort=None):
+        if port:
+            self._servers.append(await asyncio.start_server(
+                self.handleTelnet, host, port))
+            print(f"Spot server on {host}:{port}")
+
+        if wsPort:
+            self._servers.append(await asyncio.start_server(
+                self.handleWebSocket, host, wsPort))
+            print(f"Spot server websocket on {host}:{wsPort}")
+
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+
+        for client in list(self.clients):
+            client.close()
+
+
+    async def publishSpots(self, queue):
+        # Fan the parked spots out in arrival order, each one once its
+        # QRZ lookups are done or have timed out
+        batches = ReadyBatches(queue)
+
+        while True:
+            batch = await batches.next()
+
+            # distances of the whole batch in one pass per origin
+            callDatas = batchDxData(batch)
+            for position in {client.position for client in self.clients}:
+                self.args['distanceCache'].prefetch(callDatas, position)
+
+            for parked in batch:
+                if parked is None:
+                    return
+
+                self.publish(parked)
+
+
+    def publish(self, pending):
+        spot = pending.spot
+        if spot is None or pending.rejected:
+            return
+
+        dxCallData = pending.callData(spot.dx)
+        if dxCallData is None:
+            return
+
+        deCallData = pending.callData(spot.de)
+        if not self.args['filterPlan'].acceptGeo(dxCallData, deCallData,
+                                                 pending.friend):
+            return
+
+        self.published += 1
+        self.args['metrics'].shown(pending.received, spot.time)
+
+        history = self.args['history']
+        if history is not None:
+            history.add(spot, dxCallData,
+                        self.args['distanceCache'].miles(dxCallData,
+                                                         self.position))
+
+        # display line by distance origin, most clients share one
+        lines = {}
+        for client in self.clients:
+            if not (pending.friend or
+                    client.accepts(spot, dxCallData, deCallData)):
+                continue
+
+            line = lines.get(client.position)
+            if line is None:
+                miles = self.args['distanceCache'].miles(dxCallData,
+                                                         client.position)
+                line = spotLine(spot, dxCallData, miles)
+                lines[client.position] = line
+
+            client.push(line)
+
+
+    def command(self, client, text):
+        # Run one client command, False when the client is done
+        try:
+            words = shlex.split(text)
+        except ValueError as e:
+            client.push(f"Error: {e}")
+            return True
+
+        cmd = words[0].lower()
+        if cmd == 'set':
+            try:
+                client.setFilters(words[1:])
+            except FilterCommandError as e:
+                client.push(f"Error: {e}")
+            else:
+                client.push(f"Filters set: {' '.join(words[1:]) or 'none'}")
+        elif cmd == 'show':
+            client.push(f"Filters: {' '.join(client.filterCommand) or 'none'}")
+            client.push(f"Distance from: {client.position[0]}, "
+                        f"{client.position[1]}")
+            client.push(f"Lines sent {client.sent}, dropped {client.dropped}")
+        elif cmd == 'help':
+            for line in COMMAND_HELP:
+                client.push(line)
+        elif cmd in ('quit', 'bye', 'exit'):
+            client.push("73 de RBNPY")
+            return False
+        else:
+            client.push(f"Unknown command '{words[0]}', try help")
+
+        return True
+
+
+    async def runClient(self, client, commands, peer):
+        self.clients.add(client)
+        print(f"{client.name} connected from {peer}, "
+              f"{len(self.clients)} clients")
+
+        sender = asyncio.ensure_future(client.sendLoop())
+        lost = False
+        try:
+            async for text in commands:
+                if not self.command(client, text):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            print(f"{client.name} connection lost: {e!r}")
+            lost = True
+        finally:
+            self.clients.discard(client)
+            if not lost:
+                # the replies still queued, the goodbye among them
+                client.finish()
+                try:
+                    await asyncio.wait_for(sender, CLIENT_CLOSE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+            sender.cancel()
+            client.close()
+
+        print(f"{client.name} disconnected after {client.sent} lines, "
+              f"{client.dropped} dropped, {len(self.clients)} clients")
+
+
+    async def handleTelnet(self, reader, writer):
+        # The RBN login dialog, so RBN clients can connect unchanged
+        peer = writer.get_extra_info('peername')
+
+        try:
+            writer.write(b"Please enter your call: ")
+            await writer.drain()
+
+            line = await asyncio.wait_for(reader.readline(),
+                                          CLIENT_LOGIN_TIMEOUT)
+            call = line.decode('ascii', 'replace').strip().upper()
+            if not call:
+                writer.close()
+                return
+
+            now = datetime.datetime.now(datetime.timezone.utc)
+            writer.write(f"\r\nHello {call}, this is the rbn.py spot server\r\n"
+                         f"Local users = {len(self.clients) + 1}\r\n\r\n"
+                         f"{call} de RBNPY {now:%d-%b-%Y %H%MZ} >\r\n".
+                         encode('ascii'))
+        except (ConnectionError, asyncio.TimeoutError):
+            writer.close()
+            return
+
+        client = TelnetClient(self, call, writer)
+        await self.runClient(client, client.commands(reader), peer)
+
+
+    async def handleWebSocket(self, reader, writer):
+        # HTTP upgrade to a websocket, the client's name is the call
+        # parameter of the URL, e.g. ws://host:port/?call=K6ZX
+        peer = writer.get_extra_info('peername')
+
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                             CLIENT_LOGIN_TIMEOUT)
+        except (ConnectionError, asyncio.TimeoutError,
+                asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+
+        lines = request.decode('latin-1').split("\r\n")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+
+        key = headers.get('sec-websocket-key')
+        if not key or headers.get('upgrade', '').lower() != 'websocket':
+            writer.write(b"HTTP/1.1 400 Bad Request\r\n"
+                         b"Content-Length: 0\r\n\r\n")
+            writer.close()
+            return
+
+        accept = base64.b64encode(hashlib.sha1(key.encode('ascii') +
+                                               WS_GUID).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                     b"Upgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+
+        request = lines[0].split(" ")
+        target = request[1] if len(request) > 1 else "/"
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(target).query)
+        call = query.get('call', [f"{peer[0]}:{peer[1]}"])[0].upper()
+
+        client = WebSocketClient(self, call, writer)
+        await self.runClient(client, client.commands(reader), peer)
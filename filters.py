@@ -0,0 +1,312 @@
+# filters.py - RBN spot filters compiled from the program arguments
+
+
+import bisect
+import collections
+import logging
+
+
+
+# Amateur band edges in kHz
+BANDS = [
+    ('160m', 1800, 2000),
+    ('80m', 3500, 4000),
+    ('40m', 7000, 7300),
+    ('30m', 10100, 10150),
+    ('20m', 14000, 14350),
+    ('17m', 18068, 18168),
+    ('15m', 21000, 21450),
+    ('12m', 24890, 24990),
+    ('10m', 28000, 29700),
+    ('6m', 50000, 54000),
+]
+
+BAND_LOWS = [low for name, low, high in BANDS]
+
+
+def bandOf(freq):
+    # Name of the band of freq in kHz, None if it is in no band
+    i = bisect.bisect_right(BAND_LOWS, freq) - 1
+    if i >= 0 and freq <= BANDS[i][2]:
+        return BANDS[i][0]
+
+    return None
+
+
+def selection(values):
+    # Set of selected values, or None when the option is 'all'
+    if not values or 'all' in values:
+        return None
+
+    return frozenset(str(v).strip().upper() for v in values)
+
+
+def field(callData, name):
+    # Upper case value of a QRZ record field, '' if not present
+    if callData is None:
+        return ""
+
+    return str(callData.get(name, "")).strip().upper()
+
+
+def matches(selected, value):
+    return selected is None or value in selected
+
+
+def addFilterOptions(parser):
+    # The spot filter options, shared by rbn.py and the filter commands
+    # of the spot server clients
+    parser.add_argument('-b', '--band', action='append', dest='band',
+                        help='Display stations only on these bands')
+    parser.add_argument('--de_maid', action='append', dest='deMaid',
+                        help='DE Maidenhead squares')
+    parser.add_argument('--dx_maid', action='append', dest='dxMaid',
+                        help='DX Maidenhead squares')
+    parser.add_argument('--de_ituzone', action='append', dest='deITUZone',
+                        type=str, help='DE ITU Zone')
+    parser.add_argument('--dx_ituzone', action='append', dest='dxITUZone',
+                        type=str, help='DX ITU Zone')
+    parser.add_argument('--de_cqzone', action='append', dest='deCQZone',
+                        type=str, help='DE CQ Zone')
+    parser.add_argument('--dx_cqzone', action='append', dest='dxCQZone',
+                        type=str, help='DX CQ Zone')
+    parser.add_argument('--min_wpm', action='store', dest='minWPM',
+                        type=int, default=0, help='Minimum CW WPM to show')
+    parser.add_argument('--max_wpm', action='store', dest='maxWPM',
+                        type=int, default=100, help='Maximum CW WPM to show')
+    parser.add_argument('--min_snr', action='store', dest='minSNR',
+                        type=int, help='Minimum SNR in dB to show')
+    parser.add_argument('-m', '--mode', action='append', dest='mode',
+                        help='Select transmission mode')
+
+
+def filterArgs(args):
+    # The filter settings of the parsed filter options, with the
+    # defaults used when an option is not given
+    a = {}
+
+    # if no bands are configured then want to return all bands
+    if not args.band:
+        a['band'] = ['160m', '80m', '40m', '20m', '17m', '15m', '12m', '10m',
+                     '6m']
+    else:
+        a['band'] = args.band
+
+    if not args.deMaid:
+        a['deMaid'] = ['all']
+    else:
+        a['deMaid'] = args.deMaid
+
+    if not args.dxMaid:
+        a['dxMaid'] = ['all']
+    else:
+        a['dxMaid'] = args.dxMaid
+
+    if not args.deITUZone:
+        a['deITUZone'] = ['all']
+    else:
+        a['deITUZone'] = args.deITUZone
+
+    if not args.dxITUZone:
+        a['dxITUZone'] = ['all']
+    else:
+        a['dxITUZone'] = args.dxITUZone
+
+    if not args.deCQZone:
+        a['deCQZone'] = ['all']
+    else:
+        a['deCQZone'] = args.deCQZone
+
+    if not args.dxCQZone:
+        a['dxCQZone'] = ['all']
+    else:
+        a['dxCQZone'] = args.dxCQZone
+
+    a['minWPM'] = args.minWPM
+    a['maxWPM'] = args.maxWPM
+    a['minSNR'] = args.minSNR
+
+    if not args.mode:
+        a['mode'] = ['CW', 'RTTY', 'PSK31', 'PSK63', 'BPSK', 'FT8', 'FT4']
+    else:
+        a['mode'] = args.mode
+
+    return a
+
+
+
+class FilterPlan:
+    """The spot filters selected by filterArgs(), compiled once.
+
+    Bands are kept as a sorted interval table searched with bisect,
+    modes, grids and zones as sets. A dimension set to 'all' gets no
+    check at all, so a spot only pays for the filters that can reject
+    it. The plan counts the spots each filter rejected and holds no
+    other state, so it can be shared by anything that filters spots."""
+
+    def __init__(self, args):
+        self.logging = args['logging']
+
+        bands = set(args['band'])
+        selected = [b for b in BANDS if b[0] in bands]
+        self._bandLows = [low for name, low, high in selected]
+        self._bandHighs = [high for name, low, high in selected]
+
+        self.modes = selection(args['mode'])
+        self.minWPM = args['minWPM']
+        self.maxWPM = args['maxWPM']
+
+        self.dxMaid = selection(args['dxMaid'])
+        self.deMaid = selection(args['deMaid'])
+        self.dxITUZone = selection(args['dxITUZone'])
+        self.deITUZone = selection(args['deITUZone'])
+        self.dxCQZone = selection(args['dxCQZone'])
+        self.deCQZone = selection(args['deCQZone'])
+
+        self.minSNR = args['minSNR']
+
+        # The checks this plan needs, in order, as (name, method). Raw
+        # checks only need the fields of the RBN line, geo checks need
+        # the QRZ data of the callsigns and run after the lookups.
+        self._rawChecks = [('band', self.filterBand)]
+        if self.modes is not None:
+            self._rawChecks.append(('mode', self.filterMode))
+        self._rawChecks.append(('wpm', self.filterWPM))
+        if self.minSNR is not None:
+            self._rawChecks.append(('snr', self.filterSNR))
+
+        self._geoChecks = []
+        if self.dxMaid is not None or self.deMaid is not None:
+            self._geoChecks.append(('maidenhead', self.filterMaidenhead))
+        if self.dxITUZone is not None or self.deITUZone is not None:
+            self._geoChecks.append(('ituzone', self.filterITUZones))
+        if self.dxCQZone is not None or self.deCQZone is not None:
+            self._geoChecks.append(('cqzone', self.filterCQZones))
+
+        # QRZ data of the callsigns is only needed by the geo checks,
+        # and by the display for the distance and location of the DX.
+        # Zones are also known from the callsign prefix, grids only
+        # from QRZ or the skimmer file.
+        self.needsDeGrid = self.deMaid is not None
+        self.needsDeZones = (self.deITUZone is not None or
+                             self.deCQZone is not None)
+        self.needsDxGrid = self.dxMaid is not None
+        self.needsDxZones = (self.dxITUZone is not None or
+                             self.dxCQZone is not None)
+        self.needsDeData = self.needsDeGrid or self.needsDeZones
+        self.needsDxData = self.needsDxGrid or self.needsDxZones
+
+        self.passed = 0
+        self.rejected = collections.Counter()
+
+
+    def bandEdges(self):
+        # (low, high) kHz of each band selected
+        return list(zip(self._bandLows, self._bandHighs))
+
+
+    def acceptRaw(self, freq, mode, wpm, snr):
+        # First stage, checks on the fields of the RBN line
+        for name, check in self._rawChecks:
+            if not check(freq, mode, wpm, snr):
+                self.rejected[name] += 1
+                return False
+
+        return True
+
+
+    def acceptGeo(self, dxCallData, deCallData, friend=False):
+        # Last stage, checks on the QRZ data of the callsigns. Spots of
+        # friends and club members skip the checks but are counted as
+        # passed, so the counts add up to the spots shown.
+        if not friend:
+            for name, check in self._geoChecks:
+                if not check(dxCallData, deCallData):
+                    self.rejected[name] += 1
+                    return False
+
+        self.passed += 1
+        return True
+
+
+    def accept(self, freq, mode, wpm, snr, dxCallData, deCallData):
+        return (self.acceptRaw(freq, mode, wpm, snr) and
+                self.acceptGeo(dxCallData, deCallData))
+
+
+    def report(self):
+        # Number of spots each filter rejected and the number passed
+        counts = {name: self.rejected[name]
+                  for name, check in self._rawChecks + self._geoChecks}
+        counts['passed'] = self.passed
+        return counts
+
+
+    # Check if freq of spot lines within a band specified
+    def filterBand(self, freq, mode, wpm, snr):
+        i = bisect.bisect_right(self._bandLows, freq) - 1
+        result = i >= 0 and freq <= self._bandHighs[i]
+
+        if self.logging and not result:
+            logging.info(f"filterBand(): freq {freq}")
+
+        return result
+
+
+    def filterMode(self, freq, mode, wpm, snr):
+        result = mode in self.modes
+
+        if self.logging and not result:
+            logging.info(f"filterMode(): cfg {sorted(self.modes)}, mode {mode}")
+
+        return result
+
+
+    def filterWPM(self, freq, mode, wpm, snr):
+        # only CW spots report a speed in WPM
+        result = wpm is None or self.minWPM <= wpm <= self.maxWPM
+
+        if self.logging and not result:
+            logging.info(f"filterWPM(): min {self.minWPM}, max {self.maxWPM} "
+                         f"WPM {wpm}")
+
+        return result
+
+
+    def filterSNR(self, freq, mode, wpm, snr):
+        result = snr is not None and snr >= self.minSNR
+
+        if self.logging and not result:
+            logging.info(f"filterSNR(): min {self.minSNR}, SNR {snr}")
+
+        return result
+
+
+    def filterMaidenhead(self, dxCallData, deCallData):
+        if self.logging:
+            logging.info(f"filterMaidenhead() dxMaid: {field(dxCallData, 'grid')}, "
+                         f"deMaid: {field(deCallData, 'grid')}")
+
+        return (matches(self.dxMaid, field(dxCallData, 'grid')[:2]) and
+                matches(self.deMaid, field(deCallData, 'grid')[:2]))
+
+
+    def filterITUZones(self, dxCallData, deCallData):
+        if self.logging:
+            logging.info(f"filterITUZones() dxITUZone: "
+                         f"{field(dxCallData, 'ituzone')}, "
+                         f"deITUZone: {field(deCallData, 'ituzone')}")
+
+        return (matches(self.dxITUZone, field(dxCallData, 'ituzone')) and
+                matches(self.deITUZone, field(deCallData, 'ituzone')))
+
+
+    def filterCQZones(self, dxCallData, deCallData):
+        if self.logging:
+            logging.info(f"filterCQZones() dxCQZone: "
+                         f"{field(dxCallData, 'cqzone')}, "
+                         f"deCQZone: {field(deCallData, 'cqzone')}")
+
+        return (matches(self.dxCQZone, field(dxCallData, 'cqzone')) and
+                matches(self.deCQZone, field(deCallData, 'cqzone')))
+
@@ -0,0 +1,276 @@
+# geo.py - Distances from the station to the spotted stations
+
+
+import math
+
+from geopy import distance
+
+# numpy is in requirements.txt, without it the fast distances are
+# computed one at a time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+METERS_PER_MILE = 1609.344
+
+# Central angle beyond which Lambert's formula loses accuracy, points
+# this close to antipodal (over about 11700 miles apart) get the geodesic
+LAMBERT_MAX_SIGMA = math.radians(170)
+
+
+def callPosition(callData):
+    # (lat, lon) of a QRZ record as floats, None if it has no position
+    if not callData or 'lat' not in callData or 'lon' not in callData:
+        return None
+
+    try:
+        return (float(callData['lat']), float(callData['lon']))
+    except (TypeError, ValueError):
+        return None
+
+
+def maidenheadToLatLon(locator):
+    # (lat, lon) of the centre of a Maidenhead locator of 2, 4, 6 or 8
+    # characters, e.g. FN or FN30 or FN30as, None if it is not valid
+    loc = locator.strip().upper()
+    if len(loc) not in (2, 4, 6, 8):
+        return None
+
+    # field, square, subsquare and extended square, each one splitting
+    # the one before into 18, 10, 24 and 10 parts
+    lon, lat = -180.0, -90.0
+    lonSize, latSize = 360.0, 180.0
+    for i in range(0, len(loc), 2):
+        pair = loc[i:i + 2]
+        if i == 0:
+            parts, base = 18, 'A'
+        elif i == 4:
+            parts, base = 24, 'A'
+        else:
+            parts, base = 10, '0'
+
+        x = ord(pair[0]) - ord(base)
+        y = ord(pair[1]) - ord(base)
+        if not (0 <= x < parts and 0 <= y < parts):
+            return None
+
+        lonSize /= parts
+        latSize /= parts
+        lon += x * lonSize
+        lat += y * latSize
+
+    return (lat + latSize / 2, lon + lonSize / 2)
+
+
+def geodesicMiles(p1, p2):
+    return distance.distance(p1, p2).miles
+
+
+def lambertMiles(p1, p2):
+    # Lambert's formula for long lines on the WGS84 ellipsoid, a great
+    # circle on the reduced latitudes corrected for the flattening.
+    # Within 0.12 miles of the geodesic up to 11000 miles.
+    lat1, lon1 = math.radians(p1[0]), math.radians(p1[1])
+    lat2, lon2 = math.radians(p2[0]), math.radians(p2[1])
+
+    b1 = math.atan((1 - WGS84_F) * math.tan(lat1))
+    b2 = math.atan((1 - WGS84_F) * math.tan(lat2))
+
+    h = (math.sin((b2 - b1) / 2) ** 2 +
+         math.cos(b1) * math.cos(b2) * math.sin((lon2 - lon1) / 2) ** 2)
+    sigma = 2 * math.asin(math.sqrt(min(1.0, h)))
+
+    if sigma < 1e-12:
+        return 0.0
+
+    if sigma > LAMBERT_MAX_SIGMA:
+        return geodesicMiles(p1, p2)
+
+    p = (b1 + b2) / 2
+    q = (b2 - b1) / 2
+    x = ((sigma - math.sin(sigma)) * math.sin(p) ** 2 * math.cos(q) ** 2 /
+         math.cos(sigma / 2) ** 2)
+    y = ((sigma + math.sin(sigma)) * math.cos(p) ** 2 * math.sin(q) ** 2 /
+         math.sin(sigma / 2) ** 2)
+
+    return WGS84_A * (sigma - WGS84_F / 2 * (x + y)) / METERS_PER_MILE
+
+
+def lambertMilesArray(lats, lons, position):
+    # lambertMiles() from position to each of the points lats, lons,
+    # vectorized with NumPy
+    lat1, lon1 = math.radians(position[0]), math.radians(position[1])
+    lat2 = numpy.radians(numpy.asarray(lats, dtype=float))
+    lon2 = numpy.radians(numpy.asarray(lons, dtype=float))
+
+    b1 = math.atan((1 - WGS84_F) * math.tan(lat1))
+    b2 = numpy.arctan((1 - WGS84_F) * numpy.tan(lat2))
+
+    h = (numpy.sin((b2 - b1) / 2) ** 2 +
+         math.cos(b1) * numpy.cos(b2) * numpy.sin((lon2 - lon1) / 2) ** 2)
+    sigma = 2 * numpy.arcsin(numpy.sqrt(numpy.minimum(1.0, h)))
+
+    p = (b1 + b2) / 2
+    q = (b2 - b1) / 2
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        x = ((sigma - numpy.sin(sigma)) * numpy.sin(p) ** 2 *
+             numpy.cos(q) ** 2 / numpy.cos(sigma / 2) ** 2)
+        y = ((sigma + numpy.sin(sigma)) * numpy.cos(p) ** 2 *
+             numpy.sin(q) ** 2 / numpy.sin(sigma / 2) ** 2)
+        miles = WGS84_A * (sigma - WGS84_F / 2 * (x + y)) / METERS_PER_MILE
+
+    miles[sigma < 1e-12] = 0.0
+
+    for i in numpy.flatnonzero(sigma > LAMBERT_MAX_SIGMA):
+        miles[i] = geodesicMiles(position, (float(lats[i]), float(lons[i])))
+
+    return miles
+
+
+
+class DistanceCache:
+    """Distances in miles from a station position to the positions of
+    QRZ records. A callsign, and every station in the same grid square
+    when QRZ only knows the grid, always has the same position, so the
+    distance is computed once per position and station.
+
+    The 'geodesic' method is geopy's ellipsoid geodesic. The 'fast'
+    method is Lambert's formula, well under a mile from the geodesic at
+    the displayed precision, and is computed for a whole batch of
+    records at once with prefetch() when NumPy is available."""
+
+    def __init__(self, method='geodesic', maxEntries=100000):
+        self.method = method
+        self.maxEntries = maxEntries
+        self._compute = lambertMiles if method == 'fast' else geodesicMiles
+
+        self._distances = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def miles(self, callData, position):
+        # Distance from position to the station of callData, None if
+        # the record has no position
+        there = callPosition(callData)
+        if there is None:
+            return None
+
+        key = (there, position)
+        d = self._distances.get(key)
+        if d is not None:
+            self.hits += 1
+            return d
+
+        self.misses += 1
+        d = self._compute(position, there)
+        self._store(key, d)
+
+        return d
+
+
+    def prefetch(self, callDatas, position):
+        # Compute the distances to the records not cached yet in one
+        # vectorized pass, the later miles() calls are cache hits
+        if self.method != 'fast' or numpy is None:
+            return
+
+        missing = []
+        for callData in callDatas:
+            there = callPosition(callData)
+            if there is not None and (there, position) not in self._distances:
+                missing.append(there)
+
+        if len(missing) < 2:
+            return
+
+        missing = list(set(missing))
+        miles = lambertMilesArray([p[0] for p in missing],
+                                  [p[1] for p in missing], position)
+        for there, d in zip(missing, miles.tolist()):
+            self._store((there, position), d)
+
+
+    def _store(self, key, d):
+        # positions are few, so simply start over when the cache is full
+        if len(self._distances) >= self.maxEntries:
+            self._distances.clear()
+
+        self._distances[key] = d
+
+
+
+class SkimmerTable:
+    """Locations of the RBN skimmers, read from a local file, so spots
+    can be filtered on the DE station without QRZ lookups. Each line
+    holds a skimmer callsign and its Maidenhead locator, optionally
+    followed by its latitude and longitude, separated by spaces or
+    commas. Lines starting with '#' are comments.
+
+      # call   grid    lat      lon
+      KM3T     FN42    42.72   -71.49
+      W3OA     FM16
+
+    The records look like QRZ records with the fields call, grid, lat
+    and lon, the position is the centre of the locator when not given."""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._records = {}
+        self.skipped = 0
+
+        if filename:
+            self.load(filename)
+
+
+    def load(self, filename):
+        with open(filename) as f:
+            for line in f:
+                fields = line.replace(',', ' ').split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+
+                record = self._record(fields)
+                if record is None:
+                    self.skipped += 1
+                    continue
+
+                self._records[record['call']] = record
+
+
+    @staticmethod
+    def _record(fields):
+        if len(fields) < 2:
+            return None
+
+        # skimmers appear in spots without their -# or -N suffix
+        call = fields[0].upper().split('-')[0]
+        grid = fields[1].upper()
+
+        position = maidenheadToLatLon(grid)
+        if len(fields) >= 4:
+            try:
+                position = (float(fields[2]), float(fields[3]))
+            except ValueError:
+                return None
+
+        if position is None:
+            return None
+
+        return {'call': call, 'grid': grid, 'lat': position[0],
+                'lon': position[1]}
+
+
+    def callData(self, callsign):
+        return self._records.get(callsign)
+
+
+    def __len__(self):
+        return len(self._records)
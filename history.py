@@ -0,0 +1,199 @@
+# history.py - SQLite history of the spots shown, written in batches
+
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from filters import bandOf
+from spot import spotTimestamp
+
+
+
+# Spots waiting for the writer before new spots are dropped
+HISTORY_QUEUE_SIZE = 100000
+
+HISTORY_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS spots (
+           time REAL NOT NULL,
+           rbntime TEXT,
+           dx TEXT NOT NULL,
+           de TEXT NOT NULL,
+           freq REAL NOT NULL,
+           band TEXT,
+           mode TEXT,
+           snr INTEGER,
+           wpm INTEGER,
+           type TEXT,
+           country TEXT,
+           state TEXT,
+           grid TEXT,
+           cqzone TEXT,
+           ituzone TEXT,
+           miles REAL)""",
+    "CREATE INDEX IF NOT EXISTS spots_dx ON spots (dx, band, time)",
+    "CREATE INDEX IF NOT EXISTS spots_de ON spots (de, band, time)",
+    "CREATE INDEX IF NOT EXISTS spots_time ON spots (time)",
+]
+
+HISTORY_COLUMNS = ('time', 'rbntime', 'dx', 'de', 'freq', 'band', 'mode',
+                   'snr', 'wpm', 'type', 'country', 'state', 'grid',
+                   'cqzone', 'ituzone', 'miles')
+
+HISTORY_INSERT = (f"INSERT INTO spots ({', '.join(HISTORY_COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * len(HISTORY_COLUMNS))})")
+
+
+def openHistory(filename, readOnly=False):
+    # Connection to a history file, created with its schema when it
+    # does not exist yet
+    if readOnly:
+        return sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+
+    db = sqlite3.connect(filename, check_same_thread=False)
+
+    # readers such as spotquery.py do not block the writer
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    with db:
+        for statement in HISTORY_SCHEMA:
+            db.execute(statement)
+
+    return db
+
+
+def historyWhere(dx=None, de=None, band=None, mode=None, since=None,
+                 until=None):
+    # WHERE clause and its parameters selecting spots, every criterion
+    # given must match
+    terms = []
+    params = []
+    for column, value in (('dx', dx), ('de', de), ('band', band),
+                          ('mode', mode)):
+        if value:
+            terms.append(f"{column} = ?")
+            params.append(value.lower() if column == 'band'
+                          else value.upper())
+
+    if since is not None:
+        terms.append("time >= ?")
+        params.append(since)
+    if until is not None:
+        terms.append("time < ?")
+        params.append(until)
+
+    where = f" WHERE {' AND '.join(terms)}" if terms else ""
+    return where, params
+
+
+def querySpots(db, limit=None, **criteria):
+    # Spots matching criteria, newest first, as dicts
+    where, params = historyWhere(**criteria)
+    sql = (f"SELECT {', '.join(HISTORY_COLUMNS)} FROM spots{where} "
+           f"ORDER BY time DESC")
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+
+    for row in db.execute(sql, params):
+        yield dict(zip(HISTORY_COLUMNS, row))
+
+
+def querySkimmers(db, **criteria):
+    # One row per skimmer with spots matching criteria: the skimmer,
+    # its number of spots, best SNR, first and last time heard, the
+    # skimmers with the most spots first
+    where, params = historyWhere(**criteria)
+    sql = (f"SELECT de, COUNT(*), MAX(snr), MIN(time), MAX(time) "
+           f"FROM spots{where} GROUP BY de ORDER BY COUNT(*) DESC, de")
+
+    return db.execute(sql, params).fetchall()
+
+
+
+class SpotHistory:
+    """Appends the spots that pass the filters, with the QRZ data they
+    were shown with, to a SQLite history file. Spots are handed to a
+    writer thread and inserted in one transaction per batch of up to
+    batchSize spots or flushInterval seconds, so the spot pipeline only
+    pays for a queue put. If the writer falls HISTORY_QUEUE_SIZE spots
+    behind, new spots are dropped and counted rather than waited on."""
+
+    def __init__(self, filename, batchSize=500, flushInterval=1.0,
+                 logging=0):
+        self.filename = filename
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.logging = logging
+
+        self._db = openHistory(filename)
+        self._queue = queue.Queue(HISTORY_QUEUE_SIZE)
+
+        self.written = 0
+        self.dropped = 0
+
+        self._writer = threading.Thread(target=self._writeLoop,
+                                        name='history', daemon=True)
+        self._writer.start()
+
+
+    def add(self, spot, dxCallData, miles=None):
+        # The time of a spot is its HHMMZ time dated by the feed, a
+        # replayed or backlogged spot is recorded when it was spotted
+        data = dxCallData or {}
+        spotTime = spot.timestamp
+        if spotTime is None:
+            spotTime = spotTimestamp(spot.time, time.time())
+
+        row = (spotTime, spot.time, spot.dx, spot.de, spot.freq,
+               bandOf(spot.freq), spot.mode, spot.snr, spot.wpm, spot.type,
+               data.get('country'), data.get('state'), data.get('grid'),
+               data.get('cqzone'), data.get('ituzone'), miles)
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+
+    def _writeLoop(self):
+        # Collect a batch, starting with the first spot waiting, until
+        # it is full or flushInterval has passed, and insert it in one
+        # transaction. A None on the queue ends the loop.
+        done = False
+        while not done:
+            row = self._queue.get()
+            if row is None:
+                break
+
+            rows = [row]
+            deadline = time.monotonic() + self.flushInterval
+            while len(rows) < self.batchSize:
+                remaining = deadline - time.monotonic()
+                try:
+                    row = self._queue.get(timeout=max(0, remaining))
+                except queue.Empty:
+                    break
+                if row is None:
+                    done = True
+                    break
+                rows.append(row)
+
+            try:
+                with self._db:
+                    self._db.executemany(HISTORY_INSERT, rows)
+                self.written += len(rows)
+            except sqlite3.Error as e:
+                self.dropped += len(rows)
+                if self.logging:
+                    logging.info(f"SpotHistory failed to write "
+                                 f"{len(rows)} spots: {e}")
+
+        self._db.close()
+
+
+    def close(self):
+        # Write the spots still queued and close the file
+        self._queue.put(None)
+        self._writer.join()
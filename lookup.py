@@ -0,0 +1,205 @@
+# lookup.py - Background QRZ callsign lookups for the RBN spot pipeline
+
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+
+
+
+class QRZLookupPool:
+    """Run QRZ callsign lookups on a pool of worker threads so the
+    RBN read loop never waits on a round trip to qrz.com. Requests
+    for a callsign that is already being looked up share the lookup in
+    flight instead of starting another one."""
+
+    def __init__(self, qrz, args, workers=4):
+        self.qrz = qrz
+        self.args = args
+        self.logging = args['logging']
+
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='qrz')
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+
+    def lookup(self, callsign):
+        # Return a future holding the QRZ data for callsign, merging
+        # this request with any lookup of the same callsign in flight
+        with self._lock:
+            future = self._inflight.get(callsign)
+            if future is not None:
+                return future
+
+            future = self._executor.submit(self.qrz.getCallsignData,
+                                           callsign, self.args)
+            self._inflight[callsign] = future
+
+        # registered outside the lock, the callback runs immediately
+        # in this thread if the lookup has already finished
+        future.add_done_callback(lambda f: self._lookupDone(callsign, f))
+
+        if self.logging:
+            logging.info(f"QRZLookupPool.lookup() queued {callsign}")
+
+        return future
+
+
+    def _lookupDone(self, callsign, future):
+        with self._lock:
+            if self._inflight.get(callsign) is future:
+                del self._inflight[callsign]
+
+
+    def __len__(self):
+        # lookups in flight
+        return len(self._inflight)
+
+
+    def close(self):
+        # Drop lookups that have not started yet and let the running
+        # ones finish in the background. Cancelling runs _lookupDone(),
+        # which takes the lock, so the futures are cancelled after it
+        # is released.
+        with self._lock:
+            futures = list(self._inflight.values())
+            self._inflight.clear()
+
+        for future in futures:
+            future.cancel()
+
+        self._executor.shutdown(wait=False)
+
+
+
+class PendingSpot:
+    """An RBN spot parked until the QRZ data for its callsigns has
+    arrived or its lookup timeout has expired."""
+
+    __slots__ = ('spot', 'futures', 'local', 'received', 'deadline',
+                 'showOnTimeout', 'friend', 'rejected')
+
+    def __init__(self, spot, timeout, showOnTimeout):
+        self.spot = spot
+        self.futures = {}
+        self.local = None
+        self.received = time.monotonic()
+        self.deadline = self.received + timeout
+        self.showOnTimeout = showOnTimeout
+
+        # set by the filter stages run before the lookups
+        self.friend = False
+        self.rejected = False
+
+
+    def setLocal(self, callsign, callData):
+        # Data for callsign known without a QRZ lookup, used when there
+        # is no lookup or it fails and completed by the QRZ data
+        if self.local is None:
+            self.local = {}
+        self.local[callsign] = callData
+
+
+    def ready(self):
+        # True when the lookups are done or the deadline has passed
+        if time.monotonic() >= self.deadline:
+            return True
+
+        for future in self.futures.values():
+            if not future.done():
+                return False
+
+        return True
+
+
+    async def wait(self):
+        # Wait until every lookup of the spot is done or the deadline
+        # has passed, leaving the event loop free meanwhile
+        futures = [asyncio.wrap_future(f) for f in self.futures.values()
+                   if not f.done()]
+        remaining = self.deadline - time.monotonic()
+        if futures and remaining > 0:
+            await asyncio.wait(futures, timeout=remaining)
+
+
+    def callData(self, callsign):
+        # QRZ data for callsign, on top of the data known without a
+        # lookup. Without local data, a lookup that failed returns None
+        # and a lookup that has not finished by the deadline returns
+        # None (drop the spot) or an empty record (show it without QRZ
+        # data), depending on the timeout action configured.
+        local = None
+        if self.local is not None:
+            local = self.local.get(callsign)
+
+        future = self.futures.get(callsign)
+        if future is None:
+            return local
+
+        if future.done():
+            if future.cancelled() or future.exception() is not None:
+                return local
+
+            data = future.result()
+            if data is None or not local:
+                return data if data is not None else local
+
+            merged = dict(local)
+            merged.update(data)
+            return merged
+
+        if local is not None:
+            return local
+
+        if self.showOnTimeout:
+            return {}
+
+        return None
+
+
+
+def batchDxData(batch):
+    # QRZ data of the DX stations of the spots of a batch that passed
+    # the filters run before the lookups
+    return [pending.callData(pending.spot.dx) for pending in batch
+            if pending is not None and pending.spot is not None and
+            not pending.rejected]
+
+
+
+class ReadyBatches:
+    """Takes the PendingSpots from a queue in arrival order, in batches
+    of consecutive spots that are ready, so the stage after the lookups
+    can work on a block of spots at once. A batch waits for its first
+    spot only, spots that are not ready yet start the next batch. A
+    None on the queue marks the end of the input and ends the last
+    batch."""
+
+    def __init__(self, queue, maxSpots=256):
+        self.queue = queue
+        self.maxSpots = maxSpots
+        self._held = []
+
+
+    async def next(self):
+        parked = self._held.pop() if self._held else await self.queue.get()
+        batch = [parked]
+        if parked is None:
+            return batch
+
+        await parked.wait()
+
+        while len(batch) < self.maxSpots and not self.queue.empty():
+            parked = self.queue.get_nowait()
+            if parked is not None and not parked.ready():
+                self._held.append(parked)
+                break
+
+            batch.append(parked)
+            if parked is None:
+                break
+
+        return batch
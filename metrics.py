@@ -0,0 +1,276 @@
+# metrics.py - Counters and latency histograms of the spot pipeline,
+# served as Prometheus text and summarized in a status line
+
+
+import asyncio
+import bisect
+import threading
+import time
+
+from spot import spotTimestamp
+
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Seconds a metrics HTTP client gets to send its request
+METRICS_REQUEST_TIMEOUT = 5
+
+
+def labelText(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+
+class Histogram:
+    """Distribution of latencies in seconds over fixed buckets. observe()
+    is a bisect and three increments under a lock, so it can be called
+    for every spot and from the QRZ worker threads."""
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding quantile q, None if empty
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else None
+
+        return None
+
+
+    def lines(self):
+        out = [f"# HELP {self.name} {self.help}",
+               f"# TYPE {self.name} histogram"]
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            out.append(f'{self.name}_bucket{{le="{bound:g}"}} {seen}')
+        out.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        out.append(f"{self.name}_sum {self.sum:.6f}")
+        out.append(f"{self.name}_count {self.count}")
+
+        return out
+
+
+
+class Collected:
+    """A counter or gauge read when the metrics are collected, from a
+    function returning its value, or a dict of values by label value.
+    The pipeline already counts most things, these cost nothing until
+    they are read."""
+
+    def __init__(self, name, help, kind, read, label=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+        self.label = label
+
+
+    def lines(self):
+        out = [f"# HELP {self.name} {self.help}",
+               f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.read()
+        except Exception:
+            return []
+
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                out.append(f"{self.name}{labelText([(self.label, key)])} {v}")
+        else:
+            out.append(f"{self.name} {value}")
+
+        return out
+
+
+
+class Metrics:
+    """The metrics of the program by name. Histograms are timed by the
+    pipeline stages, counters and gauges are collected from the objects
+    that keep them. text() renders all of them in the Prometheus text
+    format, status() summarizes the rates since its last call in one
+    line."""
+
+    def __init__(self):
+        self._metrics = {}
+        self.started = time.monotonic()
+
+        # lines read by feed and spots shown, counted by the pipeline
+        self.linesRead = {}
+        self.spotsShown = 0
+
+        self.park = self.histogram(
+            'rbn_park_seconds',
+            'Time to parse a line, run the raw filters and start its '
+            'lookups')
+        self.filter = self.histogram(
+            'rbn_filter_seconds',
+            'Time to run the QRZ data filters of a spot and format it')
+        self.render = self.histogram(
+            'rbn_render_frame_seconds', 'Time to write a display frame')
+        self.lag = self.histogram(
+            'rbn_pipeline_lag_seconds',
+            'Time from reading a spot to showing it, QRZ lookups included')
+        self.age = self.histogram(
+            'rbn_spot_age_seconds',
+            'Time from the RBN time stamp of a spot, to the minute, to '
+            'showing it')
+
+        self.collect('rbn_lines_read_total', 'Lines read from RBN by feed',
+                     'counter', lambda: dict(self.linesRead), 'feed')
+        self.collect('rbn_spots_shown_total', 'Spots shown', 'counter',
+                     lambda: self.spotsShown)
+        self.collect('rbn_uptime_seconds', 'Seconds since start', 'gauge',
+                     lambda: round(time.monotonic() - self.started, 3))
+
+        self._last = None
+
+
+    def shown(self, received, rbnTime):
+        # Count a spot shown, read at monotonic time received and
+        # stamped rbnTime (HHMMZ) by RBN
+        self.spotsShown += 1
+        self.lag.observe(time.monotonic() - received)
+        if rbnTime:
+            now = time.time()
+            self.age.observe(max(0.0, now - spotTimestamp(rbnTime, now)))
+
+
+    def add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, buckets))
+
+
+    def collect(self, name, help, kind, read, label=None):
+        # A counter or gauge read from read() when collected, replacing
+        # any metric of the same name
+        return self.add(Collected(name, help, kind, read, label))
+
+
+    def text(self):
+        out = []
+        for metric in self._metrics.values():
+            out.extend(metric.lines())
+
+        return "\n".join(out) + "\n"
+
+
+    def status(self):
+        # Rates since the previous status line, and the median and 99th
+        # percentile latencies so far
+        now = time.monotonic()
+        read = sum(self.linesRead.values())
+        if self._last is None:
+            since, lastRead, lastShown = self.started, 0, 0
+        else:
+            since, lastRead, lastShown = self._last
+        self._last = (now, read, self.spotsShown)
+
+        seconds = max(now - since, 1e-9)
+        line = (f"read {(read - lastRead) / seconds:.1f}/s  shown "
+                f"{(self.spotsShown - lastShown) / seconds:.1f}/s")
+
+        for label, histogram in (('lag', self.lag), ('park', self.park),
+                                 ('filter', self.filter)):
+            p50 = histogram.quantile(0.5)
+            p99 = histogram.quantile(0.99)
+            if p50 is not None:
+                line += f"  {label} {secondsText(p50)}/{secondsText(p99)}"
+
+        ratio = self._metrics.get('rbn_qrz_cache_hit_ratio')
+        if ratio is not None:
+            line += f"  cache {ratio.read():.0%}"
+
+        qrz = self._metrics.get('rbn_qrz_http_seconds')
+        if qrz is not None and qrz.count:
+            line += (f"  qrz {qrz.count} "
+                     f"{secondsText(qrz.quantile(0.5))}")
+
+        return line
+
+
+    async def serve(self, host, port):
+        # HTTP endpoint answering every GET with the metrics
+        return await asyncio.start_server(self._handle, host, port)
+
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(),
+                                             METRICS_REQUEST_TIMEOUT)
+            # skip the request headers
+            while True:
+                header = await asyncio.wait_for(reader.readline(),
+                                                METRICS_REQUEST_TIMEOUT)
+                if header in (b'\r\n', b'\n', b''):
+                    break
+
+            if request.split()[:1] == [b'GET']:
+                body = self.text().encode()
+                status = b"200 OK"
+            else:
+                body = b"Only GET is supported\n"
+                status = b"405 Method Not Allowed"
+
+            writer.write(b"HTTP/1.0 " + status + b"\r\n"
+                         b"Content-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() +
+                         b"\r\n\r\n" + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def statusLoop(self, interval, write):
+        # Pass a status line to write() every interval seconds until
+        # cancelled
+        while True:
+            await asyncio.sleep(interval)
+            write(self.status())
+
+
+
+def secondsText(seconds):
+    if seconds is None:
+        return "-"
+    if seconds < 0.001:
+        return f"{seconds * 1e6:.0f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.0f}ms"
+
+    return f"{seconds:g}s"
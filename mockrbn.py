@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+# A local stand-in for the RBN telnet server, for load and soak testing
+# rbn.py without connecting to telnet.reversebeacon.net. It runs the RBN
+# login dialog and then streams synthetic spots, or the lines of a
+# recorded capture, at a configurable rate with optional bursts, stalls
+# and disconnects. Normal invocation is:
+#
+#   $ ./mockrbn.py --port 7300 --rate 100 --burst_every 30 --burst_size 2000
+#   $ ./rbn.py -f rbn.cfg --host localhost --port 7300 --feed cw
+#
+# Run a second server with --ft8 on the FT8 port to feed both of the
+# connections rbn.py makes:
+#
+#   $ ./mockrbn.py --port 7301 --ft8 --rate 1000
+#   $ ./rbn.py -f rbn.cfg --host localhost --port 7300 --ft8_port 7301
+#
+
+
+import asyncio
+import configargparse
+import datetime
+import itertools
+
+from replay import *
+from synth import *
+
+
+
+def parseArguments():
+    p = ("Streams RBN style spots to rbn.py clients. A contest weekend "
+         "peaks at a few hundred spots per second on the CW port.")
+
+    parser = configargparse.ArgumentParser(description='Mock RBN telnet '
+                                           'server.', epilog=p)
+
+    parser.add_argument('--host', action='store', dest='host',
+                        default='localhost', help='Address to listen on')
+    parser.add_argument('--port', action='store', dest='port', type=int,
+                        default=7300, help='Port to listen on')
+    parser.add_argument('--rate', action='store', dest='rate', type=float,
+                        default=50, help='Spots per second sent to a client')
+    parser.add_argument('--ft8', action='store_true', dest='ft8',
+                        help='Send FT8 and FT4 spots like the RBN FT8 port')
+    parser.add_argument('--replay', action='store', dest='replay',
+                        help='Send the lines of a recorded RBN capture, in a '
+                        'loop, instead of synthetic spots')
+    parser.add_argument('--burst_every', action='store', dest='burstEvery',
+                        type=float, default=0,
+                        help='Seconds between bursts, 0 for no bursts')
+    parser.add_argument('--burst_size', action='store', dest='burstSize',
+                        type=int, default=1000,
+                        help='Extra spots sent at once in a burst')
+    parser.add_argument('--stall_every', action='store', dest='stallEvery',
+                        type=float, default=0,
+                        help='Seconds between stalls, 0 for no stalls')
+    parser.add_argument('--stall_secs', action='store', dest='stallSecs',
+                        type=float, default=10,
+                        help='Length of a stall, the spots held back are '
+                        'sent when it ends')
+    parser.add_argument('--disconnect_every', action='store',
+                        dest='disconnectEvery', type=float, default=0,
+                        help='Seconds before a client is disconnected, 0 to '
+                        'never disconnect')
+    parser.add_argument('--status_interval', action='store',
+                        dest='statusInterval', type=float, default=10,
+                        help='Seconds between status lines')
+
+    return parser.parse_args()
+
+
+def spotSource(args):
+    # Function returning the next spot line to send
+    if args.replay:
+        with openCapture(args.replay) as f:
+            lines = [l.rstrip(b'\r\n') + b'\r\n' for l in f
+                     if l.startswith(b'DX de ')]
+        return itertools.cycle(lines).__next__
+
+    # spot times advance at the rate the spots are sent
+    modes = SYNTH_FT8_MODES if args.ft8 else SYNTH_MODES
+    generator = SpotGenerator(seed=int(datetime.datetime.now().timestamp()),
+                              spotsPerMinute=max(1, int(args.rate * 60)),
+                              modes=modes)
+    return generator.line
+
+
+
+class MockRBNServer:
+    """Serves each client the RBN login dialog followed by a stream of
+    spots. The stream catches up after a stall or a slow client, so the
+    write buffer of a connection shows how far its client is behind."""
+
+    # Seconds between the writes of the spots due
+    TICK = 0.05
+
+
+    def __init__(self, args):
+        self.args = args
+        self.clients = {}
+        self.users = 0
+
+        # spots sent to each client at the previous status line
+        self.lastSent = {}
+
+
+    async def handleClient(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        loggedIn = False
+
+        try:
+            call = await self.login(reader, writer)
+            if call is None:
+                return
+
+            self.users += 1
+            loggedIn = True
+            print(f"{call} connected from {peer}")
+            await self.stream(call, writer)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f"{peer} connection lost: {e}")
+        finally:
+            if loggedIn:
+                self.users -= 1
+            self.clients.pop(writer, None)
+            self.lastSent.pop(writer, None)
+            writer.close()
+
+
+    async def login(self, reader, writer):
+        writer.write(b"Please enter your call: ")
+        await writer.drain()
+
+        line = await reader.readline()
+        call = line.decode('ascii', 'replace').strip().upper()
+        if not call:
+            return None
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        writer.write(f"\r\nHello {call}, this is the mock RBN server\r\n"
+                     f"Local users = {self.users + 1}\r\n\r\n"
+                     f"{call} de MOCKRBN {now:%d-%b-%Y %H%MZ} >\r\n".
+                     encode('ascii'))
+        await writer.drain()
+
+        return call
+
+
+    async def stream(self, call, writer):
+        args = self.args
+        nextLine = spotSource(args)
+        loop = asyncio.get_running_loop()
+
+        start = loop.time()
+        nextBurst = start + args.burstEvery
+        nextStall = start + args.stallEvery
+        disconnect = start + args.disconnectEvery
+
+        stats = {'call': call, 'sent': 0, 'bursts': 0, 'stalls': 0}
+        self.clients[writer] = stats
+
+        while True:
+            now = loop.time()
+
+            if args.disconnectEvery and now >= disconnect:
+                print(f"{call} disconnected after {args.disconnectEvery} s")
+                return
+
+            if args.stallEvery and now >= nextStall:
+                stats['stalls'] += 1
+                await asyncio.sleep(args.stallSecs)
+                nextStall = loop.time() + args.stallEvery
+                continue
+
+            due = int((now - start) * args.rate) - stats['sent']
+            if args.burstEvery and now >= nextBurst:
+                stats['bursts'] += 1
+                due += args.burstSize
+                start -= args.burstSize / args.rate
+                nextBurst = now + args.burstEvery
+
+            if due > 0:
+                writer.write(b"".join(nextLine() for i in range(due)))
+                stats['sent'] += due
+
+            # waits here while the client is not keeping up
+            await writer.drain()
+            await asyncio.sleep(self.TICK)
+
+
+    async def status(self):
+        interval = self.args.statusInterval
+
+        while True:
+            await asyncio.sleep(interval)
+
+            for writer, stats in list(self.clients.items()):
+                rate = (stats['sent'] - self.lastSent.get(writer, 0)) / interval
+                self.lastSent[writer] = stats['sent']
+                backlog = writer.transport.get_write_buffer_size()
+                print(f"{stats['call']}: sent {stats['sent']} spots, "
+                      f"{rate:.0f}/s, {stats['bursts']} bursts, "
+                      f"{stats['stalls']} stalls, "
+                      f"{backlog} bytes not yet read")
+
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handleClient, self.args.host,
+                                            self.args.port)
+        print(f"Mock RBN server on {self.args.host}:{self.args.port}, "
+              f"{self.args.rate} spots/s")
+
+        if self.args.statusInterval > 0:
+            asyncio.get_running_loop().create_task(self.status())
+
+        async with server:
+            await server.serve_forever()
+
+
+
+def main():
+    args = parseArguments()
+
+    try:
+        asyncio.run(MockRBNServer(args).serve())
+    except KeyboardInterrupt:
+        print("\nMock RBN server stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# profiling.py - Profile a running rbn.py on demand: SIGUSR1 starts and
+# stops cProfile, SIGUSR2 writes a tracemalloc snapshot
+
+
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+
+
+
+class Profiler:
+    """On demand profiling of the running program, driven by signals so
+    a client falling behind can be looked at without a restart.
+
+    The first SIGUSR1 starts cProfile, the next one stops it and writes
+    the functions taking the most time to rbn-profile-<time>.txt in
+    directory, with the raw statistics in a .prof file next to it for
+    pstats or snakeviz. cProfile sees the thread running the event
+    loop, parsing, filtering and display. The QRZ requests run in the
+    lookup worker threads and are timed by the rbn_qrz_http_seconds
+    metric instead.
+
+    The first SIGUSR2 only arms tracemalloc: its report holds little
+    more than the allocations of the snapshot itself. Every later one
+    writes the lines holding the most memory, and how that changed
+    since the previous snapshot, to rbn-memory-<time>.txt. tracemalloc
+    only sees the allocations made once it is started, and slows the
+    program while it runs.
+
+    The signal handlers only note the signal. The profile is started
+    and stopped and the reports are written by the event loop attached
+    with attach(), or by close() for signals received while there is
+    none."""
+
+    def __init__(self, directory, top=25, logging=0):
+        self.directory = directory
+        self.top = top
+        self.logging = logging
+
+        self._profile = None
+        self._started = None
+        self._snapshot = None
+
+        self._loop = None
+        self._signals = []
+
+
+    def install(self):
+        # Handle SIGUSR1 and SIGUSR2, the SIGINT handler is left alone.
+        # Platforms without them (Windows) have no profiling.
+        if not hasattr(signal, 'SIGUSR1'):
+            return False
+
+        signal.signal(signal.SIGUSR1, self._signalled)
+        signal.signal(signal.SIGUSR2, self._signalled)
+        return True
+
+
+    def attach(self, loop):
+        # Event loop handling the signals, None when it stops. The
+        # signals received before it started are handled now.
+        self._loop = loop
+        if loop is not None and self._signals:
+            loop.call_soon(self.handleSignals)
+
+
+    def _signalled(self, signum, frame):
+        # No I/O in the signal handler, the loop does the work
+        self._signals.append(signum)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.handleSignals)
+
+
+    def handleSignals(self):
+        while self._signals:
+            if self._signals.pop(0) == signal.SIGUSR1:
+                self.toggleProfile()
+            else:
+                self.memorySnapshot()
+
+
+    def _filename(self, kind, extension):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.directory,
+                            f"rbn-{kind}-{stamp}.{extension}")
+
+
+    def _report(self, message):
+        print(f"\n{message}")
+        if self.logging:
+            logging.info(message)
+
+
+    def toggleProfile(self):
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._started = time.monotonic()
+            self._profile.enable()
+            self._report("Profiling started, send SIGUSR1 again to stop")
+            return
+
+        self._profile.disable()
+        profile = self._profile
+        seconds = time.monotonic() - self._started
+        self._profile = None
+
+        try:
+            filename = self.writeProfile(profile, seconds)
+        except OSError as e:
+            self._report(f"Can't write the profile: {e}")
+            return
+
+        self._report(f"Profile of {seconds:.1f} s written to {filename}")
+
+
+    def close(self):
+        # Handle the signals left and write the profile still running
+        # when the program ends
+        self._loop = None
+        self.handleSignals()
+        if self._profile is not None:
+            self.toggleProfile()
+
+
+    def writeProfile(self, profile, seconds):
+        # Text report sorted by cumulative and by own time, and the raw
+        # statistics
+        filename = self._filename('profile', 'txt')
+        profile.dump_stats(filename[:-len('.txt')] + '.prof')
+
+        out = io.StringIO()
+        out.write(f"Profile of {seconds:.1f} s taken "
+                  f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}\n\n")
+        stats = pstats.Stats(profile, stream=out)
+        stats.strip_dirs()
+        for order in ('cumulative', 'tottime'):
+            out.write(f"Sorted by {order}\n")
+            stats.sort_stats(order).print_stats(self.top)
+
+        with open(filename, 'w') as f:
+            f.write(out.getvalue())
+
+        return filename
+
+
+    def memorySnapshot(self):
+        # The first snapshot, taken as tracing starts, is the baseline
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._snapshot = None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+        previous = self._snapshot
+        try:
+            filename = self.writeSnapshot(snapshot, previous)
+        except OSError as e:
+            self._report(f"Can't write the memory snapshot: {e}")
+            return
+        finally:
+            self._snapshot = snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        self._report(f"Memory snapshot ({current / 1024:.0f} KiB traced, "
+                     f"peak {peak / 1024:.0f} KiB) written to {filename}")
+        if previous is None:
+            self._report("Memory tracing started, send SIGUSR2 again for "
+                         "the allocations since")
+
+
+    def writeSnapshot(self, snapshot, previous=None):
+        filename = self._filename('memory', 'txt')
+        current, peak = tracemalloc.get_traced_memory()
+
+        with open(filename, 'w') as f:
+            f.write(f"Memory traced {current / 1024:.0f} KiB, peak "
+                    f"{peak / 1024:.0f} KiB\n\n")
+
+            f.write(f"Top {self.top} lines\n")
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                f.write(f"{stat}\n")
+
+            if previous is not None:
+                f.write(f"\nTop {self.top} changes since the previous "
+                        f"snapshot\n")
+                for stat in snapshot.compare_to(previous,
+                                                'lineno')[:self.top]:
+                    f.write(f"{stat}\n")
+
+        return filename
@@ -8,12 +8,40 @@ import logging
 import os
 import re
 import requests
-import shelve
-import xmltodict
+from requests.adapters import HTTPAdapter
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
 
+from cache import *
+from metrics import Histogram
 
 
 
+# Fields of a QRZ callsign record that are kept, the rest of the reply
+# is skipped
+QRZ_FIELDS = frozenset(('call', 'fname', 'name', 'addr2', 'state',
+                        'country', 'grid', 'lat', 'lon', 'cqzone',
+                        'ituzone'))
+
+# Program name sent to qrz.com with the login
+QRZ_AGENT = 'rbn'
+
+# Seconds to connect to and to wait for a reply from qrz.com
+QRZ_REQUEST_TIMEOUT = (5, 10)
+
+# Bytes of a reply fed to the XML parser at a time
+QRZ_CHUNK_SIZE = 4096
+
+# Queries that may be sent at once before --qrz_rate applies
+QRZ_BURST = 10
+
+# Seconds before a callsign is queried again after a network, server
+# or login error. Kept in memory only, unlike the negative cache of
+# callsigns qrz.com does not know.
+QRZ_RETRY_DELAY = 60
+
+
 class QRZerror(Exception):
     pass
 
@@ -22,51 +50,222 @@ class CallsignNotFound(Exception):
     pass
 
 
+def parseQRZReply(chunks):
+    # The Session fields and the QRZ_FIELDS of the Callsign record (None
+    # if there is none) of a reply read as chunks of bytes. Elements are
+    # dropped as soon as they are parsed.
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    session = {}
+    callData = None
+    section = None
+
+    def drain():
+        nonlocal callData, section
+        for event, element in parser.read_events():
+            # the tags are in the qrz.com namespace, '{...}call'
+            tag = element.tag.rpartition('}')[2]
+            if event == 'start':
+                if tag in ('Session', 'Callsign'):
+                    section = tag
+                    if tag == 'Callsign':
+                        callData = {}
+                continue
+
+            if tag == section:
+                section = None
+            elif section == 'Session':
+                session[tag] = element.text or ''
+            elif section == 'Callsign' and tag in QRZ_FIELDS:
+                callData[tag] = element.text or ''
+            element.clear()
+
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            drain()
+        parser.close()
+        drain()
+    except ElementTree.ParseError as e:
+        raise QRZerror(f"Unexpected API Result: {e}")
+
+    return session, callData
+
+
+
+class TokenBucket:
+    """Rate limit shared by the lookup worker threads. Up to burst
+    queries go out at once, after that rate per second. acquire() takes
+    a token, reserving the next one and sleeping until it is due when
+    the bucket is empty, so waiting workers are served in turn. A rate
+    of 0 is no limit."""
+
+    def __init__(self, rate, burst=QRZ_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        # Seconds waited for the token
+        if not self.rate:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+
 
 class QRZ:
 
-    QRZ_BASE_URL = 'http://xmldata.qrz.com/xml/current/'
+    QRZ_BASE_URL = 'https://xmldata.qrz.com/xml/current/'
     
 
-    def __init__(self, username, password, logging):
-        self._session = None
+    def __init__(self, username, password, logging, cacheFile=None,
+                 cacheTTL=30 * 86400, cacheSize=100000, memCacheSize=2000,
+                 negCacheFile=None, negCacheTTL=1800, negCacheMaxTTL=86400,
+                 workers=4, rate=5.0):
         self._session_key = None
 
+        # one keep-alive connection per lookup worker, shared by all
+        # the queries, certificates verified
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(1, workers)))
+
+        # qrz.com limits the rate of queries of a user
+        self._rateLimit = TokenBucket(rate)
+
         self.username = username
         self.password = password
         self.logging = logging
 
-        # open shelve file with QRZ callsign info storage
-        self.QRZ_SHELVE_FILE = os.path.join(os.environ['HOME'],
-                                            'amateur-radio/rbnData.db')
-        self.qrzLocalData = shelve.open(self.QRZ_SHELVE_FILE, flag='n')
+        # open shelve file with QRZ callsign info storage, records are
+        # kept across runs until they are older than cacheTTL seconds
+        if cacheFile is None:
+            cacheFile = os.path.join(os.environ['HOME'],
+                                     'amateur-radio/rbnData.db')
+        self.QRZ_SHELVE_FILE = cacheFile
+        self.qrzLocalData = CallsignCache(self.QRZ_SHELVE_FILE, cacheTTL,
+                                          cacheSize, logging)
+
+        # the most recently used records are also kept decoded in
+        # memory in front of the shelve file
+        self.qrzMemData = LRUCache(memCacheSize, cacheTTL)
+
+        # callsigns qrz.com could not resolve are not queried again
+        # until their backoff has passed
+        if negCacheFile is None:
+            negCacheFile = os.path.join(os.environ['HOME'],
+                                        'amateur-radio/rbnNegative.db')
+        self.qrzNegData = NegativeCache(negCacheFile, negCacheTTL,
+                                        negCacheMaxTTL, cacheSize, logging)
+
+        # lookups run on worker threads (see lookup.py), the session
+        # login must not be done concurrently
+        self._sessionLock = threading.Lock()
+
+        # callsign -> monotonic time it may be queried again after a
+        # transient error
+        self._retryAfter = {}
+        self._retryLock = threading.Lock()
+
+        self.httpSeconds = Histogram('rbn_qrz_http_seconds',
+                                     'Latency of the queries to qrz.com')
+        self.rateWait = Histogram('rbn_qrz_rate_wait_seconds',
+                                  'Time a query waited for the QRZ rate '
+                                  'limit')
+
+
+    # Class destructor, need to close the shelve file
+    def __del__(self):
+        self.close()
 
 
-    # Class destructor, need to close and remove the shelve file
-    def __del__(self):
-        self.qrzLocalData.close()
+    def close(self):
+        # Also run by __del__ when __init__ failed part way, so only
+        # what was opened is closed
+        if getattr(self, 'logging', 0) and hasattr(self, 'qrzNegData'):
+            logging.info(f"QRZ cache stats: {self.cacheStats()}")
 
-        
+        for name in ('qrzLocalData', 'qrzNegData', '_session'):
+            resource = getattr(self, name, None)
+            if resource is not None:
+                resource.close()
+
+
+    def cacheStats(self):
+        # Hit and miss counts of the memory and shelve cache tiers
+        return {'memHits': self.qrzMemData.hits,
+                'memMisses': self.qrzMemData.misses,
+                'memSize': len(self.qrzMemData),
+                'diskHits': self.qrzLocalData.hits,
+                'diskMisses': self.qrzLocalData.misses,
+                'diskSize': len(self.qrzLocalData),
+                'negHits': self.qrzNegData.hits,
+                'negSize': len(self.qrzNegData)}
+
+
+    def _query(self, params):
+        # Session fields and callsign record of one qrz.com query, sent
+        # when the rate limit allows it and parsed as it is received
+        self.rateWait.observe(self._rateLimit.acquire())
+
+        start = time.perf_counter()
+        try:
+            with self._session.get(self.QRZ_BASE_URL, params=params,
+                                   timeout=QRZ_REQUEST_TIMEOUT,
+                                   stream=True) as r:
+                if r.status_code != 200:
+                    raise QRZerror(f"Error Querying: Response code "
+                                   f"{r.status_code}")
+
+                return parseQRZReply(r.iter_content(QRZ_CHUNK_SIZE))
+        finally:
+            self.httpSeconds.observe(time.perf_counter() - start)
 
 
     def _get_session(self):
-        url = self.QRZ_BASE_URL + '?username={}&password={}'.\
-                                   format(self.username, self.password)
-        self._session = requests.Session()
-        self._session.verify = False
-        r = self._session.get(url)
+        session, callData = self._query({'username': self.username,
+                                         'password': self.password,
+                                         'agent': QRZ_AGENT})
 
-        if r.status_code == 200:
-            raw_session = xmltodict.parse(r.content)
-            self._session_key = raw_session['QRZDatabase']['Session']['Key']
-            if self._session_key:
-                return True
-        raise Exception('could not get QRZ session')
+        self._session_key = session.get('Key')
+        if not self._session_key:
+            raise QRZerror(f"could not get QRZ session: "
+                           f"{session.get('Error', 'no session key')}")
+
+        if self.logging:
+            logging.info("QRZ session started")
+
+
+    def _sessionKey(self, expired=None):
+        # The session key, logging in when there is none yet or it is
+        # the expired one. Workers finding the same expired key log in
+        # once, the others get the new key.
+        with self._sessionLock:
+            if self._session_key is None or self._session_key == expired:
+                self._session_key = None
+                self._get_session()
+
+            return self._session_key
 
 
     def getQRZCallsignData(self, callsign, retry=True, quiet=False):
-        if self._session_key is None:
-            self._get_session()
+        key = self._sessionKey()
 
         # search for '/' in callsigns and effectively remove it from
         # the callsign submitted to qrz.com
@@ -76,47 +275,33 @@ class QRZ:
             
         # print(f'callsignData: call: {callsign}')
 
-        url = self.QRZ_BASE_URL + '?s={}&callsign={}'.format(self._session_key,
-                                                             callsign)
-        r = self._session.get(url)
+        session, callData = self._query({'s': key, 'callsign': callsign})
 
-        if r.status_code != 200:
-            raise Exception("Error Querying: Response code {}".\
-                            format(r.status_code))
-
-        raw = xmltodict.parse(r.content).get('QRZDatabase')
-        if not raw:
-            raise QRZerror('Unexpected API Result')
-
-        if raw['Session'].get('Error'):
-            errormsg = raw['Session'].get('Error')
+        errormsg = session.get('Error')
+        if errormsg:
             if 'Session Timeout' in errormsg or 'Invalid session key' in errormsg:
                 if retry:
-                    self._session_key = None
-                    self._session = None
-
-                    return self.callsign(callsign, retry=False)
-                else:
-                    pass
+                    # log in again and repeat the query once
+                    self._sessionKey(expired=key)
+                    return self.getQRZCallsignData(callsign, retry=False,
+                                                   quiet=quiet)
             elif "not found" in errormsg.lower():
                 raise CallsignNotFound(errormsg)
 
-            raise QRZerror(raw['Session'].get('Error'))
+            raise QRZerror(errormsg)
 
-        else:
-            callData = raw.get('Callsign')
-            if callData:
-                if not quiet:
-                    print(f"Rcvd QRZ data for: {callsign}")
-                return callData
+        if callData:
+            if not quiet:
+                print(f"Rcvd QRZ data for: {callsign}")
+            return callData
 
-        raise Exception("Unhandled Error during Query")
+        raise QRZerror('Unexpected API Result')
 
 
     def localCallsignDataExists(self, callsign):
         result = False
         
-        if callsign in self.qrzLocalData:
+        if self.getLocalCallsignData(callsign) is not None:
             result = True
 
         return result
@@ -127,25 +312,74 @@ class QRZ:
         if self.logging:
             # logging.info(f"getLocalCallsignData() {self.qrzLocalData[callsign]}")
             logging.info(f"getLocalCallsignData() get call {callsign}")
-        return self.qrzLocalData[callsign]
+
+        callData = self.qrzMemData.get(callsign)
+        if callData is None:
+            callData = self.qrzLocalData.get(callsign)
+            if callData is not None:
+                self.qrzMemData.set(callsign, callData,
+                                    self.qrzLocalData.timestamp(callsign))
+
+        return callData
+
+
+    def _retryDue(self, callsign):
+        # False while a transient error of callsign is backing off
+        with self._retryLock:
+            retry = self._retryAfter.get(callsign)
+            if retry is None:
+                return True
+            if time.monotonic() < retry:
+                return False
+
+            del self._retryAfter[callsign]
+            return True
+
+
+    def _retryLater(self, callsign, error):
+        now = time.monotonic()
+        with self._retryLock:
+            self._retryAfter[callsign] = now + QRZ_RETRY_DELAY
+
+            # a long outage leaves many entries, drop those that are due
+            if len(self._retryAfter) > self.qrzLocalData.maxEntries:
+                self._retryAfter = {c: t for c, t in self._retryAfter.items()
+                                    if t > now}
+
+        if self.logging:
+            logging.info(f"QRZ lookup of {callsign} failed, retry in "
+                         f"{QRZ_RETRY_DELAY} s: {error}")
 
 
     def getCallsignData(self, callsign, args):
-        if self.localCallsignDataExists(callsign):
-            # callsign data has already been retrieved from qrz.com
-            # and is in the local shelve file
-            callData = self.getLocalCallsignData(callsign)
-        else:
-            # callsign data hasn't been retrieved from qrz.com so get it
+        callData = self.getLocalCallsignData(callsign)
+        if callData is None:
+            if (self.qrzNegData.blocked(callsign) or
+                    not self._retryDue(callsign)):
+                # a recent lookup of this callsign failed
+                return None
+
+            # callsign data hasn't been retrieved from qrz.com, or the
+            # local copy has expired, so get it. Only a callsign qrz.com
+            # does not know goes to the negative cache, network, server
+            # and login errors are retried after QRZ_RETRY_DELAY.
             try:
                 callData = self.getQRZCallsignData(callsign, quiet=True)
-                self.setLocalCallsignData(callsign, callData)
+            except CallsignNotFound as e:
+                self.qrzNegData.fail(callsign, e)
+                return None
             except Exception as e:
-                # frameinfo = getframeinfo(currentframe())
-                # print(f"\nfilter() caught exception '{e}' for callsign {callsign}, "
-                #       f"{frameinfo.filename}: {frameinfo.lineno}")
+                self._retryLater(callsign, e)
                 return None
-                
+
+            self.qrzNegData.succeed(callsign)
+            try:
+                self.setLocalCallsignData(callsign, callData)
+            except Exception as e:
+                # the data is still used, it is fetched again next run
+                if self.logging:
+                    logging.info(f"QRZ cache write of {callsign} failed: {e}")
+
         # if args['logging']:
         #     logging.info(f"callsignData: {callData}")
 
@@ -158,8 +392,9 @@ class QRZ:
             # logging.info(f"setLocalCallsignData() {data}")
             logging.info(f"setLocalCallsignData() set data for {callsign}")
         # print(f"setLocalCallsignData() set data {callsign}: {data}")
-        self.qrzLocalData[callsign] = data
+        self.qrzLocalData.set(callsign, data)
+        self.qrzMemData.set(callsign, data)
         
 
     def getLocalCallsignDataKeys(self):
-        return list(self.qrzLocalData.keys())
+        return self.qrzLocalData.keys()
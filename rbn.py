@@ -1,41 +1,73 @@
 #!/usr/bin/env python
 
 
+import asyncio
 import colorama
 import configargparse
-from geopy import distance
+import datetime
 from inspect import currentframe, getframeinfo
 import logging
 import os
-import re
 import shutil
 import signal
 import sqlite3
 import sys
-import telnetlib
-
+import time
+
+from aggregate import *
+from archive import *
+from clubs import *
+from cty import *
+from dedup import *
+from fanout import *
+from geo import *
+from filters import *
+from history import *
+from lookup import *
+from metrics import *
+from profiling import *
 from qrz import *
+from rbnclient import *
+from render import *
+from replay import *
+from spot import *
 
 
 
 RBN_HOST = "telnet.reversebeacon.net"
 RBN_PORT = 7000
+RBN_FT8_PORT = 7001
+
+# Modes spotted on the FT8 port, every other mode is on the CW port
+FT8_MODES = ('FT8', 'FT4')
+
+# Seconds to wait before connecting again after a connection failed
+RECONNECT_DELAY = 5
 
-TELNETLIB_DEBUG_LEVEL = 0
+# Spots parked waiting for their QRZ data before reading the RBN
+# stream pauses
+PENDING_QUEUE_SIZE = 10000
 
-telnetInstance = None
+# Spots parked from one feed before the other feeds get a turn
+PARK_BATCH = 200
+
+# Open RBN connections or replay source by feed name, closed on SIGINT
+rbnConnections = {}
 
 DEFAULT_CONFIG_FILE = 'rbn.cfg'
 
-lastCall = ""
-lastTime = ""
+# Background colour of spots of club members, clubs added to the club
+# index first take priority
+CLUB_COLORS = {
+    'licw': colorama.Back.GREEN,
+    'skcc': colorama.Back.CYAN,
+}
 
 
 def signalHandler(signum, frame):
-    global telnetInstance
-    
-    print(f"\nTerminating connection to: {RBN_HOST}\n")
-    telnetInstance.close()
+    print("\nTerminating connection\n")
+    for connection in list(rbnConnections.values()):
+        connection.close()
 
     sys.exit(0)
 
@@ -44,7 +76,7 @@ signal.signal(signal.SIGINT, signalHandler)
 
 
 
-def parseArguments():
+def buildParser():
     p = ("Telnet to Reverse Beacon Network (RBN) server and capture CW spots. "
          "This program provides better (IMHO) filtering of these spots. Provide "
          "the filtering parameters as command line arguments or in a config "
@@ -56,32 +88,14 @@ def parseArguments():
 
     parser.add_argument('--init', action='store', dest='init',
                         help='Initialize rbn configuration files') 
-    parser.add_argument('-b', '--band', action='append', dest='band',
-                        help='Display stations only on these bands')
     parser.add_argument('-c', '--callsign', action='store', dest='callsign',
                         type=str, help="Specify user's callsign")
     parser.add_argument('-l', '--logging', action='store', dest='logging',
                         type=int, default = 0, help='Enable program logging')
     parser.add_argument('--telnetdebug', action='store', dest='telnetdebug',
-                        type=int, default = 0, help='Enable telnetlib debugging')
-    parser.add_argument('--de_maid', action='append', dest='deMaid',
-                        help='DE Maidenhead squares')
-    parser.add_argument('--dx_maid', action='append', dest='dxMaid',
-                        help='DX Maidenhead squares')
-    parser.add_argument('--de_ituzone', action='append', dest='deITUZone',
-                        type=str, help='DE ITU Zone')
-    parser.add_argument('--dx_ituzone', action='append', dest='dxITUZone',
-                        type=str, help='DX ITU Zone')
-    parser.add_argument('--de_cqzone', action='append', dest='deCQZone',
-                        type=str, help='DE CQ Zone')
-    parser.add_argument('--dx_cqzone', action='append', dest='dxCQZone',
-                        type=str, help='DX CQ Zone')
-    parser.add_argument('--min_wpm', action='store', dest='minWPM',
-                        type=int, default=0, help='Minimum CW WPM to show')
-    parser.add_argument('--max_wpm', action='store', dest='maxWPM',
-                        type=int, default=100, help='Maximum CW WPM to show')
-    parser.add_argument('-m', '--mode', action='append', dest='mode',
-                        help='Select transmission mode')
+                        type=int, default = 0,
+                        help='Log the raw data received from RBN')
+    addFilterOptions(parser)
     parser.add_argument('-f', '--config-file', action='store', dest='configFile',
                         is_config_file=True, help='Config file path')
     parser.add_argument('--licw-file', action='store', dest='licwFile', type=str,
@@ -105,7 +119,142 @@ def parseArguments():
                         help='Highlight SKCC members')
     parser.add_argument('--licw', action='store_true', dest='licw',
                         help='Highlight LICW members')
+    parser.add_argument('--host', action='store', dest='host',
+                        default=RBN_HOST,
+                        help='RBN telnet server, e.g. a local mockrbn.py')
+    parser.add_argument('--port', action='store', dest='port', type=int,
+                        default=RBN_PORT, help='RBN telnet server port')
+    parser.add_argument('--ft8_port', action='store', dest='ft8Port',
+                        type=int, default=RBN_FT8_PORT,
+                        help='RBN telnet server port of the FT8 spots')
+    parser.add_argument('--feed', action='append', dest='feed',
+                        choices=['cw', 'ft8'],
+                        help='RBN feeds to connect to, by default the ones '
+                        'carrying the selected modes')
+    parser.add_argument('--serve_port', action='store', dest='servePort',
+                        type=int,
+                        help='Serve the spots to telnet clients on this port '
+                        'instead of displaying them')
+    parser.add_argument('--serve_ws_port', action='store', dest='serveWsPort',
+                        type=int,
+                        help='Serve the spots to websocket clients on this port')
+    parser.add_argument('--serve_host', action='store', dest='serveHost',
+                        default='localhost',
+                        help='Address the spot server listens on')
+    parser.add_argument('--client_queue', action='store', dest='clientQueue',
+                        type=int, default=1000,
+                        help='Lines queued for a slow spot server client '
+                        'before its oldest lines are dropped')
+    parser.add_argument('--refresh_hz', action='store', dest='refreshHz',
+                        type=float, default=10,
+                        help='Maximum terminal updates per second, 0 to '
+                        'write every spot at once')
+    parser.add_argument('--distance', action='store', dest='distance',
+                        choices=['geodesic', 'fast'], default='geodesic',
+                        help='Distance calculation, the ellipsoid geodesic or '
+                        'a faster formula within a fraction of a mile')
+    parser.add_argument('--aggregate', action='store', dest='aggregate',
+                        type=float, default=0,
+                        help='Show one line per DX station and band with '
+                        'the spots of the last AGGREGATE seconds, 0 shows '
+                        'one line per spot')
+    parser.add_argument('--dedup_window', action='store', dest='dedupWindow',
+                        type=float, default=60,
+                        help='Seconds a station spotted again on the same '
+                        'frequency is not shown again, 0 shows every spot')
+    parser.add_argument('--dedup_khz', action='store', dest='dedupKHz',
+                        type=float, default=1.0,
+                        help='Frequency resolution in kHz of the duplicate '
+                        'spot check')
+    parser.add_argument('--skimmer_file', action='store', dest='skimmerFile',
+                        help='File of skimmer callsigns and grid squares, '
+                        'DE filters use it instead of QRZ lookups')
+    parser.add_argument('--cty_file', action='store', dest='ctyFile',
+                        help='cty.dat country file, zone filters and the '
+                        'country shown use it instead of QRZ lookups')
+    parser.add_argument('--dx_lookup', action='store', dest='dxLookup',
+                        choices=['always', 'filter'], default='always',
+                        help='Look up every DX station in QRZ for its '
+                        'distance and location, or only when a DX filter '
+                        'needs its QRZ data')
+    parser.add_argument('--history', action='store', dest='history',
+                        help='Record the spots that pass the filters in this '
+                        'SQLite file, queried with spotquery.py')
+    parser.add_argument('--archive', action='store', dest='archive',
+                        help='Append every spot received to this binary '
+                        'spot archive, read with archive.readArchive()')
+    parser.add_argument('--metrics_port', action='store', dest='metricsPort',
+                        type=int,
+                        help='Serve the pipeline metrics in the Prometheus '
+                        'text format on this port')
+    parser.add_argument('--metrics_host', action='store', dest='metricsHost',
+                        default='localhost',
+                        help='Address the metrics endpoint listens on')
+    parser.add_argument('--status_interval', action='store',
+                        dest='statusInterval', type=float, default=0,
+                        help='Seconds between status lines of the pipeline '
+                        'rates and latencies, 0 for none')
+    parser.add_argument('--profile_dir', action='store', dest='profileDir',
+                        default='amateur-radio',
+                        help='Directory of the reports written on SIGUSR1 '
+                        '(profile) and SIGUSR2 (memory snapshot)')
+    parser.add_argument('--profile_top', action='store', dest='profileTop',
+                        type=int, default=25,
+                        help='Number of functions or lines in the profile and '
+                        'memory reports')
+    parser.add_argument('--replay', action='store', dest='replay',
+                        help='Replay a recorded RBN capture file (plain '
+                        'or gzip) instead of connecting to RBN')
+    parser.add_argument('--replay_date', action='store', dest='replayDate',
+                        help='UTC date (YYYY-MM-DD) of the first spot of the '
+                        'replayed capture, by default the date the capture '
+                        'file was last written')
+    parser.add_argument('--replay_speed', action='store', dest='replaySpeed',
+                        type=float, default=0,
+                        help='Replay speed, 1 is real time, 0 is as fast '
+                        'as possible')
+    parser.add_argument('--qrz_workers', action='store', dest='qrzWorkers',
+                        type=int, default=4,
+                        help='Number of concurrent QRZ lookups')
+    parser.add_argument('--qrz_rate', action='store', dest='qrzRate',
+                        type=float, default=5.0,
+                        help='Maximum QRZ queries per second, 0 for no '
+                        'limit')
+    parser.add_argument('--qrz_timeout', action='store', dest='qrzTimeout',
+                        type=float, default=10.0,
+                        help='Seconds a spot waits for its QRZ data')
+    parser.add_argument('--qrz_timeout_action', action='store',
+                        dest='qrzTimeoutAction', choices=['drop', 'show'],
+                        default='drop',
+                        help='Drop or show spots whose QRZ lookup timed out')
+    parser.add_argument('--qrz_cache', action='store', dest='qrzCache',
+                        default='amateur-radio/rbnData.db',
+                        help='Local QRZ callsign cache file')
+    parser.add_argument('--qrz_cache_ttl', action='store', dest='qrzCacheTTL',
+                        type=float, default=30,
+                        help='Days before cached QRZ data is fetched again')
+    parser.add_argument('--qrz_cache_size', action='store',
+                        dest='qrzCacheSize', type=int, default=100000,
+                        help='Maximum number of callsigns in the QRZ cache')
+    parser.add_argument('--qrz_memcache_size', action='store',
+                        dest='qrzMemCacheSize', type=int, default=2000,
+                        help='Number of QRZ records kept decoded in memory')
+    parser.add_argument('--qrz_negcache', action='store', dest='qrzNegCache',
+                        default='amateur-radio/rbnNegative.db',
+                        help='Cache file of callsigns QRZ could not resolve')
+    parser.add_argument('--qrz_neg_ttl', action='store', dest='qrzNegTTL',
+                        type=float, default=30,
+                        help='Minutes before a failed QRZ lookup is retried')
+    parser.add_argument('--qrz_neg_max_ttl', action='store',
+                        dest='qrzNegMaxTTL', type=float, default=1440,
+                        help='Maximum minutes between retries of a failed '
+                        'QRZ lookup')
+
+    return parser
+
 
+def parseArguments():
+    parser = buildParser()
 
     args = parser.parse_args()
 
@@ -123,51 +272,8 @@ def processArgs(args):
 
     a['init'] = args.init
     
-    # if no bands are configured then want to return all bands
-    if not args.band:
-        a['band'] = ['160m', '80m', '40m', '20m', '17m', '15m', '12m', '10m',
-                     '6m']
-    else:
-        a['band'] = args.band
+    a.update(filterArgs(args))
 
-    if not args.deMaid:
-        a['deMaid'] = ['all']
-    else:
-        a['deMaid'] = args.deMaid
-        
-    if not args.dxMaid:
-        a['dxMaid'] = ['all']
-    else:
-        a['dxMaid'] = args.dxMaid
-        
-    if not args.deITUZone:
-        a['deITUZone'] = ['all']
-    else:
-        a['deITUZone'] = args.deITUZone
-
-    if not args.dxITUZone:
-        a['dxITUZone'] = ['all']
-    else:
-        a['dxITUZone'] = args.dxITUZone
-        
-    if not args.deCQZone:
-        a['deCQZone'] = ['all']
-    else:
-        a['deCQZone'] = args.deCQZone
-        
-    if not args.dxCQZone:
-        a['dxCQZone'] = ['all']
-    else:
-        a['dxCQZone'] = args.dxCQZone
-        
-    a['minWPM'] = args.minWPM
-    a['maxWPM'] = args.maxWPM
-    
-    if not args.mode:
-        a['mode'] = ['CW', 'RTTY', 'PSK31', 'PSK63', 'BPSK', 'FT8', 'FT4']
-    else:
-        a['mode'] = args.mode
-        
     a['logging'] = args.logging
     a['telnetdebug'] = args.telnetdebug
     
@@ -218,6 +324,8 @@ def processArgs(args):
             print("ERROR: the station's longitude is not provided, exiting...")
             sys.exit(1)
 
+        a['position'] = tuple(a['position'])
+
     if args.skcc:
         a['skcc'] = True
     else:
@@ -228,6 +336,148 @@ def processArgs(args):
     else:
         a['licw'] = False
 
+    a['host'] = args.host
+    a['port'] = args.port
+    a['ft8Port'] = args.ft8Port
+
+    # the CW port carries CW, RTTY and PSK spots, FT8 and FT4 are only
+    # on the FT8 port
+    if args.feed:
+        feeds = args.feed
+    else:
+        feeds = []
+        if any(m.upper() not in FT8_MODES for m in a['mode']):
+            feeds.append('cw')
+        if any(m.upper() in FT8_MODES for m in a['mode']):
+            feeds.append('ft8')
+
+    a['feeds'] = []
+    for feed in ('cw', 'ft8'):
+        if feed in feeds:
+            a['feeds'].append((feed, a['port'] if feed == 'cw'
+                               else a['ft8Port']))
+
+    a['servePort'] = args.servePort
+    a['serveWsPort'] = args.serveWsPort
+    a['serveHost'] = args.serveHost
+    a['clientQueue'] = max(1, args.clientQueue)
+    a['serve'] = bool(args.servePort or args.serveWsPort)
+
+    a['refreshHz'] = max(0.0, args.refreshHz)
+
+    # distances to the spotted stations, cached per station position
+    a['distanceCache'] = DistanceCache(args.distance)
+
+    a['aggregate'] = max(0.0, args.aggregate)
+
+    # repeated spots of a station, shown once per window
+    a['dedup'] = SpotDeduplicator(args.dedupWindow, args.dedupKHz)
+
+    # skimmer locations known without QRZ lookups
+    a['skimmerFile'] = None
+    a['skimmerTable'] = SkimmerTable()
+    if args.skimmerFile:
+        if os.path.isabs(args.skimmerFile):
+            a['skimmerFile'] = args.skimmerFile
+        else:
+            a['skimmerFile'] = os.path.join(os.environ['HOME'],
+                                            args.skimmerFile)
+
+        try:
+            a['skimmerTable'] = SkimmerTable(a['skimmerFile'])
+        except OSError as e:
+            print(f"ERROR: Can't read the skimmer file: {e}")
+            sys.exit(1)
+
+    # country and zones of callsigns known without QRZ lookups
+    a['ctyFile'] = None
+    a['ctyTable'] = CtyTable()
+    if args.ctyFile:
+        if os.path.isabs(args.ctyFile):
+            a['ctyFile'] = args.ctyFile
+        else:
+            a['ctyFile'] = os.path.join(os.environ['HOME'], args.ctyFile)
+
+        try:
+            a['ctyTable'] = CtyTable(a['ctyFile'])
+        except OSError as e:
+            print(f"ERROR: Can't read the cty file: {e}")
+            sys.exit(1)
+
+    a['dxLookup'] = args.dxLookup
+
+    # spot history, opened by main()
+    a['historyFile'] = None
+    if args.history:
+        if os.path.isabs(args.history):
+            a['historyFile'] = args.history
+        else:
+            a['historyFile'] = os.path.join(os.environ['HOME'], args.history)
+    a['history'] = None
+
+    # binary archive of every spot received, opened by main()
+    a['archiveFile'] = None
+    if args.archive:
+        if os.path.isabs(args.archive):
+            a['archiveFile'] = args.archive
+        else:
+            a['archiveFile'] = os.path.join(os.environ['HOME'], args.archive)
+    a['archive'] = None
+
+    # counters and latencies of the pipeline stages
+    a['metrics'] = Metrics()
+    a['metricsPort'] = args.metricsPort
+    a['metricsHost'] = args.metricsHost
+    a['statusInterval'] = max(0.0, args.statusInterval)
+
+    # reports of the profiling started and stopped by signals
+    if os.path.isabs(args.profileDir):
+        a['profileDir'] = args.profileDir
+    else:
+        a['profileDir'] = os.path.join(os.environ['HOME'], args.profileDir)
+    a['profileTop'] = max(1, args.profileTop)
+    a['profiler'] = None
+
+    a['replay'] = args.replay
+    a['replaySpeed'] = args.replaySpeed
+
+    a['replayDate'] = None
+    if args.replayDate:
+        try:
+            a['replayDate'] = datetime.date.fromisoformat(args.replayDate)
+        except ValueError:
+            print(f"ERROR: Can't parse the replay date '{args.replayDate}'")
+            sys.exit(1)
+
+    # time of the feed, dating the HHMMZ spot times: the clock for the
+    # live feed, the time reached in the capture for a replay
+    a['feedClock'] = time.time
+
+    a['qrzWorkers'] = max(1, args.qrzWorkers)
+    a['qrzRate'] = max(0.0, args.qrzRate)
+    a['qrzTimeout'] = args.qrzTimeout
+    a['qrzTimeoutAction'] = args.qrzTimeoutAction
+
+    if os.path.isabs(args.qrzCache):
+        a['qrzCache'] = args.qrzCache
+    else:
+        a['qrzCache'] = os.path.join(os.environ['HOME'], args.qrzCache)
+
+    a['qrzCacheTTL'] = args.qrzCacheTTL * 86400
+    a['qrzCacheSize'] = args.qrzCacheSize
+    a['qrzMemCacheSize'] = args.qrzMemCacheSize
+
+    if os.path.isabs(args.qrzNegCache):
+        a['qrzNegCache'] = args.qrzNegCache
+    else:
+        a['qrzNegCache'] = os.path.join(os.environ['HOME'], args.qrzNegCache)
+
+    a['qrzNegTTL'] = args.qrzNegTTL * 60
+    a['qrzNegMaxTTL'] = args.qrzNegMaxTTL * 60
+
+    # band, mode, WPM, grid and zone filters compiled once for all spots
+    a['filterPlan'] = FilterPlan(a)
+
     return a
 
 
@@ -264,304 +514,116 @@ def initRbn(args):
     shutil.copy(srcPath, absPath)
 
 
-def filterFriend(args, dxCall, licwLst, line):
-    result = False
-
-    for call in licwLst:
-        rg = re.escape(call) + '\s+de'
-        if re.search(rg, line):
-            result = True
-            break
-
-    return result
-
-        
-    
-
-# Check if freq of spot lines within a band specified 
-def filterBand(args, freq):
-    # print(f"filterBand() args: {args}, freq {freq}")
-
-    band = args['band']
-
-    result = False
-
-    if '160m' in band:
-        if 1800 <= freq <= 2000:
-            result = True
-    if '80m' in band:
-        if 3500 <= freq <= 4000:
-            result = True
-    if '40m' in band:
-        if 7000 <= freq <= 7300:
-            result = True
-    if '30m' in band:
-        if 10100 <= freq <= 10150:
-            result = True
-    if '20m' in band:
-        if 14000 <= freq <= 14350:
-            result = True
-    if '17m' in band:
-        if 18068 <= freq <= 18168:
-            result = True
-    if '15m' in band:
-        if 21000 <= freq <= 21450:
-            result = True
-    if '12m' in band:
-        if 24890 <= freq <= 24990:
-            result = True
-    if '10m' in band:
-        if 28000 <= freq <= 29700:
-            result = True
-    if '6m' in band:
-        if 50000 <= freq <= 54000:
-            result = True
-
-    if args['logging'] and result == False:
-        logging.info("filterBand(): cfg {args['band']}, {freq}")
-        
-    return result
+def filterFriend(args, dxCall, clubIndex):
+    return clubIndex.isMember('licw', dxCall)
 
 
-def filterMode(args, mode):
-    # print(f"filterMode() args: {args}, mode: {mode}")
+def parkSpot(args, parser, lookupPool, clubIndex, line):
+    # Run the filters that need no QRZ data and start the QRZ lookups
+    # of spots that pass them. Stages, each one short-circuits:
+    #   1. club members are always shown, skipping the filters
+    #   2. band, mode, WPM and SNR from the RBN line
+    #   3. QRZ lookups, of the DE call only if a DE filter or spot
+    #      server clients may need data the skimmer and cty files do
+    #      not have, of the DX call unless --dx_lookup filter and no DX
+    #      filter needs more than the cty file has, then the grid and
+    #      zone filters in filter()
+    spot = parser.parse(line)
+    pending = PendingSpot(spot, args['qrzTimeout'],
+                          args['qrzTimeoutAction'] == 'show')
+    if spot is None:
+        return pending
 
-    xmtMode = args['mode']
-    
-    result = False
-
-    if 'CW' in mode:
-        result = True
-    if 'RTTY' in mode:
-        result = True
-    if 'PSK31' in mode:
-        result = True
-    if 'PSK63' in mode:
-        result = True
-    if 'BPSK' in mode:
-        result = True
-    if 'FT8' in mode:
-        result = True
-    if 'FT4' in mode:
-        result = True
-
-    if args['logging'] and result == False:
-        logging.info(f"filterMode(): cfg {args['mode']}, mode {mode}")
-        
-    return result
-
-
-def filterWPM(args, wpmStr):
-    # print(f"filterWPM() args {args}, wpm: {wpmStr}")
-
-    result = False
-    wpm = int(wpmStr)
-
-    if args['minWPM'] <= wpm <= args['maxWPM']:
-        result = True
-    
-    if args['logging'] and result == False:
-        logging.info(f"filterWPM(): min {args['minWPM']}, max {args['maxWPM']} "
-                     f"WPM {wpm}")
-        
-    return result
+    spot.timestamp = spotTimestamp(spot.time, args['feedClock']())
 
+    if args['logging']:
+        logging.info(f"DEBUG: {spot}")
 
-def filterMaidenhead(args, dxCallData, deCallData):
-    dxGrid = False
-    deGrid = False
+    if args['archive'] is not None:
+        args['archive'].add(spot)
 
-    if 'all' in args['dxMaid'] and 'all' in args['deMaid']:
-        return True
+    plan = args['filterPlan']
 
-    if 'all' in args['dxMaid']:
-        dxGrid = True
-    elif dxCallData is not None:
-        if 'grid' in dxCallData:
-            if dxCallData['grid'][:2] in args['dxMaid']:
-                dxGrid = True
+    pending.friend = filterFriend(args, spot.dx, clubIndex)
+    pending.rejected = not (pending.friend or
+                            plan.acceptRaw(spot.freq, spot.mode, spot.wpm,
+                                           spot.snr))
 
-    if 'all' in args['deMaid']:
-        deGrid = True
-    elif deCallData is not None:
-        if 'grid' in deCallData:
-            if deCallData['grid'][:2] in args['deMaid']:
-                deGrid = True
+    if not pending.rejected:
+        serve = args['serve']
+        cty = args['ctyTable']
 
-    if args['logging']:
-        if (dxCallData is not None) and ('grid' in dxCallData):
-            logging.info(f"filterMaidenhead() dxMaid: {dxCallData['grid']}")
+        dxCty = cty.callData(spot.dx)
+        if (args['dxLookup'] == 'always' or serve or plan.needsDxGrid or
+                (plan.needsDxZones and dxCty is None)):
+            pending.futures[spot.dx] = lookupPool.lookup(spot.dx)
+            if dxCty is not None:
+                pending.setLocal(spot.dx, dxCty)
         else:
-            logging.info("filterMaidenhead() dxMaid not present")
+            # shown without distance and location
+            pending.setLocal(spot.dx, dxCty if dxCty is not None else {})
 
-        if (deCallData is not None) and ('grid' in deCallData):
-            logging.info(f"filterMaidenhead() deMaid: {deCallData['grid']}")
-        else:
-            logging.info("filterMaidenhead() deMaid not present")
-
-    if dxGrid and deGrid:
-        return True
-    else:
-        return False
+        if plan.needsDeData or serve:
+            skimmer = args['skimmerTable'].callData(spot.de)
+            deCty = cty.callData(spot.de)
+            if skimmer is not None and deCty is not None:
+                pending.setLocal(spot.de, dict(deCty, **skimmer))
+            elif skimmer is not None or deCty is not None:
+                pending.setLocal(spot.de, skimmer or deCty)
 
+            if (((plan.needsDeGrid or serve) and skimmer is None) or
+                    ((plan.needsDeZones or serve) and deCty is None)):
+                pending.futures[spot.de] = lookupPool.lookup(spot.de)
 
-def filterITUZones(args, dxCallData, deCallData):
-    dxITU = False
-    deITU = False
+    return pending
 
-    if 'all' in args['dxITUZone'] and 'all' in args['deITUZone']:
-        return True
-
-    if 'all' in args['dxITUZone']:
-        dxITU = True
-    elif dxCallData is not None:
-        if 'ituzone' in dxCallData:
-            if dxCallData['ituzone'] in args['dxITUZone']:
-                dxITU = True
-
-    if 'all' in args['deITUZone']:
-        deITU = True
-    elif deCallData is not None:
-        if 'ituzone' in deCallData:
-            if deCallData['ituzone'] in args['deITUZone']:
-                dxITU = True
-
-    if args['logging']:
-        if (dxCallData is not None) and ('ituzone' in dxCallData):
-            logging.info(f"filterITUZones() dxITUZone: {dxCallData['ituzone']}")
-        else:
-            logging.info("filterITUZone() dxITUZone not present")
 
-        if (deCallData is not None) and ('ituzone' in deCallData):
-            logging.info(f"filterITUZones() deITUZone: {deCallData['ituzone']}")
-        else:
-            logging.info("filterITUZone() deITUZone not present")
-            
-    if dxITU and deITU:
-        return True
-    else:
-        return False
+def acceptSpot(progArgs, pending):
+    # QRZ data of the DX station of a parked spot that passes the
+    # filters, None if the spot is rejected
+    if pending.rejected:
+        return None
 
+    dxCallData = pending.callData(pending.spot.dx)
+    deCallData = pending.callData(pending.spot.de)
 
-def filterCQZones(args, dxCallData, deCallData):
-    dxCQZone = False
-    deCQZone = False
+    if progArgs['logging']:
+        logging.info("-------------------------------------------------------")
+        logging.info(f"dxCallData: {dxCallData}")
+        logging.info(f"deCallData: {deCallData}")
 
-    if 'all' in args['dxCQZone'] and 'all' in args['deCQZone']:
-        return True
+    # Callsign data was retrieved from qrz.com, so filter the RBN line
+    # based on the criteria from the configuration file
+    if dxCallData is None:
+        return None
 
-    if 'all' in args['dxCQZone']:
-        dxCQZone = True
-    elif dxCallData is not None:
-        if 'cqzone' in dxCallData:
-            if dxCallData['cqzone'] in args['dxCQZone']:
-                dxCQZone = True
+    if progArgs['filterPlan'].acceptGeo(dxCallData, deCallData,
+                                        pending.friend):
+        return dxCallData
 
-    if 'all' in args['deCQZone']:
-        deCQZone = True
-    elif deCallData is not None:
-        if 'cqzone' in deCallData:
-            if deCallData['cqzone'] in args['deCQZone']:
-                deCQZone = True
+    return None
 
-    if args['logging']:
-        if (dxCallData is not None) and ('cqzone' in dxCallData):
-            logging.info(f"filterCQZones() dxCQZone: {dxCallData['cqzone']}")
-        else:
-            logging.info("filterCQZone() dxCQZone not present")
 
-        if (deCallData is not None) and ('cqzone' in deCallData):
-            logging.info(f"filterCQZones() deCQZone: {deCallData['cqzone']}")
-        else:
-            logging.info("filterCQZone() deCQZone not present")
-            
-    if dxCQZone and deCQZone:
-        return True
-    else:
-        return False
+def filter(progArgs, pending):
+    spot = pending.spot
+    if spot is None:
+        return None
 
+    dxCallData = acceptSpot(progArgs, pending)
+    if dxCallData is None:
+        return ""
 
- 
-def filter(progArgs, qrz, licwLst, line):
-    global lastCall
-    global lastTime
-    
-    lineStr = line.decode('utf-8').rstrip()
+    miles = progArgs['distanceCache'].miles(dxCallData, progArgs['position'])
+    if progArgs['history'] is not None:
+        progArgs['history'].add(spot, dxCallData, miles)
 
-    # Extract information from RBN line
-    l = lineStr.split()
-    if len(l) == 12:
+    if progArgs['dedup'].isDuplicate(spot.dx, spot.freq, spot.timestamp):
         if progArgs['logging']:
-            # logging.info("-------------------------------")
-            logging.info(f"split: {l}")
+            logging.info(f"duplicate spot of {spot.dx} on {spot.freq}")
+        return '*'
 
-        try:
-            deCall = l[2].split('-')[0]
-            freq = float(l[3])
-            dxCall = l[4]
-            mode = l[5]
-            snr = l[6]
-            wpm = l[8]
-            xmsn = l[10]
-            time = l[(len(l) - 1)]
-        except ValueError as e:
-            print(f"error {e}")
-            print(f"line: {l}")
-
-        if progArgs['logging']:
-            logging.info(f"DEBUG: {dxCall} de {deCall}, freq {freq}, {mode}, "
-                         f"{snr} dB, {wpm} WPM, {time}Z")
+    return spotLine(spot, dxCallData, miles)
 
-        dxCallData = qrz.getCallsignData(dxCall, progArgs)
-        deCallData = qrz.getCallsignData(deCall, progArgs)
-
-        if progArgs['logging']:
-            logging.info("-------------------------------------------------------")
-            logging.info(f"dxCallData: {dxCallData}")
-            logging.info(f"deCallData: {deCallData}")
-
-        retStr = ""
-        printData = False
-        if dxCallData is not None:
-            # Callsign data was retrieved from qrz.com, so filter the
-            # RBN line based on the criteria from the configuration
-            # file
-            if filterFriend(progArgs, dxCall, licwLst, lineStr):
-                printData = True
-            elif (filterBand(progArgs, freq) and
-                  filterMode(progArgs, mode) and
-                  filterWPM(progArgs, wpm) and
-                  filterMaidenhead(progArgs, dxCallData, deCallData) and
-                  filterITUZones(progArgs, dxCallData, deCallData) and
-                  filterCQZones(progArgs, dxCallData, deCallData)):
-                printData = True
-
-            if printData:
-                retStr = (f"{dxCall:8s} de {deCall:6s}  {freq:>7.1f} MHz  {mode}  "
-                          f"{snr:>2s} dB  {wpm:>2s}   {time}")
-
-                if 'lat' in dxCallData and 'lon' in dxCallData:
-                    d = distance.distance((dxCallData['lat'], dxCallData['lon']),
-                                          progArgs['position']).miles
-                    retStr += f"  {round(d):5} mi"
-
-                if 'state' in dxCallData:
-                    retStr += f"  {dxCallData['state']}"
-                elif 'country' in dxCallData:
-                    retStr += f"  {dxCallData['country']}"
-                
-                if (lastCall == dxCall) and (lastTime == time):
-                    retStr = '*'
-
-                lastCall = dxCall
-                lastTime = time
-
-                if progArgs['logging']:
-                    logging.info(f"call {dxCall} - {lastCall} "
-                                 f"time {time} - {lastTime}")
-                
-        return retStr
-        
 
 
 def getCallsigns(file):
@@ -595,110 +657,379 @@ def getSQLCallsigns(db):
     
     
 
-def rbnLogin(tn, args):
-    tn.open(RBN_HOST, RBN_PORT, 10)
-    
-    tn.read_until(b"Please enter your call: ")
-    loginStr = (args['callsign'] + "\n").encode('ascii')
-    tn.write(loginStr)
+def spotHighlight(args, clubIndex, dxCall):
+    # Background colour of a displayed spot, the user's own callsign
+    # first and then the highest priority club the station belongs to
+    if args['callsign'].upper() in callsignVariants(dxCall):
+        return colorama.Back.YELLOW
 
-    tn.read_until(b"Local users", timeout=20)
-    print("Connection established...")
+    for club in clubIndex.clubsOf(dxCall):
+        return CLUB_COLORS.get(club, "")
+
+    return ""
 
-    while True:
-        s = tn.read_until(b"\r\n")
 
-        if re.match(rf"^{args['callsign']}", s.decode('utf-8')):
-            print("Receiving RBN Data...")
-            break;
+async def displaySpots(queue, args, clubIndex):
+    # Show the parked spots in arrival order, each one once its QRZ
+    # lookups are done or have timed out. A None on the queue marks the
+    # end of the input. Output is written by the renderer in frames.
+    metrics = args['metrics']
+    renderer = TerminalRenderer(args['refreshHz'],
+                                frameTimes=metrics.render)
+    tasks = [asyncio.ensure_future(renderer.run())]
+    if args['statusInterval']:
+        tasks.append(asyncio.ensure_future(metrics.statusLoop(
+            args['statusInterval'],
+            lambda text: renderer.line(text, colorama.Fore.CYAN))))
 
+    renderer.header()
+    batches = ReadyBatches(queue)
+
+    try:
+        while True:
+            batch = await batches.next()
+
+            # distances of the whole batch in one pass
+            args['distanceCache'].prefetch(batchDxData(batch),
+                                           args['position'])
+
+            for parked in batch:
+                if parked is None:
+                    return
+
+                start = time.perf_counter()
+                line = filter(args, parked)
+                metrics.filter.observe(time.perf_counter() - start)
+
+                if line == '*':
+                    renderer.marker('*')
+                elif line == "":
+                    renderer.marker('.')
+                elif line:
+                    # the displayed line starts with the DX callsign
+                    color = spotHighlight(args, clubIndex,
+                                          line.split(None, 1)[0])
+                    renderer.line(line, color)
+                    metrics.shown(parked.received, parked.spot.time)
+    finally:
+        for task in tasks:
+            task.cancel()
+        renderer.flush()
+
+
+async def aggregateSpots(queue, args, clubIndex):
+    # Collect the spots that pass the filters into one line per DX
+    # station and band, redrawn by the renderer in frames. A None on
+    # the queue marks the end of the input.
+    metrics = args['metrics']
+    aggregator = SpotAggregator(args['aggregate'])
+    renderer = AggregateRenderer(aggregator, args['refreshHz'],
+                                 frameTimes=metrics.render)
+    tasks = [asyncio.ensure_future(renderer.run())]
+    if args['statusInterval']:
+        tasks.append(asyncio.ensure_future(metrics.statusLoop(
+            args['statusInterval'],
+            lambda text: setattr(renderer, 'status', text))))
+
+    batches = ReadyBatches(queue)
+
+    try:
+        while True:
+            batch = await batches.next()
+
+            args['distanceCache'].prefetch(batchDxData(batch),
+                                           args['position'])
+
+            for parked in batch:
+                if parked is None:
+                    return
+                if parked.spot is None:
+                    continue
+
+                start = time.perf_counter()
+                dxCallData = acceptSpot(args, parked)
+                if dxCallData is None:
+                    metrics.filter.observe(time.perf_counter() - start)
+                    continue
+
+                spot = parked.spot
+                miles = args['distanceCache'].miles(dxCallData,
+                                                    args['position'])
+                if args['history'] is not None:
+                    args['history'].add(spot, dxCallData, miles)
+
+                aggregator.add(spot, dxCallData, miles,
+                               spotHighlight(args, clubIndex, spot.dx),
+                               spot.timestamp)
+                metrics.filter.observe(time.perf_counter() - start)
+                metrics.shown(parked.received, spot.time)
+
+            if not args['refreshHz']:
+                renderer.flush()
+    finally:
+        for task in tasks:
+            task.cancel()
+        renderer.flush()
+
+
+def showSpots(queue, args, clubIndex):
+    # The terminal display selected, a line per spot or per DX station
+    if args['aggregate']:
+        return aggregateSpots(queue, args, clubIndex)
+
+    return displaySpots(queue, args, clubIndex)
+
+
+async def parkLines(lines, queue, args, parser, lookupPool, clubIndex,
+                    feed):
+    # Park the spots of an RBN stream on the display queue. The event
+    # loop is yielded after every chunk of lines so a busy feed cannot
+    # starve the other feeds or the display.
+    metrics = args['metrics']
+    linesRead = metrics.linesRead
+    linesRead.setdefault(feed, 0)
 
-def printHeader(cols):
-    print("\nDX          DE       freq            snr    wpm  time    dist to me")
     count = 0
-    while (count < cols):
-        print("=", end='')
+    async for rawline in lines:
+        start = time.perf_counter()
+        pending = parkSpot(args, parser, lookupPool, clubIndex, rawline)
+        metrics.park.observe(time.perf_counter() - start)
+        linesRead[feed] += 1
+
+        await queue.put(pending)
         count += 1
+        if count % PARK_BATCH == 0:
+            await asyncio.sleep(0)
+
+
+async def rbnProcess(lines, args, parser, lookupPool, clubIndex):
+    # Spots wait on the queue, in arrival order, until their QRZ
+    # lookups are done. The display runs as a separate task so lines
+    # keep being read while qrz.com is queried.
+    queue = asyncio.Queue(PENDING_QUEUE_SIZE)
+    args['metrics'].collect('rbn_pending_spots',
+                            'Spots waiting for their lookups', 'gauge',
+                            queue.qsize)
+    display = asyncio.ensure_future(showSpots(queue, args, clubIndex))
+
+    # At the end of the input the spots still parked are shown before
+    # the end of file is passed on
+    eof = None
+    try:
+        try:
+            await parkLines(lines, queue, args, parser, lookupPool,
+                            clubIndex, 'replay')
+        except EOFError as e:
+            eof = e
+
+        await queue.put(None)
+        await display
+    finally:
+        display.cancel()
+
+    if eof is not None:
+        raise eof
+
+
+async def rbnReplay(args, parser, lookupPool, clubIndex):
+    # Run a recorded RBN capture through the same pipeline as the live
+    # RBN connection
+    source = ReplaySource(args['replay'], args['replaySpeed'],
+                          args['replayDate'])
+    rbnConnections['replay'] = source
+    args['feedClock'] = source.feedTime
+
+    try:
+        await rbnProcess(source.stream(), args, parser, lookupPool, clubIndex)
+    finally:
+        source.close()
+        del rbnConnections['replay']
+
     print()
-    
+    print(source.summary())
+    print(f"RBN lines: {parser.report()}")
 
-def rbnProcess(tn, args, licwCallLst, skccCallLst):
-    dots = 0
-    columns, rows = shutil.get_terminal_size()
-    dotCols = columns - 10
-    rowsCount = 0
 
-    qrz = QRZ(args['qrzUsername'], args['qrzPassword'], args['logging'])
+async def rbnFeed(feed, port, queue, args, parser, lookupPool, clubIndex):
+    # Stay connected to one RBN port, connecting again whenever the
+    # connection is closed or fails. Each feed reconnects on its own,
+    # the other feeds keep running.
+    label = feed.upper()
 
-    printHeader(columns)
-    
     while True:
-        if rowsCount > (rows - 7):
-            printHeader(columns)
-            rowsCount = 0
-            
-        rawline = tn.read_until(b"\r\n")
-        line = filter(args, qrz, licwCallLst, rawline)
-        if line == '*' or line == "":
-            if dots >= dotCols:
-                # goto to beginning of line and clear the line
-                print("", end="\r")            # carriage return
-                sys.stdout.write("\033[K")     # clear to eol
-                dots = 0
-            else:
-                if line == "*":
-                    ch = "*"
-                else:
-                    ch = "."
-                    
-                print(ch, end="", flush=True)
-                dots += 1
-        elif line:
-            if dots > 0:
-                # goto to beginning of line and clear the line
-                print("", end="\r")            # carriage return
-                sys.stdout.write("\033[K")     # clear to eol
-                dots = 0
-
-            meFound = False
-            friendFound = False
-            skccFound = False
-            if re.match(args['callsign'], line):
-                meFound = True
-
-            if args['licw'] and not meFound:
-                # Highlight LICW members
-                for call in licwCallLst:
-                    rg = re.escape(call) + '\s+de'
-                    if re.search(rg, line):
-                        friendFound = True
-                        break
-                    
-            if args['skcc'] and (not meFound or not friendFound):
-                # Highlight SKCC members only if enabled
-                for call in skccCallLst:
-                    rg = re.escape(call) + '\s+de'
-                    if re.search(rg, line):
-                        skccFound = True
-                        break
-
-            if meFound:
-                print(colorama.Back.YELLOW + line)
-                rowsCount += 1
-            elif friendFound:
-                print(colorama.Back.GREEN + line)
-                rowsCount += 1
-            elif skccFound:
-                print(colorama.Back.CYAN + line)
-                rowsCount += 1
-            else:
-                print(line)
-                rowsCount += 1
+        writer = None
+        try:
+            print(f"{label}: Connecting to {args['host']}:{port}...")
+            reader, writer = await rbnConnect(args['host'], port,
+                                              args['callsign'], label)
+            rbnConnections[feed] = writer
 
+            await parkLines(rbnLines(reader, args['telnetdebug']), queue,
+                            args, parser, lookupPool, clubIndex, feed)
 
-def main():
-    global telnetInstance
+        except EOFError as e:
+            print(colorama.Fore.RED + f"{label}: Connection failed: {e}" +
+                  colorama.Style.RESET_ALL)
+            print(f"{label}: Retrying...")
+        except (OSError, asyncio.TimeoutError) as e:
+            # refused, reset or timed out, don't hammer the server
+            print(colorama.Fore.RED + f"{label}: Connection failed: {e!r}" +
+                  colorama.Style.RESET_ALL)
+            print(f"{label}: Retrying in {RECONNECT_DELAY} seconds...")
+            await asyncio.sleep(RECONNECT_DELAY)
+        finally:
+            rbnConnections.pop(feed, None)
+            if writer is not None:
+                writer.close()
+
+
+async def rbnConnection(args, parser, lookupPool, clubIndex, consume):
+    # Read every configured RBN feed at once, the spots of all feeds
+    # merged in arrival order into one queue emptied by consume(queue).
+    # RBN sends the spots of each port in time order, stamped to the
+    # minute, so arrival order is also time order.
+    queue = asyncio.Queue(PENDING_QUEUE_SIZE)
+    args['metrics'].collect('rbn_pending_spots',
+                            'Spots waiting for their lookups', 'gauge',
+                            queue.qsize)
+
+    tasks = [asyncio.ensure_future(consume(queue))]
+    for feed, port in args['feeds']:
+        tasks.append(asyncio.ensure_future(rbnFeed(feed, port, queue, args,
+                                                   parser, lookupPool,
+                                                   clubIndex)))
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def rbnDisplay(args, parser, lookupPool, clubIndex):
+    # Show the spots of the RBN feeds in the terminal
+    await rbnConnection(args, parser, lookupPool, clubIndex,
+                        lambda queue: showSpots(queue, args, clubIndex))
+
+
+async def rbnServe(args, parser, lookupPool, clubIndex):
+    # Spot server, one set of RBN connections and QRZ lookups shared
+    # by every client
+    server = FanoutServer(args)
+    await server.start(args['serveHost'], args['servePort'],
+                       args['serveWsPort'])
+
+    metrics = args['metrics']
+    metrics.collect('rbn_spots_published_total', 'Spots published',
+                    'counter', lambda: server.published)
+    metrics.collect('rbn_clients', 'Connected clients', 'gauge',
+                    lambda: len(server.clients))
+
+    status = None
+    if args['statusInterval']:
+        status = asyncio.ensure_future(metrics.statusLoop(
+            args['statusInterval'],
+            lambda text: print(colorama.Fore.CYAN + text +
+                               colorama.Style.RESET_ALL)))
+
+    try:
+        await rbnConnection(args, parser, lookupPool, clubIndex,
+                            server.publishSpots)
+    finally:
+        if status is not None:
+            status.cancel()
+        server.close()
+
+
+def registerMetrics(args, qrz, lookupPool, parser):
+    # Counters and gauges kept by the pipeline objects, read when the
+    # metrics are collected
+    metrics = args['metrics']
+    metrics.add(qrz.httpSeconds)
+    metrics.add(qrz.rateWait)
+
+    metrics.collect('rbn_lines_parsed_total', 'RBN lines by parse result',
+                    'counter',
+                    lambda: {'parsed': parser.parsed,
+                             'malformed': parser.malformed,
+                             'ignored': parser.ignored}, 'result')
+    metrics.collect('rbn_spots_filtered_total',
+                    'Spots rejected by filter, and passed', 'counter',
+                    args['filterPlan'].report, 'filter')
+    metrics.collect('rbn_duplicates_suppressed_total',
+                    'Duplicate spots suppressed', 'counter',
+                    lambda: args['dedup'].suppressed)
+
+    metrics.collect('rbn_qrz_cache_total', 'QRZ cache hits and misses by '
+                    'tier', 'counter',
+                    lambda: {k: v for k, v in qrz.cacheStats().items()
+                             if not k.endswith('Size')}, 'result')
+    metrics.collect('rbn_qrz_cache_hit_ratio', 'Share of QRZ lookups '
+                    'answered from a cache', 'gauge',
+                    lambda: qrzHitRatio(qrz.cacheStats()))
+    metrics.collect('rbn_qrz_lookups_in_flight', 'QRZ lookups not done yet',
+                    'gauge', lambda: len(lookupPool))
+
+    distanceCache = args['distanceCache']
+    metrics.collect('rbn_distance_cache_total',
+                    'Distance cache hits and misses', 'counter',
+                    lambda: {'hits': distanceCache.hits,
+                             'misses': distanceCache.misses}, 'result')
+
+    history = args['history']
+    if history is not None:
+        metrics.collect('rbn_history_spots_total',
+                        'Spots written to the history, and dropped',
+                        'counter',
+                        lambda: {'written': history.written,
+                                 'dropped': history.dropped}, 'result')
+
+    archive = args['archive']
+    if archive is not None:
+        metrics.collect('rbn_archive_records_total',
+                        'Spot records written to the archive', 'counter',
+                        lambda: archive.records)
+
+
+def qrzHitRatio(stats):
+    # Lookups answered by the memory, shelve or negative cache
+    lookups = stats['memHits'] + stats['memMisses']
+    if not lookups:
+        return 0.0
+
+    hits = stats['memHits'] + stats['diskHits'] + stats['negHits']
+    return round(hits / lookups, 4)
+
+
+async def runWithMetrics(args, run):
+    # Serve the metrics while run, a coroutine, runs, and handle the
+    # profiling signals in the event loop
+    profiler = args['profiler']
+    if profiler is not None:
+        profiler.attach(asyncio.get_running_loop())
+
+    server = None
+    if args['metricsPort']:
+        try:
+            server = await args['metrics'].serve(args['metricsHost'],
+                                                 args['metricsPort'])
+        except OSError as e:
+            run.close()
+            print(f"ERROR: Can't serve the metrics: {e}")
+            sys.exit(1)
+        print(f"Metrics on http://{args['metricsHost']}:"
+              f"{args['metricsPort']}/metrics")
+
+    try:
+        await run
+    finally:
+        if server is not None:
+            server.close()
+        if profiler is not None:
+            profiler.attach(None)
 
+
+def main():
     args = parseArguments()
 
     progArgs = processArgs(args)
@@ -707,21 +1038,26 @@ def main():
         initRbn(progArgs)
         sys.exit(0)
     
-    if progArgs['logging']:
+    if progArgs['logging'] or progArgs['telnetdebug']:
         logging.basicConfig(filename='rbn.log', filemode='w',
                             level=logging.INFO)
 
+    # SIGUSR1 profiles and SIGUSR2 snapshots the memory of the running
+    # program
+    profiler = Profiler(progArgs['profileDir'], progArgs['profileTop'],
+                        progArgs['logging'])
+    profiler.install()
+    progArgs['profiler'] = profiler
+
+    # Club members are highlighted in the order the clubs are added
+    clubIndex = ClubIndex()
     if progArgs['licw']:
         licwCallsigns = getCallsigns(progArgs['licwFile'])
         cwopsCallsigns = getCallsigns(progArgs['cwops'])
-        licwCallsigns = licwCallsigns + cwopsCallsigns
-    else:
-        licwCallsigns = None
+        clubIndex.addClub('licw', licwCallsigns + cwopsCallsigns)
 
     if progArgs['skcc']:
-        skccCallsigns = getSQLCallsigns(progArgs['skccFile'])
-    else:
-        skccCallsigns = None
+        clubIndex.addClub('skcc', getSQLCallsigns(progArgs['skccFile']))
 
     colorama.init(autoreset=True)
 
@@ -733,26 +1069,70 @@ def main():
     # print(colorama.Back.CYAN + 'testing...')
     # print(colorama.Back.MAGENTA + 'testing...')
     # sys.exit(0)
-    
-    while True:
+
+    # spots are written to the history file in the background
+    if progArgs['historyFile']:
         try:
-            tn = telnetlib.Telnet()
-            telnetInstance = tn
-            
-            tn.set_debuglevel(progArgs['telnetdebug'])
-            print(f"Connecting...")
-            tn.open(RBN_HOST, RBN_PORT, 10)
+            progArgs['history'] = SpotHistory(progArgs['historyFile'],
+                                              logging=progArgs['logging'])
+        except sqlite3.Error as e:
+            print(f"ERROR: Can't open the spot history file: {e}")
+            sys.exit(1)
 
-            rbnLogin(tn, progArgs)
+    if progArgs['archiveFile']:
+        try:
+            progArgs['archive'] = SpotArchive(progArgs['archiveFile'],
+                                              progArgs['ctyTable'])
+        except (OSError, ValueError) as e:
+            print(f"ERROR: Can't open the spot archive: {e}")
+            sys.exit(1)
 
-            rbnProcess(tn, progArgs, licwCallsigns, skccCallsigns)
-            
-        except EOFError as e:
-            print(colorama.Fore.RED + f"Connection failed: {e}" +
-                  colorama.Style.RESET_ALL)
-            print("Retrying...")
-        finally:
-            tn.close()
+    # The QRZ cache and its lookup workers outlive each connection so
+    # lookups in flight are not lost when the connection is retried
+    qrz = QRZ(progArgs['qrzUsername'], progArgs['qrzPassword'],
+              progArgs['logging'], progArgs['qrzCache'],
+              progArgs['qrzCacheTTL'], progArgs['qrzCacheSize'],
+              progArgs['qrzMemCacheSize'], progArgs['qrzNegCache'],
+              progArgs['qrzNegTTL'], progArgs['qrzNegMaxTTL'],
+              progArgs['qrzWorkers'], progArgs['qrzRate'])
+    lookupPool = QRZLookupPool(qrz, progArgs, progArgs['qrzWorkers'])
+    parser = SpotParser()
+    registerMetrics(progArgs, qrz, lookupPool, parser)
+
+    if progArgs['replay']:
+        run = rbnReplay
+    elif progArgs['serve']:
+        run = rbnServe
+    else:
+        run = rbnDisplay
+
+    try:
+        asyncio.run(runWithMetrics(progArgs, run(progArgs, parser,
+                                                 lookupPool, clubIndex)))
+    finally:
+        profiler.close()
+        lookupPool.close()
+        qrz.close()
+
+        history = progArgs['history']
+        if history is not None:
+            history.close()
+            print(f"Spots recorded: {history.written}, dropped: "
+                  f"{history.dropped}")
+
+        archive = progArgs['archive']
+        if archive is not None:
+            archive.close()
+            print(f"Spots archived: {archive.records}")
+
+        report = progArgs['filterPlan'].report()
+        print(f"Spots rejected by filter: {report}")
+        print(f"Duplicate spots suppressed: {progArgs['dedup'].suppressed}")
+        if progArgs['logging']:
+            logging.info(f"Spots rejected by filter: {report}")
+            logging.info("Duplicate spots suppressed: "
+                         f"{progArgs['dedup'].suppressed}")
+            logging.info(f"RBN lines: {parser.report()}")
 
 
 
@@ -0,0 +1,94 @@
+# rbnclient.py - asyncio connection to the RBN telnet server
+
+
+import asyncio
+import logging
+
+
+
+# Bytes requested from the socket per read
+READ_CHUNK = 65536
+
+# Seconds allowed for each step of the login dialog
+LOGIN_TIMEOUT = 20
+
+
+
+class LineBuffer:
+    """Splits the chunks read from the socket into lines. The bytes of
+    a partial line stay in one reused bytearray until the rest of the
+    line arrives."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+
+    def feed(self, data):
+        # Add a chunk, returning the complete lines it finished
+        buf = self._buf
+        buf += data
+
+        lines = []
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            lines.append(bytes(buf[start:end + 1]))
+            start = end + 1
+
+        if start:
+            del buf[:start]
+
+        return lines
+
+
+    def __len__(self):
+        return len(self._buf)
+
+
+
+async def rbnConnect(host, port, callsign, label="RBN"):
+    # Connect and log in to the RBN telnet server, returning the
+    # stream reader and writer once spots are about to be sent
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port),
+                                            LOGIN_TIMEOUT)
+
+    try:
+        await asyncio.wait_for(reader.readuntil(b"Please enter your call: "),
+                               LOGIN_TIMEOUT)
+        writer.write((callsign + "\n").encode('ascii'))
+        await writer.drain()
+
+        await asyncio.wait_for(reader.readuntil(b"Local users"),
+                               LOGIN_TIMEOUT)
+        print(f"{label}: Connection established...")
+
+        while True:
+            s = await asyncio.wait_for(reader.readuntil(b"\r\n"),
+                                       LOGIN_TIMEOUT)
+            if s.decode('utf-8', 'replace').startswith(callsign):
+                print(f"{label}: Receiving RBN Data...")
+                break
+    except BaseException:
+        writer.close()
+        raise
+
+    return reader, writer
+
+
+async def rbnLines(reader, debug=0):
+    # Lines received from the RBN server, read in large chunks. Raises
+    # EOFError when the server closes the connection.
+    buffer = LineBuffer()
+
+    while True:
+        data = await reader.read(READ_CHUNK)
+        if not data:
+            raise EOFError("connection closed by RBN server")
+
+        if debug:
+            logging.info(f"rbnLines() recv {data!r}")
+
+        for line in buffer.feed(data):
+            yield line
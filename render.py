@@ -0,0 +1,195 @@
+# render.py - Batched terminal output of the RBN spot display
+
+
+import asyncio
+import shutil
+import sys
+import time
+
+import colorama
+
+from aggregate import AGGREGATE_HEADER, aggregateLine
+
+
+
+HEADER = "DX          DE       freq            snr    wpm  time    dist to me"
+
+# Carriage return and clear to end of line, erases the marker line
+CLEAR_LINE = "\r\033[K"
+
+# Cursor home and clear to end of screen, redraws the whole screen
+CLEAR_SCREEN = "\033[H\033[J"
+
+
+def headerText(cols, header=HEADER):
+    return f"\n{header}\n{'=' * cols}\n"
+
+
+
+class TerminalRenderer:
+    """Collects the display lines and the progress markers of rejected
+    and duplicate spots, and writes them to the terminal in one buffered
+    write per frame, at most refreshHz frames per second. refreshHz 0
+    writes every spot as soon as it is shown.
+
+    Markers are coalesced: a frame only writes the markers added to the
+    marker line since the last frame, and markers erased before they
+    were written are never written. The spot pipeline only appends to a
+    list, and a busy feed of rejected spots costs the terminal at most
+    one marker line per frame, so throughput does not depend on how
+    fast the terminal takes the output."""
+
+    def __init__(self, refreshHz=10, out=sys.stdout, frameTimes=None):
+        self.refreshHz = refreshHz
+        self.out = out
+        self.frameTimes = frameTimes
+
+        self.columns, self.rows = shutil.get_terminal_size()
+        self.dotCols = self.columns - 10
+
+        self.rowsCount = 0
+        self.frames = 0
+
+        # finished output not yet written
+        self._pending = []
+
+        # the marker line, the number of its markers already written
+        # and whether the written ones must be erased
+        self._markers = []
+        self._shown = 0
+        self._erase = False
+
+
+    def header(self):
+        self._pending.append(headerText(self.columns))
+        self.rowsCount = 0
+
+
+    def marker(self, ch):
+        # A '.' for a rejected spot or '*' for a duplicate, on a line
+        # that is cleared when full
+        if len(self._markers) >= self.dotCols:
+            self._erase = self._erase or self._shown > 0
+            self._markers.clear()
+            self._shown = 0
+        else:
+            self._markers.append(ch)
+
+        if not self.refreshHz:
+            self.flush()
+
+
+    def line(self, text, color=""):
+        # the line replaces the marker line, markers not yet written
+        # are dropped
+        if self._erase or self._shown > 0:
+            self._pending.append(CLEAR_LINE)
+        self._markers.clear()
+        self._shown = 0
+        self._erase = False
+
+        if self.rowsCount > (self.rows - 7):
+            self.header()
+
+        if color:
+            self._pending.append(f"{color}{text}{colorama.Style.RESET_ALL}\n")
+        else:
+            self._pending.append(f"{text}\n")
+        self.rowsCount += 1
+
+        if not self.refreshHz:
+            self.flush()
+
+
+    def flush(self):
+        out = self._pending
+        if self._erase:
+            out.append(CLEAR_LINE)
+            self._erase = False
+        if len(self._markers) > self._shown:
+            out.append("".join(self._markers[self._shown:]))
+            self._shown = len(self._markers)
+
+        if not out:
+            return
+
+        start = time.perf_counter()
+        self.out.write("".join(out))
+        self.out.flush()
+        out.clear()
+        self.frames += 1
+
+        if self.frameTimes is not None:
+            self.frameTimes.observe(time.perf_counter() - start)
+
+
+    async def run(self):
+        # Write a frame every 1 / refreshHz seconds until cancelled
+        if not self.refreshHz:
+            return
+
+        interval = 1.0 / self.refreshHz
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+
+
+class AggregateRenderer:
+    """Draws the stations of a SpotAggregator as a table, one line per
+    DX station and band, the most recently heard on top, redrawn in one
+    write per frame at most refreshHz frames per second, and only when
+    the aggregator changed. refreshHz 0 redraws on every flush()."""
+
+    def __init__(self, aggregator, refreshHz=10, out=sys.stdout,
+                 frameTimes=None):
+        self.aggregator = aggregator
+        self.refreshHz = refreshHz
+        self.out = out
+        self.frameTimes = frameTimes
+
+        self.columns, self.rows = shutil.get_terminal_size()
+        self.frames = 0
+        self._drawn = None
+
+        # status line shown above the table
+        self.status = ""
+
+
+    def flush(self):
+        self.aggregator.expire()
+        drawn = (self.aggregator.version, self.status)
+        if drawn == self._drawn:
+            return
+
+        start = time.perf_counter()
+        out = [CLEAR_SCREEN]
+        if self.status:
+            out.append(f"{self.status[:self.columns]}\n")
+        out.append(headerText(self.columns, AGGREGATE_HEADER))
+        for activity in self.aggregator.latest(max(1, self.rows - 5)):
+            line = aggregateLine(activity)[:self.columns]
+            if activity.color:
+                out.append(f"{activity.color}{line}"
+                           f"{colorama.Style.RESET_ALL}\n")
+            else:
+                out.append(f"{line}\n")
+
+        self.out.write("".join(out))
+        self.out.flush()
+        self._drawn = drawn
+        self.frames += 1
+
+        if self.frameTimes is not None:
+            self.frameTimes.observe(time.perf_counter() - start)
+
+
+    async def run(self):
+        # Redraw every 1 / refreshHz seconds until cancelled
+        if not self.refreshHz:
+            return
+
+        interval = 1.0 / self.refreshHz
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
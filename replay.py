@@ -0,0 +1,174 @@
+# replay.py - Replay a recorded RBN telnet stream through the spot pipeline
+
+
+import asyncio
+import calendar
+import gzip
+import os
+import time
+
+
+
+def openCapture(filename):
+    # Open a capture file, plain text or gzip compressed
+    f = open(filename, 'rb')
+    if f.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=f)
+
+    return f
+
+
+def spotMinute(line):
+    # Minute of the day of the HHMMZ time at the end of a spot line
+    last = line.rstrip()[-5:]
+    if len(last) == 5 and last[4:] == b'Z' and last[:4].isdigit():
+        t = int(last[:4])
+        return (t // 100) * 60 + t % 100
+
+    return None
+
+
+
+class ReplaySource:
+    """Stands in for the RBN connection, returning the lines of a
+    recorded RBN capture from the async iterator stream().
+
+    With speed 0 lines are returned as fast as they are read. Otherwise
+    the capture is replayed at speed times real time. The spot times
+    only have a resolution of one minute, so the lines of each minute
+    are spread evenly across that minute.
+
+    A capture holds HHMMZ times only. Its first spot minute is dated
+    date (a datetime.date, UTC), or without a date the last time that
+    minute came before the capture file was last written. The date
+    advances each time the spot minutes wrap past midnight, and
+    feedTime() is the time reached in the capture."""
+
+    # A spot up to this many minutes older than the minute being
+    # replayed is part of that minute, not a wrap to the next day
+    REORDER_MINUTES = 720
+
+    # Lines returned between yields to the event loop when the capture
+    # is replayed as fast as possible
+    YIELD_LINES = 100
+
+
+    def __init__(self, filename, speed=0.0, date=None):
+        self.filename = filename
+        self.speed = speed
+        self.date = date
+
+        # unix time of the spot minute being replayed
+        self.spotTime = None
+
+        self.lines = 0
+        self.started = None
+        self.finished = None
+
+        self._file = openCapture(filename)
+        self._paced = self._pacedLines()
+
+
+    def _minutes(self):
+        # Lines of the capture grouped by the minute of their spot time
+        group = []
+        minute = None
+
+        for raw in self._file:
+            line = raw.rstrip(b'\r\n') + b'\r\n'
+
+            m = spotMinute(line)
+            if m is not None and minute is None:
+                minute = m
+            elif m is not None:
+                delta = (m - minute) % 1440
+                if 0 < delta < self.REORDER_MINUTES:
+                    yield minute, group
+                    group = []
+                    minute = m
+
+            group.append(line)
+
+        if group:
+            yield minute, group
+
+
+    def _firstSpotTime(self, minute):
+        if self.date is not None:
+            return calendar.timegm(self.date.timetuple()) + minute * 60
+
+        written = os.path.getmtime(self.filename)
+        t = written - written % 86400 + minute * 60
+        return t - 86400 if t > written else t
+
+
+    def feedTime(self):
+        # Time reached in the capture, the middle of the spot minute
+        # being replayed
+        if self.spotTime is None:
+            return time.time()
+
+        return self.spotTime + 30
+
+
+    def _pacedLines(self):
+        # Lines of the capture with the time each one is due
+        start = None
+        last = None
+
+        for minute, group in self._minutes():
+            if minute is not None:
+                if last is None:
+                    self.spotTime = self._firstSpotTime(minute)
+                else:
+                    self.spotTime += ((minute - last) % 1440) * 60
+
+            if self.speed <= 0:
+                if minute is not None:
+                    last = minute
+                for line in group:
+                    yield 0, line
+                continue
+
+            if start is None:
+                start = time.monotonic()
+            elif minute is not None and last is not None:
+                start += ((minute - last) % 1440) * 60 / self.speed
+
+            if minute is not None:
+                last = minute
+
+            interval = 60 / self.speed / len(group)
+            for i, line in enumerate(group):
+                yield start + i * interval, line
+
+
+    async def stream(self):
+        # The lines of the capture, each one returned when it is due
+        self.started = time.monotonic()
+
+        for due, line in self._paced:
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            elif self.lines % self.YIELD_LINES == 0:
+                # let the rest of the pipeline run
+                await asyncio.sleep(0)
+
+            self.lines += 1
+            yield line
+
+        self.finished = time.monotonic()
+
+
+    def summary(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        elapsed = end - self.started if self.started is not None else 0.0
+        rate = self.lines / elapsed if elapsed > 0 else 0.0
+
+        return (f"Replayed {self.lines} lines from {self.filename} in "
+                f"{elapsed:.1f} s ({rate:.0f} lines/s)")
+
+
+    def close(self):
+        self._file.close()
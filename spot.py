@@ -0,0 +1,186 @@
+# spot.py - Parse RBN telnet lines into spot records and format them for
+# display
+
+
+import collections
+
+
+
+# Unit tokens following the SNR and the speed of a spot line
+SPOT_UNITS = (b'dB', b'WPM', b'BPS')
+
+
+
+class Spot:
+    """One RBN spot. Callsigns, mode, type and time are str, freq is a
+    float in kHz, snr and wpm are int or None when the line does not
+    carry them (wpm is only set for CW spots reported in WPM).
+    timestamp is the unix time of the HHMMZ time, dated by the feed the
+    spot came from (see spotTimestamp()), None until it is known."""
+
+    __slots__ = ('de', 'dx', 'freq', 'mode', 'snr', 'wpm', 'type', 'time',
+                 'timestamp')
+
+    def __init__(self, de, dx, freq, mode, snr, wpm, type, time,
+                 timestamp=None):
+        self.de = de
+        self.dx = dx
+        self.freq = freq
+        self.mode = mode
+        self.snr = snr
+        self.wpm = wpm
+        self.type = type
+        self.time = time
+        self.timestamp = timestamp
+
+
+    def __repr__(self):
+        return (f"Spot({self.dx} de {self.de}, {self.freq}, {self.mode}, "
+                f"{self.snr} dB, {self.wpm} WPM, {self.type}, {self.time})")
+
+
+
+def spotTimestamp(rbnTime, now):
+    # Unix time of the HHMMZ time of a spot, on the UTC day that puts it
+    # closest to now, the time of the feed (the time a live spot is
+    # received, the time reached in a replayed capture). Near midnight
+    # that is the day before or after the UTC day of now.
+    if not rbnTime:
+        return int(now)
+
+    t = (now - now % 86400 + int(rbnTime[:2]) * 3600 +
+         int(rbnTime[2:4]) * 60)
+    if t > now + 43200:
+        t -= 86400
+    elif t < now - 43200:
+        t += 86400
+
+    return int(t)
+
+
+def spotLine(spot, dxCallData, miles):
+    # Display line of a spot, with the distance in miles to the DX
+    # station when known and its state or country when its QRZ data
+    # has them
+    snr = "" if spot.snr is None else str(spot.snr)
+    wpm = "" if spot.wpm is None else str(spot.wpm)
+    time = spot.time or ""
+
+    line = (f"{spot.dx:8s} de {spot.de:6s}  {spot.freq:>7.1f} MHz  "
+            f"{spot.mode}  {snr:>2s} dB  {wpm:>2s}   {time}")
+
+    if miles is not None:
+        line += f"  {round(miles):5} mi"
+
+    if 'state' in dxCallData:
+        line += f"  {dxCallData['state']}"
+    elif 'country' in dxCallData:
+        line += f"  {dxCallData['country']}"
+
+    return line
+
+
+
+class SpotParser:
+    """Parse the lines read from the RBN telnet server into Spots.
+
+    Works on the raw bytes and only decodes the fields it keeps.
+    Handles the line variants RBN sends:
+
+      DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  CQ      1234Z
+      DX de VE2WU-#:   14100.0  4U1UN     CW  12 dB  22 WPM  NCDXF B 1234Z
+      DX de KM3T-#:    14080.0  DL1ABC    RTTY 9 dB  45 BPS  CQ      1234Z
+      DX de K1TTT-#:   14074.0  JA1XYZ    FT8 -12 dB         CQ      1234Z
+      DX de VE7CC-1-#:14025.0   K6ZX      CW  15 dB  22 WPM  CQ      1234Z
+
+    Lines that are not spots are counted as ignored, spot lines that
+    cannot be parsed as malformed."""
+
+    def __init__(self):
+        self.parsed = 0
+        self.malformed = 0
+        self.ignored = 0
+
+        # parsed spots by type, CQ, BEACON, NCDXF B, ...
+        self.types = collections.Counter()
+
+
+    def parse(self, line):
+        # Spot parsed from the bytes of one RBN line, or None
+        if not line.startswith(b'DX de '):
+            if line.strip():
+                self.ignored += 1
+            return None
+
+        fields = line.split()
+        if len(fields) < 3:
+            self.malformed += 1
+            return None
+
+        # skimmer call and frequency may run together, 'VE7CC-1-#:14025.0'
+        skimmer, colon, rest = fields[2].partition(b':')
+        if not colon:
+            self.malformed += 1
+            return None
+
+        fields = fields[3:]
+        if rest:
+            fields.insert(0, rest)
+
+        if len(fields) < 3:
+            self.malformed += 1
+            return None
+
+        try:
+            freq = float(fields[0])
+        except ValueError:
+            self.malformed += 1
+            return None
+
+        dx = fields[1].decode('latin-1')
+        mode = fields[2].decode('latin-1')
+
+        time = None
+        end = len(fields)
+        last = fields[-1]
+        if len(last) == 5 and last.endswith(b'Z') and last[:4].isdigit():
+            time = last.decode('latin-1')
+            end -= 1
+
+        # the remaining fields are '<snr> dB', '<speed> WPM|BPS' and the
+        # spot type, each of them may be missing
+        snr = None
+        wpm = None
+        i = 3
+        try:
+            if i + 1 < end and fields[i + 1] == b'dB':
+                snr = int(fields[i])
+                i += 2
+
+            if i + 1 < end and fields[i + 1] in (b'WPM', b'BPS'):
+                speed = int(fields[i])
+                if fields[i + 1] == b'WPM':
+                    wpm = speed
+                i += 2
+        except ValueError:
+            self.malformed += 1
+            return None
+
+        # a unit anywhere else is a garbled line, e.g. the mode run into
+        # the SNR, 'PSK31-14 dB'
+        if any(field in SPOT_UNITS for field in fields[i:end]):
+            self.malformed += 1
+            return None
+
+        type = b' '.join(fields[i:end]).decode('latin-1')
+
+        self.parsed += 1
+        self.types[type] += 1
+
+        return Spot(skimmer.split(b'-')[0].decode('latin-1'), dx, freq, mode,
+                    snr, wpm, type, time)
+
+
+    def report(self):
+        return {'parsed': self.parsed, 'malformed': self.malformed,
+                'ignored': self.ignored, 'types': dict(self.types)}
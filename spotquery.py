@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Query the spot history recorded by rbn.py --history, e.g. all the
+# skimmers that heard K6ZX on 40m in the last week:
+#
+#   $ ./spotquery.py --dx K6ZX -b 40m --since 7d --skimmers
+
+
+import configargparse
+import datetime
+import os
+import re
+import sys
+import time
+
+from history import *
+
+
+
+# --since and --until as a time ago, e.g. 30m, 12h, 7d or 2w
+AGO_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parseArguments():
+    parser = configargparse.ArgumentParser(description='Query the rbn.py '
+                                           'spot history.')
+
+    parser.add_argument('--history', action='store', dest='history',
+                        default=os.path.join(os.environ['HOME'],
+                                             'amateur-radio/rbnHistory.db'),
+                        help='Spot history file written by rbn.py --history')
+    parser.add_argument('--dx', action='store', dest='dx',
+                        help='Spots of this DX callsign')
+    parser.add_argument('--de', action='store', dest='de',
+                        help='Spots of this skimmer')
+    parser.add_argument('-b', '--band', action='store', dest='band',
+                        help='Spots on this band, e.g. 40m')
+    parser.add_argument('-m', '--mode', action='store', dest='mode',
+                        help='Spots in this mode, e.g. CW')
+    parser.add_argument('--since', action='store', dest='since',
+                        help='Spots since a time ago (30m, 12h, 7d, 2w) or '
+                        'a UTC date (2024-01-31, "2024-01-31 18:00" or '
+                        '"2024-01-31 1800Z")')
+    parser.add_argument('--until', action='store', dest='until',
+                        help='Spots before a time ago or a date')
+    parser.add_argument('--skimmers', action='store_true', dest='skimmers',
+                        help='List the skimmers with their number of spots, '
+                        'best SNR and first and last time heard')
+    parser.add_argument('--limit', action='store', dest='limit', type=int,
+                        default=100, help='Maximum number of spots listed, '
+                        '0 for all')
+
+    return parser.parse_args()
+
+
+def parseTime(text):
+    # Unix time of a time ago or a UTC date and time, also in the
+    # format the spots are listed in
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([mhdw])', text.strip().lower())
+    if match:
+        return time.time() - float(match.group(1)) * AGO_UNITS[match.group(2)]
+
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d %H%MZ', '%Y-%m-%d'):
+        try:
+            date = datetime.datetime.strptime(text.strip(), fmt)
+            return date.replace(tzinfo=datetime.timezone.utc).timestamp()
+        except ValueError:
+            pass
+
+    print(f"ERROR: Can't parse the time '{text}'")
+    sys.exit(1)
+
+
+def timeStr(t):
+    # UTC, with the HHMMZ time of the RBN spots
+    return datetime.datetime.fromtimestamp(
+        t, datetime.timezone.utc).strftime('%Y-%m-%d %H%MZ')
+
+
+def main():
+    args = parseArguments()
+
+    if not os.path.exists(args.history):
+        print(f"ERROR: No spot history file {args.history}")
+        sys.exit(1)
+
+    criteria = {
+        'dx': args.dx,
+        'de': args.de,
+        'band': args.band,
+        'mode': args.mode,
+        'since': parseTime(args.since) if args.since else None,
+        'until': parseTime(args.until) if args.until else None,
+    }
+
+    db = openHistory(args.history, readOnly=True)
+
+    if args.skimmers:
+        for de, spots, bestSNR, first, last in querySkimmers(db, **criteria):
+            snr = "" if bestSNR is None else bestSNR
+            print(f"{de:10s} {spots:6d} spots  best {snr:>3} dB  "
+                  f"{timeStr(first)} - {timeStr(last)}")
+    else:
+        for spot in querySpots(db, args.limit, **criteria):
+            snr = "" if spot['snr'] is None else spot['snr']
+            wpm = "" if spot['wpm'] is None else spot['wpm']
+            output = (f"{timeStr(spot['time'])}  {spot['dx']:10s} de "
+                      f"{spot['de']:9s} {spot['freq']:>8.1f}  "
+                      f"{spot['mode'] or '':4s} {snr:>3} dB {wpm:>3} WPM")
+            if spot['miles'] is not None:
+                output += f"  {round(spot['miles']):5} mi"
+            location = spot['state'] or spot['country']
+            if location:
+                output += f"  {location}"
+            print(output)
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# synth.py - Synthetic RBN spot lines and QRZ records for benchmarks and
+# the mock RBN server
+
+
+import random
+import string
+import zlib
+
+
+
+# (band edge low, high in kHz, relative spot volume)
+SYNTH_BANDS = [
+    (1800, 1850, 2), (3500, 3600, 6), (7000, 7060, 10), (10100, 10130, 5),
+    (14000, 14070, 12), (18068, 18095, 3), (21000, 21070, 6),
+    (24890, 24920, 2), (28000, 28070, 4), (50080, 50100, 1),
+]
+
+SYNTH_MODES = [('CW', 85), ('RTTY', 8), ('PSK31', 2), ('FT8', 5)]
+
+# Modes of the RBN FT8 port
+SYNTH_FT8_MODES = [('FT8', 90), ('FT4', 10)]
+
+SYNTH_TYPES = [('CQ', 90), ('DX', 6), ('BEACON', 3), ('NCDXF B', 1)]
+
+SYNTH_GRIDS = ['FN', 'FM', 'EN', 'EM', 'DN', 'DM', 'CN', 'CM', 'JO', 'JN',
+               'IO', 'KP', 'PM', 'QF', 'GG', 'KO']
+
+SYNTH_PREFIXES = ['K', 'W', 'N', 'AA', 'KB', 'VE', 'DL', 'G', 'F', 'I', 'JA',
+                  'VK', 'PY', 'OH', 'SM', 'UA', 'EA', 'ON', 'PA', 'OK']
+
+
+def randomCallsign(rnd):
+    prefix = rnd.choice(SYNTH_PREFIXES)
+    suffix = ''.join(rnd.choice(string.ascii_uppercase)
+                     for i in range(rnd.randint(1, 3)))
+    return f"{prefix}{rnd.randint(0, 9)}{suffix}"
+
+
+def callsignPool(count, seed=0):
+    rnd = random.Random(seed)
+    pool = set()
+    while len(pool) < count:
+        pool.add(randomCallsign(rnd))
+
+    return sorted(pool)
+
+
+def formatSpot(de, freq, dx, mode, snr, speed, type, hhmm):
+    # One spot line laid out like the RBN telnet server does
+    deField = de + '-#:'
+    if mode == 'CW':
+        speedField = f"{speed:2d} WPM"
+    elif mode in ('FT8', 'FT4'):
+        speedField = "      "
+    else:
+        speedField = f"{speed:2d} BPS"
+
+    # the mode and the SNR are separate columns, 'PSK31 -14 dB'
+    return (f"DX de {deField:<11s}{freq:>9.1f}  {dx:<13s}{mode:<5s} "
+            f"{snr:>3d} dB  {speedField}  {type:<8s}{hhmm:04d}Z\r\n").encode('ascii')
+
+
+class SpotGenerator:
+    """Endless stream of synthetic RBN spot lines. A few hundred DX
+    stations and skimmers make up most of the traffic, as on a busy
+    contest weekend, and spot times advance one minute per
+    spotsPerMinute lines."""
+
+    def __init__(self, seed=0, dxCount=5000, skimmerCount=300,
+                 spotsPerMinute=600, modes=SYNTH_MODES):
+        self.rnd = random.Random(seed)
+        self.dxCalls = callsignPool(dxCount, seed + 1)
+        self.skimmers = callsignPool(skimmerCount, seed + 2)
+        self.spotsPerMinute = spotsPerMinute
+
+        self.count = 0
+        self.minute = 0
+
+        self._bandWeights = [b[2] for b in SYNTH_BANDS]
+        self._modes = [m for m, w in modes]
+        self._modeWeights = [w for m, w in modes]
+        self._types = [t for t, w in SYNTH_TYPES]
+        self._typeWeights = [w for t, w in SYNTH_TYPES]
+
+
+    def _pick(self, calls):
+        # Strongly skewed towards the start of the list
+        i = int(len(calls) * self.rnd.random() ** 4)
+        return calls[i]
+
+
+    def line(self):
+        rnd = self.rnd
+
+        low, high, weight = rnd.choices(SYNTH_BANDS, self._bandWeights)[0]
+        mode = rnd.choices(self._modes, self._modeWeights)[0]
+        type = rnd.choices(self._types, self._typeWeights)[0]
+
+        self.count += 1
+        if self.count % self.spotsPerMinute == 0:
+            self.minute = (self.minute + 1) % 1440
+        hhmm = (self.minute // 60) * 100 + self.minute % 60
+
+        return formatSpot(self._pick(self.skimmers),
+                          round(rnd.uniform(low, high), 1),
+                          self._pick(self.dxCalls), mode, rnd.randint(-20, 45),
+                          rnd.randint(12, 40) if mode == 'CW' else 45,
+                          type, hhmm)
+
+
+    def lines(self, count):
+        return [self.line() for i in range(count)]
+
+
+
+def syntheticRecord(callsign):
+    # QRZ style record for callsign, always the same for a callsign
+    h = zlib.crc32(callsign.encode('ascii'))
+    grid = SYNTH_GRIDS[h % len(SYNTH_GRIDS)]
+
+    return {
+        'call': callsign,
+        'fname': 'Synthetic',
+        'name': 'Station',
+        'grid': f"{grid}{h % 10}{(h // 10) % 10}",
+        'lat': f"{(h % 1400) / 10 - 70:.3f}",
+        'lon': f"{(h // 1400 % 3600) / 10 - 180:.3f}",
+        'country': 'Synthetic',
+        'cqzone': str(h % 40 + 1),
+        'ituzone': str(h % 90 + 1),
+    }
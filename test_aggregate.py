@@ -0,0 +1,56 @@
+# test_aggregate.py - Tests of the rolling window of spots per DX station
+
+
+from aggregate import *
+from spot import *
+
+
+
+def replaySpots(lines):
+    # Spots of lines dated on 2024-03-09, as a replay dates them
+    parser = SpotParser()
+    midnight = 1709942400.0
+    spots = []
+    for line in lines:
+        spot = parser.parse(line)
+        spot.timestamp = spotTimestamp(spot.time, midnight + 12 * 3600)
+        spots.append(spot)
+    return spots
+
+
+def testWindowOfReplayedSpots():
+    # Added all at once, as a replay at full speed does, only the spots
+    # within the window before the latest spot are aggregated
+    aggregator = SpotAggregator(window=300)
+    for spot in replaySpots([
+        b"DX de W3OA-#:    14025.0  K6ZX      CW   5 dB  20 WPM  CQ      0100Z",
+        b"DX de KM3T-#:    14025.0  K6ZX      CW   9 dB  22 WPM  CQ      0100Z",
+        b"DX de VE2WU-#:   14025.0  W1AW      CW  30 dB  25 WPM  CQ      0102Z",
+        b"DX de W3OA-#:    14025.1  K6ZX      CW  15 dB  24 WPM  CQ      0900Z",
+        b"DX de K1TTT-#:   14025.0  K6ZX      CW  21 dB  26 WPM  CQ      0903Z",
+    ]):
+        aggregator.add(spot, {})
+
+    assert list(aggregator.activities) == [('K6ZX', '20m')]
+    activity = aggregator.activities[('K6ZX', '20m')]
+    assert sorted(activity.skimmers) == ['K1TTT', 'W3OA']
+    assert (activity.bestSNR(), activity.medianSNR()) == (21, 15)
+    assert activity.meanWPM() == 25
+    assert activity.time == '0903Z'
+
+
+def testExpireByLatestSpot():
+    aggregator = SpotAggregator(window=300)
+    spots = replaySpots([
+        b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  CQ      0100Z",
+        b"DX de W3OA-#:    7025.0   W1AW      CW  15 dB  22 WPM  CQ      0104Z",
+    ])
+    aggregator.add(spots[0], {})
+    aggregator.add(spots[1], {})
+
+    # no spots newer than the latest, nothing more expires
+    aggregator.expire()
+    assert len(aggregator) == 2
+
+    aggregator.expire(spots[1].timestamp + 60)
+    assert list(aggregator.activities) == [('W1AW', '40m')]
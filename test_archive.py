@@ -0,0 +1,58 @@
+# test_archive.py - Tests of the binary spot archive
+
+
+import os
+
+import pytest
+
+from archive import *
+from spot import *
+
+numpy = pytest.importorskip('numpy')
+
+
+
+SPOT_LINES = [
+    b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  CQ      0100Z",
+    b"DX de KM3T-#:    14080.0  DL1ABC    RTTY 9 dB  45 BPS  CQ      0101Z",
+    b"DX de VE2WU-#:   7025.0   W1AW      CW  12 dB  25 WPM  CQ      0102Z",
+    b"DX de K1TTT-#:   14074.0  JA1XYZ    FT8 -12 dB         CQ      0103Z",
+]
+
+
+def archiveSpots(filename, lines):
+    parser = SpotParser()
+    archive = SpotArchive(filename)
+    for line in lines:
+        spot = parser.parse(line)
+        spot.timestamp = spotTimestamp(spot.time, 1709942400.0)
+        archive.add(spot)
+    archive.close()
+
+
+def readSpots(filename):
+    records, calls = readArchive(filename)
+    return [(calls[r['dx']], calls[r['de']], r['freq'] / 10, int(r['snr']))
+            for r in records]
+
+
+def testAppendAfterIncompleteRecord(tmp_path):
+    filename = str(tmp_path / 'spots.rbn')
+    archiveSpots(filename, SPOT_LINES[:2])
+
+    # a crash part way through writing a record and a callsign
+    size = os.path.getsize(filename)
+    with open(filename, 'ab') as f:
+        f.write(b'\x01\x02\x03\x04\x05')
+    with open(callsFile(filename), 'ab') as f:
+        f.write(b'VE2')
+
+    archiveSpots(filename, SPOT_LINES[2:])
+
+    assert os.path.getsize(filename) == size + 2 * ARCHIVE_RECORD.size
+    assert readSpots(filename) == [
+        ('K6ZX', 'W3OA', 14025.0, 15),
+        ('DL1ABC', 'KM3T', 14080.0, 9),
+        ('W1AW', 'VE2WU', 7025.0, 12),
+        ('JA1XYZ', 'K1TTT', 14074.0, -12),
+    ]
@@ -0,0 +1,56 @@
+# test_cache.py - Tests of the QRZ callsign caches
+
+
+import threading
+
+from cache import *
+
+
+
+def onThread(function):
+    # Result of function run on a new thread, exceptions re-raised
+    result = {}
+
+    def run():
+        try:
+            result['value'] = function()
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+def testCallsignCacheFromWorkerThreads(tmp_path):
+    filename = str(tmp_path / 'rbnData.db')
+    record = {'call': 'K6ZX', 'grid': 'CM97'}
+
+    cache = CallsignCache(filename, 3600, 100)
+    onThread(lambda: cache.set('K6ZX', record))
+    assert onThread(lambda: cache.get('K6ZX')) == record
+    assert cache.get('K6ZX') == record
+    assert onThread(lambda: cache.get('W1AW')) is None
+    cache.close()
+
+    # reopened, the records and the index written by close() are back
+    cache = CallsignCache(filename, 3600, 100)
+    assert onThread(cache.keys) == ['K6ZX']
+    assert onThread(lambda: cache.get('K6ZX')) == record
+    assert cache.hits == 1
+    cache.close()
+
+
+def testCallsignCacheClosed(tmp_path):
+    cache = CallsignCache(str(tmp_path / 'rbnData.db'), 3600, 100)
+    cache.set('K6ZX', {'call': 'K6ZX'})
+    cache.close()
+    cache.close()
+
+    assert cache.get('K6ZX') is None
+    cache.set('W1AW', {'call': 'W1AW'})
+    assert cache.keys() == ['K6ZX']
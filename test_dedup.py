@@ -0,0 +1,47 @@
+# test_dedup.py - Tests of the duplicate spot check
+
+
+from dedup import *
+from spot import *
+
+
+
+def replaySpots(lines):
+    # Spots of lines dated on 2024-03-09, as a replay dates them
+    parser = SpotParser()
+    midnight = 1709942400.0
+    spots = []
+    for line in lines:
+        spot = parser.parse(line)
+        spot.timestamp = spotTimestamp(spot.time, midnight + 12 * 3600)
+        spots.append(spot)
+    return spots
+
+
+def testDuplicatesInOneMinute():
+    dedup = SpotDeduplicator(window=60)
+    spots = replaySpots([
+        b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  CQ      0100Z",
+        b"DX de KM3T-#:    14025.1  K6ZX      CW  12 dB  22 WPM  CQ      0100Z",
+        b"DX de VE2WU-#:   14025.0  W1AW      CW  12 dB  22 WPM  CQ      0100Z",
+    ])
+
+    shown = [not dedup.isDuplicate(s.dx, s.freq, s.timestamp) for s in spots]
+    assert shown == [True, False, True]
+    assert dedup.suppressed == 1
+
+
+def testReplayedSpotsHoursApart():
+    # A replay at full speed processes the whole capture in well under
+    # the window, the spot times still keep the spots apart
+    dedup = SpotDeduplicator(window=60)
+    spots = replaySpots([
+        b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  CQ      0100Z",
+        b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  CQ      0500Z",
+        b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  CQ      0900Z",
+    ])
+
+    shown = [not dedup.isDuplicate(s.dx, s.freq, s.timestamp) for s in spots]
+    assert shown == [True, True, True]
+    assert dedup.suppressed == 0
+    assert len(dedup) == 1
@@ -0,0 +1,51 @@
+# test_geo.py - Tests of the distance computations
+
+
+import random
+
+import pytest
+
+from geo import *
+
+
+
+# Largest difference in miles from the geodesic lambertMiles() promises
+LAMBERT_TOLERANCE = 0.12
+
+
+def randomPairs(count, seed=0):
+    # Pairs of positions up to 11000 miles apart
+    rnd = random.Random(seed)
+    pairs = []
+    while len(pairs) < count:
+        p1 = (rnd.uniform(-89, 89), rnd.uniform(-180, 180))
+        p2 = (rnd.uniform(-89, 89), rnd.uniform(-180, 180))
+        if geodesicMiles(p1, p2) <= 11000:
+            pairs.append((p1, p2))
+
+    return pairs
+
+
+def testLambertMiles():
+    for p1, p2 in randomPairs(5000):
+        assert (abs(lambertMiles(p1, p2) - geodesicMiles(p1, p2)) <=
+                LAMBERT_TOLERANCE)
+
+    # close to the worst case found, almost 11000 miles
+    p1, p2 = (-10.7264, -22.7189), (-3.9011, 172.9706)
+    assert (abs(lambertMiles(p1, p2) - geodesicMiles(p1, p2)) <=
+            LAMBERT_TOLERANCE)
+
+    assert lambertMiles((40.8, -73.1), (40.8, -73.1)) == 0.0
+
+
+def testLambertMilesArray():
+    pytest.importorskip('numpy')
+
+    position = (40.8, -73.1)
+    points = [p2 for p1, p2 in randomPairs(500, seed=1)] + [position]
+    miles = lambertMilesArray([p[0] for p in points],
+                              [p[1] for p in points], position)
+
+    for there, d in zip(points, miles.tolist()):
+        assert d == pytest.approx(lambertMiles(there, position), abs=1e-6)
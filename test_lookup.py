@@ -0,0 +1,39 @@
+# test_lookup.py - Tests of the background QRZ lookups
+
+
+import threading
+
+from lookup import *
+
+
+
+class BlockingQRZ:
+    """Stands in for QRZ, each lookup waits until it is released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.looked = []
+
+
+    def getCallsignData(self, callsign, args):
+        self.looked.append(callsign)
+        self.release.wait(5)
+        return {'call': callsign}
+
+
+
+def testCloseWithQueuedLookups():
+    qrz = BlockingQRZ()
+    pool = QRZLookupPool(qrz, {'logging': 0}, workers=1)
+    futures = [pool.lookup(call) for call in ('K6ZX', 'W1AW', 'DL1ABC')]
+
+    closer = threading.Thread(target=pool.close, daemon=True)
+    closer.start()
+    closer.join(5)
+    assert not closer.is_alive(), "close() hung with lookups queued"
+
+    qrz.release.set()
+    assert futures[0].result(5) == {'call': 'K6ZX'}
+    assert futures[1].cancelled() and futures[2].cancelled()
+    assert len(pool) == 0
+    assert qrz.looked == ['K6ZX']
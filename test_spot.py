@@ -0,0 +1,67 @@
+# test_spot.py - Tests of the RBN spot line parser
+
+
+import pytest
+
+from spot import *
+
+
+
+def parseOne(line):
+    parser = SpotParser()
+    return parser, parser.parse(line)
+
+
+@pytest.mark.parametrize('line, expected', [
+    (b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  CQ      1234Z",
+     ('W3OA', 'K6ZX', 14025.0, 'CW', 15, 22, 'CQ', '1234Z')),
+    (b"DX de VE2WU-#:   14100.0  4U1UN     CW  12 dB  22 WPM  NCDXF B 1234Z",
+     ('VE2WU', '4U1UN', 14100.0, 'CW', 12, 22, 'NCDXF B', '1234Z')),
+    (b"DX de KM3T-#:    14080.0  DL1ABC    RTTY 9 dB  45 BPS  CQ      1234Z",
+     ('KM3T', 'DL1ABC', 14080.0, 'RTTY', 9, None, 'CQ', '1234Z')),
+    (b"DX de K1TTT-#:   14074.0  JA1XYZ    FT8 -12 dB         CQ      1234Z",
+     ('K1TTT', 'JA1XYZ', 14074.0, 'FT8', -12, None, 'CQ', '1234Z')),
+    (b"DX de VE7CC-1-#:14025.0   K6ZX      CW  15 dB  22 WPM  CQ      1234Z",
+     ('VE7CC', 'K6ZX', 14025.0, 'CW', 15, 22, 'CQ', '1234Z')),
+    (b"DX de KM3T-#:    14070.0  W1AW      PSK31 -14 dB 31 BPS CQ     1234Z",
+     ('KM3T', 'W1AW', 14070.0, 'PSK31', -14, None, 'CQ', '1234Z')),
+])
+def testParseSpots(line, expected):
+    parser, spot = parseOne(line)
+
+    assert (spot.de, spot.dx, spot.freq, spot.mode, spot.snr, spot.wpm,
+            spot.type, spot.time) == expected
+    assert (parser.parsed, parser.malformed) == (1, 0)
+
+
+@pytest.mark.parametrize('line', [
+    # mode run into a negative SNR
+    b"DX de KM3T-#:    14070.0  W1AW      PSK31-14 dB 31 BPS CQ      1234Z",
+    # SNR and speed that are not integers
+    b"DX de W3OA-#:    14025.0  K6ZX      CW  1x dB  22 WPM  CQ      1234Z",
+    b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  2.5 WPM CQ      1234Z",
+    b"DX de KM3T-#:    14080.0  DL1ABC    RTTY 9 dB  4x BPS  CQ      1234Z",
+    # units out of place or repeated
+    b"DX de W3OA-#:    14025.0  K6ZX      CW  dB 15  22 WPM  CQ      1234Z",
+    b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  CQ  22 WPM      1234Z",
+    b"DX de W3OA-#:    14025.0  K6ZX      CW  15 dB  22 WPM  14 dB CQ 1234Z",
+    # mode missing
+    b"DX de W3OA-#:    14025.0  K6ZX      15 dB  22 WPM  CQ          1234Z",
+    # frequency and skimmer garbled
+    b"DX de W3OA-#:    14O25.0  K6ZX      CW  15 dB  22 WPM  CQ      1234Z",
+    b"DX de W3OA-#     14025.0  K6ZX      CW  15 dB  22 WPM  CQ      1234Z",
+    b"DX de W3OA-#:    14025.0",
+])
+def testMalformedSpots(line):
+    parser, spot = parseOne(line)
+
+    assert spot is None
+    assert (parser.parsed, parser.malformed) == (0, 1)
+
+
+def testIgnoredLines():
+    parser = SpotParser()
+
+    assert parser.parse(b"Please enter your call:") is None
+    assert parser.parse(b"\r\n") is None
+    assert (parser.parsed, parser.malformed, parser.ignored) == (0, 0, 1)